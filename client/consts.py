@@ -13,6 +13,9 @@ DRES = 8    # data exchange response
 DACK = 9    # data exchange acknowledgement
 DCAN = 10   # data exchange cancellation
 DWAIT = 11  # data exchange wait
+DFRAG = 12  # data exchange fragment
+DSACK = 13  # data exchange selective acknowledgement
+HANN = 14   # host announcement
 FAIL = 0
 
 
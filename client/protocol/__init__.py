@@ -3,7 +3,8 @@
     a single access point based on the mode indicated by the server's 
     PROTOCOL:SEND_TO config parameter (BROADCAST or ORCHESTRATOR).
 
-    The protocol's responder is automatically started upon import.
+    The protocol's responder and the consumer's engine are automatically 
+    started upon import.
 
     Classes:
     --------
@@ -16,10 +17,25 @@
     the protocol's responder, which takes decisions and builds and sends 
     replies to received packets based on the protocol's state.
 
+    Objects:
+    --------
+    engine: Asyncio engine owning a single receive socket and routing 
+    received packets to the coroutines of in-flight requests.
+
+    pool: Bounded pool running the provider's executions (pool.report() 
+    returns its counters, queue depth, and mean and percentile wait times 
+    per CoS).
+
     Methods:
     --------
+    submit(cos_id, data): Coroutine sending a request to host a network 
+    application of Class of Service (CoS) identified by cos_id, with data as 
+    input (run in the engine, so many requests can be in flight from a single 
+    thread).
+
     send_request(cos_id, data): Send a request to host a network application 
-    of Class of Service (CoS) identified by cos_id, with data as input.
+    of Class of Service (CoS) identified by cos_id, with data as input 
+    (blocking wrapper over submit).
 '''
 
 
@@ -40,12 +56,19 @@ from consts import SEND_TO_BROADCAST, SEND_TO_ORCHESTRATOR
 
 
 if PROTO_SEND_TO == SEND_TO_BROADCAST:
-    from .protocol_bcst import send_request, MyProtocol, MyProtocolAM
+    from .protocol_bcst import (send_request, submit, engine, pool,
+                                MyProtocol, MyProtocolAM)
 elif PROTO_SEND_TO == SEND_TO_ORCHESTRATOR:
-    from .protocol_orch import send_request, MyProtocol, MyProtocolAM
+    from .protocol_orch import (send_request, submit, engine, pool,
+                                MyProtocol, MyProtocolAM)
 
 
 if PROTO_SEND_TO in (SEND_TO_BROADCAST, SEND_TO_ORCHESTRATOR):
-    # start the answering machine
+    # the answering machine does not sniff: the engine is the only receiver,
+    # and forwards it the messages it handles (except duplicates, answered
+    # from the reply cache), as well as the large messages it reassembles
     AM = MyProtocolAM(verbose=0)
-    AM(bg=True)
+    engine.forward = AM.forward
+    engine.forward_states = frozenset(AM._handlers)
+    engine.deliver = AM.deliver
+    engine.start()
@@ -0,0 +1,149 @@
+'''
+    Classic BPF filter matching only inbound MyProtocol traffic (IPv4 packets
+    with MyProtocol's IP protocol number, or Ethernet frames with MyProtocol's
+    EtherType), to be attached to receive sockets so that other traffic
+    (e.g. iPerf floods generated by executions) never reaches Python.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Methods:
+    --------
+    compile_filter(ip_proto, ether_type, inbound): Returns list of BPF
+    instructions (code, jt, jf, k).
+
+    attach_filter(sock, ip_proto, ether_type, inbound): Attach compiled filter
+    to (AF_PACKET) socket.
+
+    pcap_filter(ip_proto, ether_type, inbound, exclude): Returns equivalent
+    filter expression in pcap syntax (for Scapy's sniff), optionally
+    excluding some MyProtocol states.
+'''
+
+
+from ctypes import create_string_buffer, addressof
+from struct import pack
+from socket import SOL_SOCKET
+
+
+SO_ATTACH_FILTER = 26
+
+# instruction classes and modes (linux/filter.h)
+BPF_LD = 0x00
+BPF_JMP = 0x05
+BPF_RET = 0x06
+BPF_W = 0x00
+BPF_H = 0x08
+BPF_B = 0x10
+BPF_ABS = 0x20
+BPF_JEQ = 0x10
+BPF_K = 0x00
+
+# ancillary data (packet type)
+SKF_AD_OFF = -0x1000
+SKF_AD_PKTTYPE = 4
+PACKET_OUTGOING = 4
+
+ETH_P_IP = 0x0800
+# offsets in Ethernet frame
+_ETH_TYPE_OFF = 12
+_IP_PROTO_OFF = 23
+
+# accept whole packet
+_ACCEPT = 0x40000
+
+
+def compile_filter(ip_proto: int, ether_type: int = None,
+                   inbound: bool = True):
+    '''
+        Returns list of BPF instructions (code, jt, jf, k) accepting IPv4
+        packets with ip_proto as protocol number, or Ethernet frames with
+        ether_type as type, and dropping everything else. If inbound is True,
+        outgoing packets are dropped as well.
+
+        If ip_proto is None, all (inbound) packets are accepted (equivalent of
+        the 'inbound' pcap filter).
+    '''
+
+    prog = []
+    if inbound:
+        prog += [
+            (BPF_LD | BPF_W | BPF_ABS, 0, 0,
+             (SKF_AD_OFF + SKF_AD_PKTTYPE) & 0xffffffff),
+            # outgoing: jump to drop (offset filled below)
+            (BPF_JMP | BPF_JEQ | BPF_K, None, 0, PACKET_OUTGOING),
+        ]
+    if ip_proto is not None:
+        prog.append((BPF_LD | BPF_H | BPF_ABS, 0, 0, _ETH_TYPE_OFF))
+        if ether_type is not None:
+            # MyProtocol directly over Ethernet: jump to accept
+            prog.append((BPF_JMP | BPF_JEQ | BPF_K, 'accept', 0, ether_type))
+        prog += [
+            (BPF_JMP | BPF_JEQ | BPF_K, 0, 'drop', ETH_P_IP),
+            (BPF_LD | BPF_B | BPF_ABS, 0, 0, _IP_PROTO_OFF),
+            (BPF_JMP | BPF_JEQ | BPF_K, 0, 'drop', ip_proto),
+        ]
+    prog += [
+        # accept
+        (BPF_RET | BPF_K, 0, 0, _ACCEPT),
+        # drop
+        (BPF_RET | BPF_K, 0, 0, 0),
+    ]
+    # resolve jump offsets (relative to next instruction)
+    accept = len(prog) - 2
+    drop = len(prog) - 1
+    labels = {'accept': accept, 'drop': drop, None: drop}
+    resolved = []
+    for i, (code, jt, jf, k) in enumerate(prog):
+        if code == BPF_JMP | BPF_JEQ | BPF_K:
+            if jt in labels:
+                jt = labels[jt] - i - 1
+            if jf in labels:
+                jf = labels[jf] - i - 1
+        resolved.append((code, jt, jf, k))
+    return resolved
+
+
+def attach_filter(sock, ip_proto: int, ether_type: int = None,
+                  inbound: bool = True):
+    '''
+        Attach compiled filter to (AF_PACKET) socket.
+    '''
+
+    prog = compile_filter(ip_proto, ether_type, inbound)
+    insns = create_string_buffer(
+        b''.join(pack('HBBI', *insn) for insn in prog))
+    # struct sock_fprog {unsigned short len; struct sock_filter *filter;}
+    fprog = pack('HL', len(prog), addressof(insns))
+    sock.setsockopt(SOL_SOCKET, SO_ATTACH_FILTER, fprog)
+
+
+def pcap_filter(ip_proto: int, ether_type: int = None,
+                inbound: bool = True, exclude: tuple = ()):
+    '''
+        Returns equivalent filter expression in pcap syntax (for Scapy's
+        sniff).
+
+        MyProtocol packets whose state is in exclude are dropped as well
+        (assuming IP headers without options).
+    '''
+
+    if ip_proto is None:
+        return 'inbound' if inbound else ''
+    # state is the first byte of MyProtocol
+    expr = _all(['ip proto %d' % ip_proto]
+                + ['ip[20] != %d' % state for state in exclude])
+    if ether_type is not None:
+        expr = '(%s or %s)' % (expr, _all(
+            ['ether proto 0x%04x' % ether_type]
+            + ['ether[14] != %d' % state for state in exclude]))
+    if inbound:
+        expr = 'inbound and ' + expr
+    return expr
+
+
+def _all(exprs: list):
+    # (pcap's and/or have the same precedence)
+    if len(exprs) == 1:
+        return exprs[0]
+    return '(%s)' % ' and '.join(exprs)
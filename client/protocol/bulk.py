@@ -0,0 +1,245 @@
+'''
+    Out-of-band bulk data channel for large data exchange requests and
+    responses (DREQ/DRES): instead of the payload itself, the data field only
+    carries a reference (token, port and size), and the receiver fetches the
+    payload from the sender over a side TCP connection, where it is streamed
+    with sendfile (files) or straight from the payload's buffer (bytes,
+    memoryviews), without copies in user space.
+
+    This keeps the protocol's state machine (and its packets) lightweight,
+    whatever the size of inputs and results.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    BulkChannel: TCP server serving payloads offered by this node, and client
+    fetching payloads offered by other nodes.
+'''
+
+
+from os import fstat
+from threading import Thread, Lock
+from socket import create_server, create_connection, SHUT_WR
+from secrets import token_bytes
+from struct import Struct
+from time import time, sleep
+
+from codec import MAX_DATA
+from logger import console, file
+
+
+# data field of a reference: magic + token, port, size
+MAGIC = b'\x00MPBULK\x00'
+_REF = Struct('!16sHQ')
+REF_LEN = len(MAGIC) + _REF.size
+TOKEN_LEN = 16
+# timeout of connections (in seconds)
+TIMEOUT = 10
+
+
+class BulkChannel:
+    '''
+        TCP server serving payloads offered by this node, and client fetching
+        payloads offered by other nodes.
+
+        Attributes:
+        -----------
+        threshold: Min payload size (in bytes) to be sent over the channel.
+        0 disables the channel.
+
+        port: TCP port of the server. Default is 0 (ephemeral, announced in
+        references).
+
+        ttl: Time (in seconds) an offered payload can be fetched for (since it
+        was last offered). Default is 60s. Expired payloads are released on
+        the next offer or fetch, or at the latest half a ttl later.
+
+        stats: Dict of counters: 'sent' and 'received' (bytes moved over the
+        channel), 'offers' and 'fetches' (payloads), and 'failures' (failed
+        fetches).
+
+        Methods:
+        --------
+        wrap(payload): Returns reference to payload (offered over the
+        channel) if large enough, payload itself if not.
+
+        offer(payload): Returns reference to payload (offered over the
+        channel, whatever its size).
+
+        unwrap(data, host): Returns payload fetched from host if data is a
+        reference, data itself if not. Returns None if fetching failed (or
+        the referenced payload is larger than MAX_DATA).
+
+        is_ref(data): Returns True if data is a reference.
+    '''
+
+    def __init__(self, threshold: int, port: int = 0, ttl: float = 60):
+        self.threshold = threshold
+        self.port = port
+        self.ttl = ttl
+        self.stats = {'sent': 0, 'received': 0, 'offers': 0, 'fetches': 0,
+                      'failures': 0}
+        # {token: [payload, size, offered at]}
+        self._offers = {}
+        # {id(payload): token} (same payload offered once)
+        self._tokens = {}
+        self._lock = Lock()
+        self._server = None
+
+    def wrap(self, payload):
+        '''
+            Returns reference to payload (offered over the channel) if large
+            enough, payload itself if not.
+
+            payload can be bytes-like or a file object opened in binary mode
+            (streamed with sendfile).
+        '''
+
+        if hasattr(payload, 'fileno'):
+            size = _file_size(payload)
+        else:
+            size = len(payload)
+        if self.threshold <= 0 or size < self.threshold:
+            return payload
+        return self.offer(payload, size)
+
+    def offer(self, payload, size: int = None):
+        '''
+            Returns reference to payload (offered over the channel, whatever
+            its size).
+        '''
+
+        if size is None:
+            size = (_file_size(payload) if hasattr(payload, 'fileno')
+                    else len(payload))
+        self._start()
+        now = time()
+        with self._lock:
+            self._expire(now)
+            token = self._tokens.get(id(payload), None)
+            if token:
+                self._offers[token][2] = now
+            else:
+                token = token_bytes(TOKEN_LEN)
+                self._offers[token] = [payload, size, now]
+                self._tokens[id(payload)] = token
+                self.stats['offers'] += 1
+        return MAGIC + _REF.pack(token, self.port, size)
+
+    def is_ref(self, data):
+        '''
+            Returns True if data is a reference.
+        '''
+
+        return len(data) == REF_LEN and data[:len(MAGIC)] == MAGIC
+
+    def unwrap(self, data, host: str):
+        '''
+            Returns payload fetched from host if data is a reference, data
+            itself if not.
+
+            Returns None if fetching failed (or the referenced payload is
+            larger than MAX_DATA).
+        '''
+
+        if not self.is_ref(data):
+            return data
+        with self._lock:
+            self._expire(time())
+        token, port, size = _REF.unpack_from(data, len(MAGIC))
+        got = 0
+        try:
+            # (size is announced by the peer, so it is bounded before being
+            # allocated)
+            if size > MAX_DATA:
+                raise ValueError('payload of %d bytes' % size)
+            buf = bytearray(size)
+            view = memoryview(buf)
+            with create_connection((host, port), TIMEOUT) as sock:
+                sock.sendall(token)
+                while got < size:
+                    n = sock.recv_into(view[got:])
+                    if not n:
+                        break
+                    got += n
+        except Exception as e:
+            console.error('Fetching data over bulk channel from %s failed '
+                          'due to %s', host, e.__class__.__name__)
+            file.exception('Fetching data over bulk channel from %s failed',
+                           host)
+        with self._lock:
+            self.stats['received'] += got
+            if got < size:
+                self.stats['failures'] += 1
+                return None
+            self.stats['fetches'] += 1
+        console.info('Recv %d bytes over bulk channel from %s', size, host)
+        return bytes(buf)
+
+    def _start(self):
+        if self._server:
+            return
+        with self._lock:
+            if self._server:
+                return
+            self._server = create_server(('', self.port))
+            self.port = self._server.getsockname()[1]
+            Thread(target=self._serve, daemon=True).start()
+            Thread(target=self._sweep, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                sock, _ = self._server.accept()
+            except OSError:
+                file.exception('Bulk channel failed to accept connection')
+                continue
+            Thread(target=self._send, args=(sock,), daemon=True).start()
+
+    def _send(self, sock):
+        with sock:
+            try:
+                sock.settimeout(TIMEOUT)
+                token = b''
+                while len(token) < TOKEN_LEN:
+                    chunk = sock.recv(TOKEN_LEN - len(token))
+                    if not chunk:
+                        return
+                    token += chunk
+                with self._lock:
+                    offer = self._offers.get(token, None)
+                if not offer:
+                    return
+                payload, size, _ = offer
+                if hasattr(payload, 'fileno'):
+                    # zero-copy (os.sendfile)
+                    sent = sock.sendfile(payload, 0, size)
+                else:
+                    sock.sendall(memoryview(payload))
+                    sent = size
+                sock.shutdown(SHUT_WR)
+                with self._lock:
+                    self.stats['sent'] += sent
+                console.info('Sent %d bytes over bulk channel', sent)
+            except Exception:
+                file.exception('Bulk channel failed to send data')
+
+    def _sweep(self):
+        # release expired payloads nobody fetched, even if nothing else is
+        # offered or fetched
+        while True:
+            sleep(max(self.ttl / 2, 1))
+            with self._lock:
+                self._expire(time())
+
+    def _expire(self, now: float):
+        for token, (payload, _, offered_at) in list(self._offers.items()):
+            if now - offered_at > self.ttl:
+                del self._offers[token]
+                self._tokens.pop(id(payload), None)
+
+
+def _file_size(f):
+    return fstat(f.fileno()).st_size
@@ -0,0 +1,202 @@
+'''
+    Content-addressed store of the inputs received by the provider, so that
+    inputs sent over and over (programs, models, etc.) are only transferred
+    once.
+
+    Instead of the input, the data field of a data exchange request (DREQ)
+    carries its digest, along with a bulk channel reference to it. If the
+    provider already holds the input (whoever sent it), it is read from the
+    store (memory-mapped). If not, it is fetched from the consumer over the
+    bulk channel, then stored.
+
+    The store is a directory of files named after the digests of their
+    contents, whose least recently used files are removed when it exceeds
+    its capacity.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    ContentStore: On-disk LRU store of inputs, addressed by digest.
+'''
+
+
+from os import makedirs, listdir, replace, remove, stat
+from os.path import join
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from mmap import mmap, ACCESS_READ
+
+from bulk import BulkChannel
+from logger import console, file
+
+
+# data field of a reference: magic + digest + bulk channel reference
+MAGIC = b'\x00MPCAS\x00\x00'
+DIGEST_LEN = 32
+
+
+class ContentStore:
+    '''
+        On-disk LRU store of inputs, addressed by digest.
+
+        Attributes:
+        -----------
+        path: Directory of the store.
+
+        capacity: Max total size (in bytes) of stored inputs.
+
+        threshold: Min input size (in bytes) to be sent as a reference. 0
+        disables references (inputs are sent as before).
+
+        bulk: BulkChannel inputs are offered over (consumer) or fetched over
+        (provider).
+
+        stats: Dict of counters: 'hits' and 'misses' (references received),
+        'evictions' (inputs removed from store), and 'saved' (dict of bytes
+        not transferred thanks to the store, keys are CoS IDs).
+
+        Methods:
+        --------
+        wrap(data): Returns reference to data if large enough, data itself
+        (or its bulk channel reference) if not.
+
+        is_ref(data): Returns True if data is a reference.
+
+        unwrap(data, host, cos_id): Returns input referenced by data (read
+        from store, or fetched from host), data itself (or the payload of its
+        bulk channel reference) if not a reference. Returns None if fetching
+        failed.
+    '''
+
+    def __init__(self, path: str, capacity: int, threshold: int,
+                 bulk: BulkChannel):
+        self.path = path
+        self.capacity = capacity
+        self.threshold = threshold
+        self.bulk = bulk
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'saved': {}}
+        # {digest: size} (in order of use)
+        self._entries = None
+        self._size = 0
+        self._lock = Lock()
+
+    def wrap(self, data):
+        '''
+            Returns reference to data if large enough, data itself (or its
+            bulk channel reference) if not.
+        '''
+
+        if self.threshold <= 0 or len(data) < self.threshold:
+            return self.bulk.wrap(data)
+        return (MAGIC + _digest(data)
+                + self.bulk.offer(data, len(data)))
+
+    def is_ref(self, data):
+        '''
+            Returns True if data is a reference.
+        '''
+
+        return data[:len(MAGIC)] == MAGIC
+
+    def unwrap(self, data, host: str, cos_id: int = None):
+        '''
+            Returns input referenced by data (read from store, or fetched from
+            host), data itself (or the payload of its bulk channel reference)
+            if not a reference.
+
+            Returns None if fetching failed.
+        '''
+
+        if not self.is_ref(data):
+            return self.bulk.unwrap(data, host)
+        start = len(MAGIC)
+        digest = bytes(data[start:start + DIGEST_LEN])
+        ref = bytes(data[start + DIGEST_LEN:])
+        content = self._get(digest)
+        if content is not None:
+            with self._lock:
+                self.stats['hits'] += 1
+                saved = self.stats['saved']
+                saved[cos_id] = saved.get(cos_id, 0) + len(content)
+            console.info('Input found in content store')
+            return content
+        with self._lock:
+            self.stats['misses'] += 1
+        content = self.bulk.unwrap(ref, host)
+        if content is None:
+            return None
+        if _digest(content) != digest:
+            console.error('Input fetched from %s does not match its digest',
+                          host)
+            return None
+        self._put(digest, content)
+        return content
+
+    def _get(self, digest: bytes):
+        with self._lock:
+            self._load()
+            if digest not in self._entries:
+                return None
+            self._entries.move_to_end(digest)
+        try:
+            with open(join(self.path, digest.hex()), 'rb') as f:
+                # (the mapping outlives the file object, and even the file
+                # if evicted meanwhile)
+                return memoryview(mmap(f.fileno(), 0, access=ACCESS_READ))
+        except (OSError, ValueError):
+            file.exception('Content store failed to read input')
+            with self._lock:
+                self._size -= self._entries.pop(digest, 0)
+            return None
+
+    def _put(self, digest: bytes, content):
+        size = len(content)
+        if size > self.capacity:
+            return
+        name = join(self.path, digest.hex())
+        try:
+            with open(name + '.tmp', 'wb') as f:
+                f.write(content)
+            replace(name + '.tmp', name)
+        except OSError:
+            file.exception('Content store failed to write input')
+            return
+        with self._lock:
+            self._load()
+            if digest in self._entries:
+                self._size -= self._entries[digest]
+            self._entries[digest] = size
+            self._size += size
+            while self._size > self.capacity:
+                old, old_size = self._entries.popitem(last=False)
+                self._size -= old_size
+                self.stats['evictions'] += 1
+                try:
+                    remove(join(self.path, old.hex()))
+                except OSError:
+                    pass
+
+    def _load(self):
+        # index of files already in store (least recently modified first)
+        if self._entries is not None:
+            return
+        self._entries = OrderedDict()
+        try:
+            makedirs(self.path, exist_ok=True)
+            files = []
+            for name in listdir(self.path):
+                if len(name) == 2 * DIGEST_LEN:
+                    st = stat(join(self.path, name))
+                    files.append((st.st_mtime, name, st.st_size))
+            for _, name, size in sorted(files):
+                self._entries[bytes.fromhex(name)] = size
+                self._size += size
+        except (OSError, ValueError):
+            file.exception('Content store failed to load')
+
+
+def _digest(data):
+    return blake2b(data, digest_size=DIGEST_LEN).digest()
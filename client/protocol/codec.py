@@ -0,0 +1,388 @@
+'''
+    Hand-written codec for MyProtocol, based on struct.pack_into and
+    struct.unpack_from over preallocated buffers, to be used on the hot path
+    instead of full Scapy dissection and building.
+
+    It is wire-compatible with the fields_desc of MyProtocol in both BROADCAST
+    (BCST) and ORCHESTRATOR (ORCH) modes, and can also decode and encode the
+    Ethernet and IPv4 headers carrying it.
+
+    Unlike the rest of the protocol package, this module does not rely on the
+    configuration received from the server, so it can be imported anywhere
+    (benchmarks, tests, etc.).
+
+    Classes:
+    --------
+    Message: MyProtocol message, with the same field names as MyProtocol
+    (plus the source and destination IP addresses of the carrying packet).
+
+    Codec: Encoder and decoder of MyProtocol messages for a given mode.
+'''
+
+
+from struct import Struct, error as StructError
+from socket import inet_aton, inet_ntoa
+
+from consts import (HREQ, HRES, RREQ, RRES, RACK, RCAN, DREQ, DRES, DACK,
+                    DCAN, DFRAG, DSACK, HANN, REQ_ID_LEN, MAC_LEN, IP_LEN,
+                    SEND_TO_BROADCAST, SEND_TO_ORCHESTRATOR)
+
+
+ETH_HLEN = 14
+IP_HLEN = 20
+ETH_P_IP = 0x0800
+ETH_P_8021Q = 0x8100
+MAX_FRAME = 65535
+# max size of data carried by a message (reassembled from fragments, or
+# fetched over the bulk channel), in bytes
+MAX_DATA = 1 << 26
+
+# state, req_id, attempt_no
+_HEADER = Struct('!B%dsI' % REQ_ID_LEN)
+_COS = Struct('!I')
+# time left before the request's deadline (in ms, negative if passed)
+_DEADLINE = Struct('!i')
+# kind, seq, frag_size, total
+_FRAG = Struct('!BIHI')
+# kind, seq, bitmap
+_SACK = Struct('!BIQ')
+# cpu_offer, ram_offer, disk_offer
+_OFFERS = Struct('!ddd')
+# queue (length of execution queue)
+_QUEUE = Struct('!H')
+# src_mac, src_ip (or host_mac, host_ip)
+_ADDR = Struct('!%ds%ds' % (MAC_LEN, IP_LEN))
+# dst, src, type
+_ETH = Struct('!6s6sH')
+# version/ihl, tos, len, id, flags/frag, ttl, proto, checksum, src, dst
+_IP = Struct('!BBHHHBBH4s4s')
+_IP_WORDS = Struct('!10H')
+_U16 = Struct('!H')
+
+
+class Message:
+    '''
+        MyProtocol message, with the same field names as MyProtocol (plus the
+        source and destination IP addresses of the carrying packet, and the
+        time it was received at, if set by the receiver).
+
+        Contrary to MyProtocol, req_id, src_mac, src_ip, host_mac and host_ip
+        are (stripped) strings, not bytes. The data of a decoded DFRAG is a
+        view into the decoded buffer (only valid until the buffer is reused).
+    '''
+
+    __slots__ = ('state', 'req_id', 'attempt_no', 'cos_id', 'deadline',
+                 'kind', 'seq', 'frag_size', 'total', 'bitmap', 'data',
+                 'cpu_offer', 'ram_offer', 'disk_offer', 'queue', 'src_mac',
+                 'src_ip', 'host_mac', 'host_ip', 'src', 'dst', 'timestamp')
+
+    def __init__(self, state: int = HREQ, req_id: str = '',
+                 attempt_no: int = 1, cos_id: int = 1, data: bytes = b'',
+                 cpu_offer: float = 0.0, ram_offer: float = 0.0,
+                 disk_offer: float = 0.0, src_mac: str = '', src_ip: str = '',
+                 host_mac: str = '', host_ip: str = '', src: str = None,
+                 dst: str = None, timestamp: float = None, kind: int = DREQ,
+                 seq: int = 0, frag_size: int = 0, total: int = 0,
+                 bitmap: int = 0, deadline: int = 0, queue: int = 0):
+        self.state = state
+        self.req_id = req_id
+        self.attempt_no = attempt_no
+        self.cos_id = cos_id
+        self.deadline = deadline
+        self.kind = kind
+        self.seq = seq
+        self.frag_size = frag_size
+        self.total = total
+        self.bitmap = bitmap
+        self.data = data
+        self.cpu_offer = cpu_offer
+        self.ram_offer = ram_offer
+        self.disk_offer = disk_offer
+        self.queue = queue
+        self.src_mac = src_mac
+        self.src_ip = src_ip
+        self.host_mac = host_mac
+        self.host_ip = host_ip
+        self.src = src
+        self.dst = dst
+        self.timestamp = timestamp
+
+    def __repr__(self):
+        return ('message(state=%s, req_id=%s, attempt_no=%s, src=%s, '
+                'dst=%s)' % (self.state, self.req_id, self.attempt_no,
+                             self.src, self.dst))
+
+    def show(self):
+        '''
+            Print all fields (like Scapy's Packet.show()).
+        '''
+
+        print()
+        print('###[ MyProtocol ]###')
+        for name in self.__slots__:
+            print('  %-10s= %r' % (name, getattr(self, name)))
+
+
+class Codec:
+    '''
+        Encoder and decoder of MyProtocol messages for a given mode
+        (SEND_TO_BROADCAST or SEND_TO_ORCHESTRATOR).
+
+        Encoding methods write into a buffer given by the caller (typically
+        preallocated once and reused), so nothing is allocated but the
+        returned length. Decoding methods read from any bytes-like object
+        (typically a memoryview over a preallocated receive buffer), and only
+        allocate the decoded Message and its field values.
+
+        Attributes:
+        -----------
+        mode: SEND_TO_BROADCAST or SEND_TO_ORCHESTRATOR.
+
+        ip_proto: IP protocol number carrying MyProtocol. Default is 0 (as in
+        packets built by Scapy with bind_layers(IP, MyProtocol)).
+
+        ether_type: EtherType of MyProtocol frames sent directly over
+        Ethernet (decoded with src and dst set to None). Default is None (not
+        decoded).
+
+        Methods:
+        --------
+        size(msg): Returns the length of the encoded MyProtocol message.
+
+        encode_into(buf, offset, msg): Write MyProtocol message into buf at
+        offset. Returns the number of bytes written.
+
+        encode_frame_into(buf, msg, src, dst, src_mac, dst_mac): Write
+        (Ethernet if MACs given +) IPv4 + MyProtocol into buf. Returns the
+        number of bytes written.
+
+        decode(buf, offset, end): Returns Message decoded from buf[offset:end],
+        None if malformed.
+
+        decode_frame(frame, length): Returns Message decoded from Ethernet
+        frame (with src and dst set), None if not a MyProtocol packet.
+    '''
+
+    def __init__(self, mode: str = SEND_TO_BROADCAST, ip_proto: int = 0,
+                 ether_type: int = None):
+        self.mode = mode
+        self.ip_proto = ip_proto
+        self.ether_type = ether_type
+        # conditional fields (same conditions as MyProtocol's fields_desc)
+        self._frag_states = frozenset((DFRAG,))
+        self._sack_states = frozenset((DSACK,))
+        self._data_states = frozenset((DREQ, DRES, DFRAG))
+        if mode == SEND_TO_ORCHESTRATOR:
+            self._cos_states = frozenset((HREQ, RREQ))
+            # (reservation requests are relayed by the orchestrator, so they
+            # keep its wire format)
+            self._deadline_states = frozenset((HREQ, DREQ))
+            self._offer_states = frozenset()
+            self._queue_states = frozenset()
+            self._src_states = frozenset((RREQ, RRES, RACK, RCAN, DACK, DCAN))
+            self._host_states = frozenset((HRES, DCAN, DACK))
+        else:
+            self._cos_states = frozenset((HREQ, RREQ))
+            self._deadline_states = frozenset((HREQ, RREQ, DREQ))
+            # (resource reservation requests may piggyback input data)
+            self._data_states = frozenset((DREQ, DRES, DFRAG, RREQ))
+            self._offer_states = frozenset((HRES, HANN))
+            self._queue_states = frozenset((HANN,))
+            self._src_states = frozenset()
+            self._host_states = frozenset()
+
+    def size(self, msg: Message):
+        '''
+            Returns the length of the encoded MyProtocol message.
+        '''
+
+        state = msg.state
+        size = _HEADER.size
+        if state in self._cos_states:
+            size += _COS.size
+        if state in self._deadline_states:
+            size += _DEADLINE.size
+        if state in self._frag_states:
+            size += _FRAG.size
+        if state in self._sack_states:
+            size += _SACK.size
+        if state in self._data_states:
+            size += len(msg.data)
+        if state in self._offer_states:
+            size += _OFFERS.size
+        if state in self._queue_states:
+            size += _QUEUE.size
+        if state in self._src_states:
+            size += _ADDR.size
+        if state in self._host_states:
+            size += _ADDR.size
+        return size
+
+    def encode_into(self, buf, offset: int, msg: Message):
+        '''
+            Write MyProtocol message into buf at offset.
+
+            Returns the number of bytes written.
+        '''
+
+        state = msg.state
+        start = offset
+        _HEADER.pack_into(buf, offset, state, msg.req_id.encode(),
+                          msg.attempt_no)
+        offset += _HEADER.size
+        if state in self._cos_states:
+            _COS.pack_into(buf, offset, msg.cos_id)
+            offset += _COS.size
+        if state in self._deadline_states:
+            _DEADLINE.pack_into(buf, offset, msg.deadline)
+            offset += _DEADLINE.size
+        if state in self._frag_states:
+            _FRAG.pack_into(buf, offset, msg.kind, msg.seq, msg.frag_size,
+                            msg.total)
+            offset += _FRAG.size
+        if state in self._sack_states:
+            _SACK.pack_into(buf, offset, msg.kind, msg.seq, msg.bitmap)
+            offset += _SACK.size
+        if state in self._data_states:
+            end = offset + len(msg.data)
+            buf[offset:end] = msg.data
+            offset = end
+        if state in self._offer_states:
+            _OFFERS.pack_into(buf, offset, msg.cpu_offer, msg.ram_offer,
+                              msg.disk_offer)
+            offset += _OFFERS.size
+        if state in self._queue_states:
+            _QUEUE.pack_into(buf, offset, min(msg.queue, 0xffff))
+            offset += _QUEUE.size
+        if state in self._src_states:
+            _ADDR.pack_into(buf, offset,
+                            msg.src_mac.ljust(MAC_LEN, ' ').encode(),
+                            msg.src_ip.ljust(IP_LEN, ' ').encode())
+            offset += _ADDR.size
+        if state in self._host_states:
+            _ADDR.pack_into(buf, offset,
+                            msg.host_mac.ljust(MAC_LEN, ' ').encode(),
+                            msg.host_ip.ljust(IP_LEN, ' ').encode())
+            offset += _ADDR.size
+        return offset - start
+
+    def encode_frame_into(self, buf, msg: Message, src: str, dst: str,
+                          src_mac: str = None, dst_mac: str = None):
+        '''
+            Write (Ethernet if MACs given +) IPv4 + MyProtocol into buf.
+
+            Returns the number of bytes written.
+        '''
+
+        offset = 0
+        if dst_mac:
+            _ETH.pack_into(buf, 0, _mac_to_bytes(dst_mac),
+                           _mac_to_bytes(src_mac), ETH_P_IP)
+            offset = ETH_HLEN
+        length = self.encode_into(buf, offset + IP_HLEN, msg)
+        total = IP_HLEN + length
+        # same defaults as Scapy (id=1, ttl=64)
+        _IP.pack_into(buf, offset, 0x45, 0, total, 1, 0, 64, self.ip_proto, 0,
+                      inet_aton(src), inet_aton(dst))
+        _U16.pack_into(buf, offset + 10,
+                       _checksum(_IP_WORDS.unpack_from(buf, offset)))
+        return offset + total
+
+    def decode(self, buf, offset: int = 0, end: int = None):
+        '''
+            Returns Message decoded from buf[offset:end], None if malformed.
+        '''
+
+        if end is None:
+            end = len(buf)
+        try:
+            state, req_id, attempt_no = _HEADER.unpack_from(buf, offset)
+            offset += _HEADER.size
+            msg = Message(state, req_id.decode(), attempt_no)
+            if state in self._cos_states:
+                msg.cos_id, = _COS.unpack_from(buf, offset)
+                offset += _COS.size
+            if state in self._deadline_states:
+                msg.deadline, = _DEADLINE.unpack_from(buf, offset)
+                offset += _DEADLINE.size
+            if state in self._frag_states:
+                (msg.kind, msg.seq, msg.frag_size,
+                 msg.total) = _FRAG.unpack_from(buf, offset)
+                offset += _FRAG.size
+                # fragment is copied once, by the receiver, where it belongs
+                msg.data = buf[offset:end]
+                offset = end
+            if state in self._sack_states:
+                msg.kind, msg.seq, msg.bitmap = _SACK.unpack_from(buf, offset)
+                offset += _SACK.size
+            if state in self._data_states and state not in self._frag_states:
+                # data is the rest of the packet
+                msg.data = bytes(buf[offset:end])
+                offset = end
+            if state in self._offer_states:
+                (msg.cpu_offer, msg.ram_offer,
+                 msg.disk_offer) = _OFFERS.unpack_from(buf, offset)
+                offset += _OFFERS.size
+            if state in self._queue_states:
+                msg.queue, = _QUEUE.unpack_from(buf, offset)
+                offset += _QUEUE.size
+            if state in self._src_states:
+                mac, ip = _ADDR.unpack_from(buf, offset)
+                msg.src_mac = mac.decode().strip()
+                msg.src_ip = ip.decode().strip()
+                offset += _ADDR.size
+            if state in self._host_states:
+                mac, ip = _ADDR.unpack_from(buf, offset)
+                msg.host_mac = mac.decode().strip()
+                msg.host_ip = ip.decode().strip()
+                offset += _ADDR.size
+        except (StructError, UnicodeDecodeError):
+            return None
+        if offset > end:
+            return None
+        return msg
+
+    def decode_frame(self, frame, length: int = None):
+        '''
+            Returns Message decoded from Ethernet frame (with src and dst set),
+            None if not a MyProtocol packet.
+        '''
+
+        if length is None:
+            length = len(frame)
+        offset = ETH_HLEN
+        if length < offset + IP_HLEN:
+            return None
+        eth_type, = _U16.unpack_from(frame, 12)
+        if eth_type == ETH_P_8021Q:
+            eth_type, = _U16.unpack_from(frame, 16)
+            offset += 4
+        if eth_type == self.ether_type:
+            return self.decode(frame, offset, length)
+        if eth_type != ETH_P_IP:
+            return None
+        try:
+            (ver_ihl, _, total, _, _, _, proto, _, src,
+             dst) = _IP.unpack_from(frame, offset)
+        except StructError:
+            return None
+        if ver_ihl >> 4 != 4 or proto != self.ip_proto:
+            return None
+        # IP total length excludes Ethernet padding
+        end = min(offset + total, length)
+        msg = self.decode(frame, offset + (ver_ihl & 0x0f) * 4, end)
+        if msg:
+            msg.src = inet_ntoa(src)
+            msg.dst = inet_ntoa(dst)
+        return msg
+
+
+def _mac_to_bytes(mac: str):
+    return bytes.fromhex(mac.replace(':', ''))
+
+
+def _checksum(words: tuple):
+    s = sum(words)
+    s = (s >> 16) + (s & 0xffff)
+    s += s >> 16
+    return ~s & 0xffff
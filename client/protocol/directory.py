@@ -0,0 +1,127 @@
+'''
+    Local directory of the capacity providers announce (HANN) periodically
+    on the segment, so that consumers can send their resource reservation
+    request (RREQ) straight to a host with enough capacity, without
+    broadcasting a host request (HREQ) for every request.
+
+    Each announcement is a compact digest of the provider's free CPU, RAM
+    and disk, and of the length of its execution queue. Only the latest one
+    of each provider is kept, and it is ignored once older than ttl (the
+    provider stopped announcing, or left).
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    Directory: Consumer-side directory of provider announcements, with
+    staleness tracking.
+'''
+
+
+from threading import Lock
+from time import time
+
+from model import CoS
+from codec import Message
+
+
+class Directory:
+    '''
+        Consumer-side directory of provider announcements (HANN messages,
+        with timestamp set), keyed by provider IP address.
+
+        Attributes:
+        -----------
+        ttl: Time (in seconds) an announcement is used for. 0 disables the
+        directory.
+
+        stats: Dict of counters: 'announcements' (received), 'hits' (host
+        found), 'misses' (no fresh host with enough capacity), 'stale'
+        (announcements dropped because of their age) and 'invalidations'.
+
+        Methods:
+        --------
+        update(msg): Keep announcement (replacing the host's previous one).
+
+        get(cos, exclude): Returns the IP address of the host with the
+        shortest queue (then the most free CPU) among those whose last
+        announcement is fresh and satisfies the minimums of CoS, None if
+        none.
+
+        invalidate(host): Remove host's announcement (until its next one).
+
+        hosts(): Returns list of IP addresses of hosts with a fresh
+        announcement.
+    '''
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self.stats = {'announcements': 0, 'hits': 0, 'misses': 0,
+                      'stale': 0, 'invalidations': 0}
+        # {host: announcement}
+        self._hosts = {}
+        self._lock = Lock()
+
+    def update(self, msg: Message):
+        '''
+            Keep announcement (replacing the host's previous one).
+        '''
+
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self.stats['announcements'] += 1
+            self._hosts[msg.src] = msg
+
+    def get(self, cos: CoS, exclude=()):
+        '''
+            Returns the IP address of the host with the shortest queue (then
+            the most free CPU) among those whose last announcement is fresh
+            and satisfies the minimums of CoS (hosts in exclude left out),
+            None if none.
+        '''
+
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            self._expire()
+            best = None
+            for host, msg in self._hosts.items():
+                if (host in exclude or msg.cpu_offer < cos.get_min_cpu()
+                        or msg.ram_offer < cos.get_min_ram()
+                        or msg.disk_offer < cos.get_min_disk()):
+                    continue
+                if not best or ((msg.queue, -msg.cpu_offer)
+                                < (best.queue, -best.cpu_offer)):
+                    best = msg
+            if not best:
+                self.stats['misses'] += 1
+                return None
+            self.stats['hits'] += 1
+            return best.src
+
+    def invalidate(self, host: str):
+        '''
+            Remove host's announcement (until its next one).
+        '''
+
+        with self._lock:
+            if self._hosts.pop(host, None):
+                self.stats['invalidations'] += 1
+
+    def hosts(self):
+        '''
+            Returns list of IP addresses of hosts with a fresh announcement.
+        '''
+
+        with self._lock:
+            self._expire()
+            return list(self._hosts)
+
+    def _expire(self):
+        expired = time() - self.ttl
+        for host in [host for host, msg in self._hosts.items()
+                     if msg.timestamp < expired]:
+            del self._hosts[host]
+            self.stats['stale'] += 1
@@ -0,0 +1,99 @@
+'''
+    Parallel dispatcher of the packets received by the protocol's responder:
+    a small pool of worker threads, each with its own queue, packets being
+    assigned to a worker by hash of their request ID. Packets of different
+    requests are processed in parallel (while one waits on a resource check,
+    a send or a log write, others go on), and packets of the same request
+    are always processed by the same worker, in order of arrival, so they
+    never race each other.
+
+    The capture thread only queues packets, so it keeps reading the socket
+    while replies are being made.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    Dispatcher: Worker threads processing tasks in parallel across keys, and
+    in order for the same key.
+'''
+
+
+from threading import Thread, Condition
+from collections import deque
+
+from logger import file
+
+
+class Dispatcher:
+    '''
+        Worker threads processing tasks in parallel across keys, and in
+        order for the same key (tasks of a key always go to the same
+        worker).
+
+        Attributes:
+        -----------
+        workers: Number of worker threads.
+
+        size: Max number of tasks waiting per worker (tasks beyond are
+        dropped, like packets of a full ring). 0 is unbounded. Default is 0.
+
+        stats: Dict of counters: 'dispatched' and 'dropped'.
+
+        Methods:
+        --------
+        submit(key, target, *args): Queue call of target with args on the
+        worker of key. Returns True if queued, False if dropped.
+
+        depth(): Returns number of tasks waiting (all workers).
+    '''
+
+    def __init__(self, workers: int, size: int = 0):
+        self.workers = workers
+        self.size = size
+        self.stats = {'dispatched': 0, 'dropped': 0}
+        self._queues = [deque() for _ in range(workers)]
+        self._conds = [Condition() for _ in range(workers)]
+        for i in range(workers):
+            Thread(target=self._work, args=(i,), daemon=True).start()
+
+    def submit(self, key, target, *args):
+        '''
+            Queue call of target with args on the worker of key (hashable,
+            e.g. request ID).
+
+            Returns True if queued, False if dropped (queue of worker is
+            full).
+        '''
+
+        i = hash(key) % self.workers
+        queue = self._queues[i]
+        with self._conds[i]:
+            if self.size and len(queue) >= self.size:
+                self.stats['dropped'] += 1
+                return False
+            queue.append((target, args))
+            self.stats['dispatched'] += 1
+            self._conds[i].notify()
+        return True
+
+    def depth(self):
+        '''
+            Returns number of tasks waiting (all workers).
+        '''
+
+        return sum(len(queue) for queue in self._queues)
+
+    def _work(self, i: int):
+        queue = self._queues[i]
+        cond = self._conds[i]
+        while True:
+            with cond:
+                while not queue:
+                    cond.wait()
+                target, args = queue.popleft()
+            try:
+                target(*args)
+            except Exception:
+                file.exception('Dispatched task failed')
@@ -0,0 +1,790 @@
+'''
+    Asyncio engine used by the consumer side of the protocol, allowing a large
+    number of requests to be in flight from a single thread, and sharing a
+    single receive socket between them (instead of one sniffer per request).
+
+    The receive socket has a BPF filter attached, so only inbound MyProtocol
+    traffic reaches Python. Incoming MyProtocol packets are decoded with the
+    hand-written codec (no Scapy dissection), and routed by (request ID,
+    attempt number, state) to the coroutines that are awaiting them. Outgoing
+    messages are encoded with the same codec into a preallocated buffer and
+    sent on raw sockets.
+
+    Data exchange requests and responses (DREQ/DRES) larger than a packet are
+    transferred as fragments (DFRAG) with a sliding send window and selective
+    acknowledgements (DSACK), and reassembled by the receiver's engine into a
+    buffer preallocated from the announced total size (the number of
+    concurrent reassemblies being bounded per source and overall, so forged
+    fragments can not exhaust memory). Reassembled messages
+    are routed like any other, and also handed to the deliver callback (the
+    protocol's responder), as if they were received in a single packet.
+
+    Duplicates of request messages the provider already answered (consumer
+    retries) are answered again from the reply cache, if set, as soon as
+    they are decoded. The engine is the only receiver: other messages of the
+    states the protocol's responder handles are forwarded to it as frames,
+    so duplicates are never dissected by Scapy nor dispatched to it.
+
+    All timeouts (of the consumer's exchanges, and of the provider's
+    retransmissions, reservation leases and acknowledgement waits) are driven
+    by a single hierarchical timer wheel, advanced by the event loop only
+    when a timer may be due.
+
+    Classes:
+    --------
+    Engine: Event loop running in a background thread, owning the receive
+    socket and the send sockets, and routing received packets to awaiting
+    coroutines.
+'''
+
+
+# !!IMPORTANT!!
+# This module relies on config that is only present AFTER the connect()
+# method is called, so only import after
+
+
+from asyncio import new_event_loop, set_event_loop, run_coroutine_threadsafe
+from threading import Thread, Event
+from time import time, thread_time
+from socket import (socket, htons, AF_PACKET, AF_INET, SOCK_RAW, IPPROTO_RAW,
+                    SOL_SOCKET, SO_BROADCAST)
+from psutil import net_if_addrs
+
+from codec import Codec, Message, MAX_FRAME, MAX_DATA
+from bpf import attach_filter
+from rtt import RttEstimator
+from timers import TimerWheel
+from network import MY_IFACE, MY_IP
+from logger import console, file
+from consts import DEFAULT_IP, DREQ, DRES, DFRAG, DSACK
+
+
+ETH_P_ALL = 0x0003
+PACKET_OUTGOING = 4
+SO_BINDTODEVICE = 25
+# max packets read per wake-up of the receive socket
+RECV_BATCH = 64
+# answers whose delay includes an execution (not only a round trip), so they
+# are not used as RTT samples
+_UNTIMED = frozenset((DRES,))
+# max number of messages being reassembled, from a single source and
+# overall (buffers are preallocated from the size announced by the sender,
+# so this bounds the memory peers can make the engine allocate)
+MAX_REASSEMBLIES_PER_SOURCE = 4
+MAX_REASSEMBLIES = 64
+# fragments received between selective acknowledgements
+ACK_EVERY = 8
+# idle time after which a reassembly is dropped (in seconds)
+REASSEMBLY_TIMEOUT = 10
+# time a reassembled message is kept, to acknowledge and deliver it again if
+# its transfer is retried (in seconds)
+REASSEMBLY_LINGER = 30
+# resolution of timeouts (in seconds)
+TIMER_TICK = 0.001
+
+
+class _Waiter:
+    '''
+        Future awaiting one packet among a set of (request ID, attempt number,
+        state) keys, optionally coming from a given source IP.
+
+        If messages is a list, all matching packets are appended to it (the
+        future is still resolved with the first one).
+    '''
+
+    __slots__ = ('future', 'keys', 'src', 'messages')
+
+    def __init__(self, future, keys: tuple, src: str = None,
+                 messages: list = None):
+        self.future = future
+        self.keys = keys
+        self.src = src
+        self.messages = messages
+
+
+class _Reassembly:
+    '''
+        Reassembly buffer of a fragmented message, preallocated from the
+        announced total size.
+    '''
+
+    __slots__ = ('buf', 'frag_size', 'count', 'flags', 'received', 'base',
+                 'last')
+
+    def __init__(self, total: int, frag_size: int):
+        self.buf = bytearray(total)
+        self.frag_size = frag_size
+        self.count = -(-total // frag_size)
+        self.flags = bytearray(self.count)
+        self.received = 0
+        # first missing fragment
+        self.base = 0
+        self.last = time()
+
+    def add(self, seq: int, data):
+        # returns True if new fragment, False if duplicate or invalid
+        if seq >= self.count or self.flags[seq]:
+            return False
+        offset = seq * self.frag_size
+        end = offset + len(data)
+        if end > len(self.buf):
+            return False
+        self.buf[offset:end] = data
+        self.flags[seq] = 1
+        self.received += 1
+        while self.base < self.count and self.flags[self.base]:
+            self.base += 1
+        return True
+
+    def bitmap(self):
+        # fragments received among the 64 following base
+        bitmap = 0
+        end = min(self.base + 65, self.count)
+        for i, flag in enumerate(self.flags[self.base + 1:end]):
+            if flag:
+                bitmap |= 1 << i
+        return bitmap
+
+
+class Engine:
+    '''
+        Event loop running in a background thread, owning the receive socket
+        and the send sockets, and routing received packets to awaiting
+        coroutines.
+
+        Attributes:
+        -----------
+        codec: Codec object of the protocol's mode.
+
+        rtt: RttEstimator object (per peer IP) computing the timeouts of
+        exchanges, fed from the exchanges answered on their first try.
+
+        frag_size: Max data size of a single packet (and size of fragments),
+        in bytes. Default is 1400.
+
+        window: Max number of unacknowledged fragments in flight. Default is
+        64.
+
+        retries: Max number of consecutive timeouts of a transfer. Default is
+        3.
+
+        deliver: Function called (in a new thread) with every reassembled
+        message. Default is None.
+
+        forward: Function called (in the engine thread) with every received
+        message of a state in forward_states that is not a duplicate, and
+        its frame (bytes, from the Ethernet header). Default is None.
+
+        forward_states: Set of states of forwarded messages. Default is
+        empty.
+
+        handlers: Dict of functions called (in the engine thread) with every
+        received message of a given state (keys), whatever its request ID,
+        instead of routing it (e.g. unsolicited announcements).
+
+        replies: ReplyCache object whose cached replies answer duplicates of
+        request messages. Default is None.
+
+        stats: Dict of receive counters: 'packets' (packets copied to Python),
+        'messages' (MyProtocol messages decoded), 'cpu_time' (CPU time
+        spent receiving and decoding them, in seconds), and 'refused'
+        (large messages not reassembled because too many were already being
+        reassembled).
+
+        timers: TimerWheel driving all timeouts (only used from the engine
+        thread).
+
+        Methods:
+        --------
+        start(): Start engine thread.
+
+        run(coro): Run coroutine in the engine and wait for its result
+        (blocking, must not be called from the engine thread).
+
+        spawn(coro): Run coroutine in the engine without waiting for its
+        result. Returns concurrent.futures.Future.
+
+        call_later(delay, callback, *args): Call callback(*args) in the
+        engine thread after delay (in seconds).
+
+        schedule(delay, callback, *args): Same as call_later, from the engine
+        thread. Returns Timer (that can be cancelled).
+
+        expect(req_id, attempt_no, states, src): Register interest in the next
+        packet matching (req_id, attempt_no, state in states), coming from
+        src if given. Returns waiter.
+
+        wait(waiter, timeout): Wait for expected packet. Returns packet, or
+        None if timed out.
+
+        send(msg, dst, dst_mac): Send message to dst (at layer 2 if dst_mac
+        is given, at layer 3 if not).
+
+        encode(msg, dst): Returns message encoded as a packet to dst (bytes,
+        from the IP header).
+
+        exchange(msg, dst, states, src, timeout, dst_mac, retry): Send
+        message and wait for the expected answer (with the same request ID
+        and attempt number). Returns answer, or None if timed out.
+
+        gather(msg, dst, states, timeout, window, dst_mac, retry): Send
+        message, wait for the first expected answer, then keep collecting
+        answers during window. Returns list of answers (in order of arrival).
+
+        fragmented(data): Returns True if data is too large for a single
+        packet.
+
+        transfer(msg, dst, dst_mac): Send large message as fragments. Returns
+        True if all fragments are acknowledged, False if not.
+
+        receiving(src, req_id, attempt_no, kind): Returns True if a large
+        message is being received (or was just reassembled).
+    '''
+
+    def __init__(self, codec: Codec, rtt: RttEstimator = None,
+                 frag_size: int = 1400, window: int = 64, retries: int = 3):
+        self.codec = codec
+        self.rtt = rtt if rtt else RttEstimator(1, 1)
+        self.frag_size = frag_size
+        self.window = window
+        self.retries = retries
+        # called (in a new thread) with every reassembled message
+        self.deliver = None
+        # called (in the engine thread) with every received message (and its
+        # frame) of forward_states, unless answered from the reply cache
+        self.forward = None
+        self.forward_states = frozenset()
+        # called (in the engine thread) with every message of a given state
+        self.handlers = {}
+        # answers duplicates of request messages (with cached replies)
+        self.replies = None
+        self.stats = {'packets': 0, 'messages': 0, 'cpu_time': 0.0,
+                      'refused': 0}
+
+        self._loop = new_event_loop()
+        self.timers = TimerWheel(TIMER_TICK, clock=self._loop.time)
+        # wake-up of the event loop to advance the timer wheel
+        self._timer_handle = None
+        self._timer_when = None
+        # keys are (request ID, attempt number, state)
+        self._waiters = {}
+        # keys are (src IP, request ID, attempt number, kind)
+        self._reassemblies = {}
+        self._reassembled = {}
+        # {src IP: number of reassemblies}
+        self._sources = {}
+        self._recv_sock = None
+        self._l2_sock = None
+        self._l3_sock = None
+        self._src_mac = None
+        # preallocated buffers (only used from the engine thread)
+        self._recv_buf = bytearray(MAX_FRAME)
+        self._recv_view = memoryview(self._recv_buf)
+        self._send_buf = bytearray(MAX_FRAME)
+        self._send_view = memoryview(self._send_buf)
+        self._run = False
+        self._started = Event()
+
+    def start(self):
+        '''
+            Start engine thread.
+        '''
+
+        if not self._run:
+            self._run = True
+            Thread(target=self._start, daemon=True).start()
+        self._started.wait()
+
+    def run(self, coro):
+        '''
+            Run coroutine in the engine and wait for its result (blocking,
+            must not be called from the engine thread).
+        '''
+
+        return self.spawn(coro).result()
+
+    def spawn(self, coro):
+        '''
+            Run coroutine in the engine without waiting for its result.
+
+            Returns concurrent.futures.Future.
+        '''
+
+        self.start()
+        return run_coroutine_threadsafe(coro, self._loop)
+
+    def call_later(self, delay: float, callback, *args):
+        '''
+            Call callback(*args) in the engine thread after delay (in
+            seconds), without a thread (or coroutine) per call.
+        '''
+
+        self.start()
+        self._loop.call_soon_threadsafe(self.schedule, delay, callback, *args)
+
+    def schedule(self, delay: float, callback, *args):
+        '''
+            Call callback(*args) after delay (in seconds).
+
+            Must be called from the engine thread.
+
+            Returns Timer (that can be cancelled).
+        '''
+
+        timer = self.timers.schedule(delay, callback, *args)
+        if (not self._timer_handle
+                or timer.tick * self.timers.tick < self._timer_when):
+            self._arm()
+        return timer
+
+    def expect(self, req_id: str, attempt_no: int, states: tuple,
+               src: str = None, many: bool = False):
+        '''
+            Register interest in the next packet matching (req_id, attempt_no,
+            state in states), coming from src if given (or in all of them if
+            many is True, until the waiter is discarded).
+
+            Must be called from the engine thread.
+
+            Returns _Waiter object.
+        '''
+
+        keys = tuple((req_id, attempt_no, state) for state in states)
+        waiter = _Waiter(self._loop.create_future(), keys, src,
+                         [] if many else None)
+        for key in keys:
+            self._waiters.setdefault(key, []).append(waiter)
+        return waiter
+
+    async def wait(self, waiter: _Waiter, timeout: float):
+        '''
+            Wait for expected packet.
+
+            Returns packet, or None if timed out.
+        '''
+
+        try:
+            return await self._within(waiter.future, timeout)
+        finally:
+            self._discard(waiter)
+
+    def send(self, msg: Message, dst: str, dst_mac: str = None):
+        '''
+            Send message to dst (at layer 2 if dst_mac is given, at layer 3 if
+            not).
+
+            Must be called from the engine thread.
+        '''
+
+        try:
+            if dst_mac:
+                length = self.codec.encode_frame_into(
+                    self._send_buf, msg, MY_IP, dst, self._src_mac, dst_mac)
+                self._l2_sock.send(self._send_view[:length])
+            else:
+                length = self.codec.encode_frame_into(
+                    self._send_buf, msg, MY_IP, dst)
+                self._l3_sock.sendto(self._send_view[:length], (dst, 0))
+        except Exception as e:
+            console.error('Engine failed to send packet due to %s',
+                          e.__class__.__name__)
+            file.exception('Engine failed to send packet')
+
+    def encode(self, msg: Message, dst: str):
+        '''
+            Returns message encoded as a packet to dst (bytes, from the IP
+            header), e.g. to be cached and sent again.
+
+            Must be called from the engine thread.
+        '''
+
+        length = self.codec.encode_frame_into(self._send_buf, msg, MY_IP,
+                                              dst)
+        return bytes(self._send_view[:length])
+
+    async def exchange(self, msg: Message, dst: str, states: tuple,
+                       src: str = None, timeout: float = None,
+                       dst_mac: str = None, retry: int = 0):
+        '''
+            Send message and wait for the expected answer (with the same
+            request ID and attempt number).
+
+            If timeout is None, it is computed from dst's RTT estimates
+            (retry being the number of times the message was already sent),
+            and the answer is used as RTT sample if it answers the first
+            transmission. A fixed timeout is meant for answers that take more
+            than a round trip (e.g. the orchestrator's host search), so they
+            are not sampled.
+
+            Returns answer, or None if timed out.
+        '''
+
+        adaptive = timeout is None
+        if adaptive:
+            timeout = self.rtt.timeout(dst, retry)
+        # register before sending so a fast answer is not missed
+        waiter = self.expect(msg.req_id, msg.attempt_no, states, src)
+        if self.fragmented(msg.data):
+            if not await self.transfer(msg, dst, dst_mac):
+                self._discard(waiter)
+                return None
+            sent_at = time()
+        else:
+            sent_at = time()
+            self.send(msg, dst, dst_mac)
+        answer = await self.wait(waiter, timeout)
+        # Karn's algorithm: only sample answers to first transmissions
+        if (adaptive and answer and not retry
+                and answer.state not in _UNTIMED):
+            self.rtt.sample(dst, answer.timestamp - sent_at)
+        return answer
+
+    async def gather(self, msg: Message, dst: str, states: tuple,
+                     timeout: float = None, window: float = 0,
+                     dst_mac: str = None, retry: int = 0):
+        '''
+            Send message, wait for the first expected answer, then keep
+            collecting answers during window.
+
+            If timeout is None, it is computed from dst's RTT estimates
+            (retry being the number of times the message was already sent),
+            and, if the first transmission is answered, the first answer is
+            used as RTT sample for dst (as well as every answer for its own
+            source).
+
+            Returns list of answers (in order of arrival).
+        '''
+
+        adaptive = timeout is None
+        if adaptive:
+            timeout = self.rtt.timeout(dst, retry)
+        waiter = self.expect(msg.req_id, msg.attempt_no, states, many=True)
+        sent_at = time()
+        self.send(msg, dst, dst_mac)
+        try:
+            if (await self._within(waiter.future, timeout)
+                    and window > 0):
+                await self._within(self._loop.create_future(), window)
+        finally:
+            self._discard(waiter)
+        if adaptive and waiter.messages and not retry:
+            self.rtt.sample(dst, waiter.messages[0].timestamp - sent_at)
+            if dst != waiter.messages[0].src:
+                for answer in waiter.messages:
+                    self.rtt.sample(answer.src, answer.timestamp - sent_at)
+        return waiter.messages
+
+    def fragmented(self, data: bytes):
+        '''
+            Returns True if data is too large for a single packet.
+        '''
+
+        return len(data) > self.frag_size
+
+    async def transfer(self, msg: Message, dst: str, dst_mac: str = None):
+        '''
+            Send large message (DREQ or DRES) as fragments (DFRAG), with at
+            most window unacknowledged fragments in flight, retransmitting
+            the ones reported missing by selective acknowledgements (DSACK)
+            and, on timeout, all unacknowledged ones.
+
+            Returns True if all fragments are acknowledged, False if not.
+        '''
+
+        data = memoryview(msg.data)
+        size = self.frag_size
+        count = -(-len(data) // size)
+        frag = Message(state=DFRAG, req_id=msg.req_id,
+                       attempt_no=msg.attempt_no, kind=msg.state,
+                       frag_size=size, total=len(data))
+        acked = bytearray(count)
+        sent_at = [0.0] * count
+        base = 0
+        next_seq = 0
+        timeouts = 0
+        waiter = self.expect(msg.req_id, msg.attempt_no, (DSACK,), dst,
+                             many=True)
+        try:
+            while base < count:
+                now = time()
+                while next_seq < count and next_seq < base + self.window:
+                    self._send_fragment(frag, data, next_seq, dst, dst_mac)
+                    sent_at[next_seq] = now
+                    next_seq += 1
+                if not await self._within(waiter.future,
+                                          self.rtt.timeout(dst, timeouts)):
+                    timeouts += 1
+                    if timeouts > self.retries:
+                        return False
+                    # retransmit all unacknowledged fragments in flight
+                    now = time()
+                    for i in range(base, next_seq):
+                        if not acked[i]:
+                            self._send_fragment(frag, data, i, dst, dst_mac)
+                            sent_at[i] = now
+                    waiter.future = self._loop.create_future()
+                    continue
+                timeouts = 0
+                sacks = waiter.messages
+                waiter.messages = []
+                waiter.future = self._loop.create_future()
+                highest = base
+                for sack in sacks:
+                    if sack.kind != msg.state:
+                        continue
+                    seq = min(sack.seq, count)
+                    if seq > base:
+                        acked[base:seq] = b'\x01' * (seq - base)
+                    bitmap = sack.bitmap
+                    i = seq + 1
+                    while bitmap and i < count:
+                        if bitmap & 1:
+                            acked[i] = 1
+                            highest = max(highest, i)
+                        bitmap >>= 1
+                        i += 1
+                while base < count and acked[base]:
+                    base += 1
+                # retransmit holes below the highest acknowledged fragment
+                # (at most once per round trip)
+                now = time()
+                srtt = self.rtt.srtt(dst) or 0
+                for i in range(base, highest):
+                    if not acked[i] and now - sent_at[i] > srtt:
+                        self._send_fragment(frag, data, i, dst, dst_mac)
+                        sent_at[i] = now
+            return True
+        finally:
+            self._discard(waiter)
+
+    def receiving(self, src: str, req_id: str, attempt_no: int,
+                  kind: int = DREQ):
+        '''
+            Returns True if a large message is being received from src (or
+            was just reassembled).
+        '''
+
+        key = (src, req_id, attempt_no, kind)
+        return key in self._reassemblies or key in self._reassembled
+
+    def _send_fragment(self, frag: Message, data: memoryview, seq: int,
+                       dst: str, dst_mac: str = None):
+        offset = seq * frag.frag_size
+        frag.seq = seq
+        frag.data = data[offset:offset + frag.frag_size]
+        self.send(frag, dst, dst_mac)
+
+    def _on_fragment(self, frag: Message):
+        key = (frag.src, frag.req_id, frag.attempt_no, frag.kind)
+        # transfer retried after reassembly (answer was lost), so acknowledge
+        # all and deliver again (once, on its first fragment)
+        msg = self._reassembled.get(key, None)
+        if msg:
+            self._send_sack(frag, -(-msg.total // frag.frag_size), 0)
+            if frag.seq == 0:
+                self._deliver(msg)
+            return
+        reassembly = self._reassemblies.get(key, None)
+        if not reassembly:
+            if (frag.kind not in (DREQ, DRES) or frag.frag_size <= 0
+                    or frag.total <= 0 or frag.total > MAX_DATA):
+                return
+            sources = self._sources.get(frag.src, 0)
+            if (sources >= MAX_REASSEMBLIES_PER_SOURCE
+                    or len(self._reassemblies) >= MAX_REASSEMBLIES):
+                # (the sender retries, or gives up if never acknowledged)
+                self.stats['refused'] += 1
+                return
+            reassembly = _Reassembly(frag.total, frag.frag_size)
+            self._reassemblies[key] = reassembly
+            self._sources[frag.src] = sources + 1
+            self.schedule(REASSEMBLY_TIMEOUT, self._expire, key)
+        in_order = frag.seq == reassembly.base
+        new = reassembly.add(frag.seq, frag.data)
+        if new:
+            reassembly.last = frag.timestamp
+        done = reassembly.base == reassembly.count
+        # acknowledge regularly and on completion, but also on gaps (so the
+        # sender retransmits missing fragments without waiting for a
+        # timeout), on filled gaps and on duplicates (retransmissions)
+        if (done or not new or not in_order
+                or reassembly.base > frag.seq + 1
+                or reassembly.received % ACK_EVERY == 0):
+            self._send_sack(frag, reassembly.base, reassembly.bitmap())
+        if done:
+            self._drop(key)
+            msg = Message(state=frag.kind, req_id=frag.req_id,
+                          attempt_no=frag.attempt_no,
+                          data=bytes(reassembly.buf), src=frag.src,
+                          dst=frag.dst, timestamp=frag.timestamp)
+            msg.total = frag.total
+            self._reassembled[key] = msg
+            self.schedule(REASSEMBLY_LINGER, self._reassembled.pop, key,
+                          None)
+            self.dispatch(msg)
+            self._deliver(msg)
+
+    def _send_sack(self, frag: Message, seq: int, bitmap: int):
+        self.send(Message(state=DSACK, req_id=frag.req_id,
+                          attempt_no=frag.attempt_no, kind=frag.kind, seq=seq,
+                          bitmap=bitmap), frag.src)
+
+    def _expire(self, key: tuple):
+        reassembly = self._reassemblies.get(key, None)
+        if not reassembly:
+            return
+        idle = time() - reassembly.last
+        if idle >= REASSEMBLY_TIMEOUT:
+            self._drop(key)
+        else:
+            self.schedule(REASSEMBLY_TIMEOUT - idle, self._expire, key)
+
+    def _drop(self, key: tuple):
+        # (key is (src IP, request ID, attempt number, kind))
+        del self._reassemblies[key]
+        sources = self._sources.pop(key[0]) - 1
+        if sources:
+            self._sources[key[0]] = sources
+
+    async def _within(self, future, timeout: float):
+        # returns result of future, None if not done within timeout (in
+        # seconds)
+        timer = self.schedule(timeout, _time_out, future)
+        try:
+            return await future
+        finally:
+            timer.cancel()
+
+    def _arm(self):
+        # wake up the event loop when the timer wheel must be advanced next
+        when = self.timers.next_expiry()
+        if self._timer_handle:
+            if when is not None and self._timer_when <= when:
+                return
+            self._timer_handle.cancel()
+            self._timer_handle = None
+        if when is not None:
+            self._timer_when = when
+            self._timer_handle = self._loop.call_at(when, self._on_timer)
+
+    def _on_timer(self):
+        # (the event loop may wake up slightly before the tick)
+        now = max(self._loop.time(), self._timer_when)
+        self._timer_handle = None
+        self.timers.advance(now)
+        self._arm()
+
+    def _replay(self, msg: Message):
+        # answer duplicate with cached reply (if any)
+        reply = self.replies.get((msg.src, msg.req_id, msg.attempt_no,
+                                  msg.state))
+        if not reply:
+            return False
+        try:
+            self._l3_sock.sendto(reply[0], (reply[1], 0))
+        except Exception:
+            file.exception('Engine failed to send packet')
+        return True
+
+    def _deliver(self, msg: Message):
+        if self.replies is not None and self._replay(msg):
+            return
+        if self.deliver:
+            Thread(target=self.deliver, args=(msg,), daemon=True).start()
+
+    def _start(self):
+        set_event_loop(self._loop)
+        for addr in net_if_addrs().get(MY_IFACE, []):
+            if addr.family == AF_PACKET:
+                self._src_mac = addr.address
+        self._recv_sock = socket(AF_PACKET, SOCK_RAW, htons(ETH_P_ALL))
+        self._recv_sock.bind((MY_IFACE, ETH_P_ALL))
+        attach_filter(self._recv_sock, self.codec.ip_proto,
+                      self.codec.ether_type)
+        self._recv_sock.setblocking(False)
+        self._l2_sock = socket(AF_PACKET, SOCK_RAW)
+        self._l2_sock.bind((MY_IFACE, 0))
+        # IPPROTO_RAW implies that IP header is included
+        self._l3_sock = socket(AF_INET, SOCK_RAW, IPPROTO_RAW)
+        self._l3_sock.setsockopt(SOL_SOCKET, SO_BROADCAST, 1)
+        if MY_IFACE:
+            self._l3_sock.setsockopt(SOL_SOCKET, SO_BINDTODEVICE,
+                                     MY_IFACE.encode())
+        self._loop.add_reader(self._recv_sock.fileno(), self._on_readable)
+        self._started.set()
+        self._loop.run_forever()
+
+    def _discard(self, waiter: _Waiter):
+        for key in waiter.keys:
+            waiters = self._waiters.get(key, None)
+            if waiters:
+                try:
+                    waiters.remove(waiter)
+                except ValueError:
+                    pass
+                if not waiters:
+                    del self._waiters[key]
+
+    def _on_readable(self):
+        start = thread_time()
+        stats = self.stats
+        replies = self.replies
+        for _ in range(RECV_BATCH):
+            try:
+                length, addr = self._recv_sock.recvfrom_into(self._recv_buf)
+            except BlockingIOError:
+                break
+            except Exception:
+                file.exception('Engine failed to receive packet')
+                break
+            stats['packets'] += 1
+            # inbound only (already filtered by BPF, but just in case)
+            if addr[2] == PACKET_OUTGOING:
+                continue
+            msg = self.codec.decode_frame(self._recv_view, length)
+            if msg is None or msg.src == MY_IP or msg.src == DEFAULT_IP:
+                continue
+            handler = self.handlers.get(msg.state, None)
+            if not msg.req_id and not handler:
+                continue
+            stats['messages'] += 1
+            # duplicate of a request already answered
+            if replies is not None and self._replay(msg):
+                continue
+            msg.timestamp = time()
+            if handler:
+                try:
+                    handler(msg)
+                except Exception:
+                    file.exception('Engine failed to handle message')
+            elif msg.state == DFRAG:
+                self._on_fragment(msg)
+            else:
+                self.dispatch(msg)
+                if self.forward and msg.state in self.forward_states:
+                    # (copied, as the receive buffer is reused)
+                    self.forward(msg, bytes(self._recv_view[:length]))
+        stats['cpu_time'] += thread_time() - start
+
+    def dispatch(self, msg: Message):
+        '''
+            Route received message to the first coroutine awaiting it (if
+            any).
+        '''
+
+        key = (msg.req_id, msg.attempt_no, msg.state)
+        for waiter in self._waiters.get(key, ()):
+            if waiter.src and waiter.src != msg.src:
+                continue
+            if not waiter.future.done():
+                waiter.future.set_result(msg)
+            if waiter.messages is not None:
+                waiter.messages.append(msg)
+                continue
+            self._discard(waiter)
+            return
+
+
+def _time_out(future):
+    if not future.done():
+        future.set_result(None)
@@ -0,0 +1,135 @@
+'''
+    IP multicast groups of the Classes of Service (CoS), so that host
+    requests (HREQ) are only captured by the providers currently able to
+    serve their CoS, instead of by every node of the segment (including pure
+    clients).
+
+    The group of a CoS is the base group address plus the CoS ID. Providers
+    join the groups of the CoS they can host, and leave them as soon as they
+    no longer can (the kernel sends the IGMP reports and programs the NIC's
+    multicast filter, so frames of other groups are dropped before reaching
+    the capture sockets).
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    Membership: Provider-side membership of CoS groups.
+
+    Methods:
+    --------
+    group_ip(base, cos_id): Returns IP address of the group of CoS.
+
+    group_mac(ip): Returns MAC address of multicast group ip.
+'''
+
+
+from socket import (socket, inet_aton, inet_ntoa, AF_INET, SOCK_DGRAM,
+                    IPPROTO_IP, IP_ADD_MEMBERSHIP, IP_DROP_MEMBERSHIP)
+from struct import Struct
+from threading import Lock
+
+from logger import console, file
+
+
+_U32 = Struct('!I')
+
+
+def group_ip(base: str, cos_id: int):
+    '''
+        Returns IP address of the group of CoS identified by cos_id (base
+        group address + cos_id).
+    '''
+
+    return inet_ntoa(_U32.pack(_U32.unpack(inet_aton(base))[0] + cos_id))
+
+
+def group_mac(ip: str):
+    '''
+        Returns MAC address of multicast group ip (01:00:5e + low 23 bits).
+    '''
+
+    addr = inet_aton(ip)
+    return '01:00:5e:%02x:%02x:%02x' % (addr[1] & 0x7f, addr[2], addr[3])
+
+
+class Membership:
+    '''
+        Provider-side membership of CoS groups.
+
+        Attributes:
+        -----------
+        base: Base group address (group of CoS is base + CoS ID).
+
+        iface_ip: IP address of the interface groups are joined on.
+
+        stats: Dict of counters: 'joins' and 'leaves'.
+
+        Methods:
+        --------
+        update(cos_id, eligible): Join group of CoS if eligible, leave it if
+        not (only if membership changes).
+
+        joined(): Returns set of IDs of CoS whose groups are joined.
+
+        leave_all(): Leave all groups.
+    '''
+
+    def __init__(self, base: str, iface_ip: str):
+        self.base = base
+        self.iface_ip = iface_ip
+        self.stats = {'joins': 0, 'leaves': 0}
+        self._joined = set()
+        self._sock = None
+        self._lock = Lock()
+
+    def update(self, cos_id: int, eligible: bool):
+        '''
+            Join group of CoS identified by cos_id if eligible, leave it if
+            not (only if membership changes).
+
+            Returns True if membership changed, False if not.
+        '''
+
+        with self._lock:
+            if eligible == (cos_id in self._joined):
+                return False
+            ip = group_ip(self.base, cos_id)
+            try:
+                if not self._sock:
+                    self._sock = socket(AF_INET, SOCK_DGRAM)
+                # struct ip_mreq {group, interface}
+                self._sock.setsockopt(
+                    IPPROTO_IP,
+                    IP_ADD_MEMBERSHIP if eligible else IP_DROP_MEMBERSHIP,
+                    inet_aton(ip) + inet_aton(self.iface_ip))
+            except OSError:
+                file.exception('Failed to %s multicast group %s',
+                               'join' if eligible else 'leave', ip)
+                return False
+            if eligible:
+                self._joined.add(cos_id)
+                self.stats['joins'] += 1
+                console.info('Joined group %s of CoS %d', ip, cos_id)
+            else:
+                self._joined.discard(cos_id)
+                self.stats['leaves'] += 1
+                console.info('Left group %s of CoS %d', ip, cos_id)
+            return True
+
+    def joined(self):
+        '''
+            Returns set of IDs of CoS whose groups are joined.
+        '''
+
+        with self._lock:
+            return set(self._joined)
+
+    def leave_all(self):
+        '''
+            Leave all groups.
+        '''
+
+        for cos_id in self.joined():
+            self.update(cos_id, False)
@@ -0,0 +1,118 @@
+'''
+    Provider-side cache of execution results, keyed by a digest of the CoS
+    and the input data, so that byte-identical inputs (from the same
+    consumer or not) are answered without executing again.
+
+    Only CoS explicitly opted in are cached (non-deterministic applications
+    must not be).
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    ResultCache: Size and TTL bounded cache of results.
+'''
+
+
+from collections import OrderedDict
+from hashlib import blake2b
+from threading import Lock
+from time import time
+
+
+class ResultCache:
+    '''
+        Size and TTL bounded cache of results, keyed by a digest of (CoS ID,
+        input data).
+
+        Attributes:
+        -----------
+        size: Max number of cached results (least recently used are evicted
+        first). 0 disables the cache.
+
+        ttl: Time (in seconds) a result is cached for.
+
+        cos_ids: Set of IDs of CoS whose results can be cached.
+
+        stats: Dict of counters: 'hits', 'misses' and 'evictions'.
+
+        Methods:
+        --------
+        enabled(cos_id): Returns True if results of CoS identified by cos_id
+        are cached.
+
+        get(cos_id, data): Returns cached result of data for CoS identified by
+        cos_id, None if not cached.
+
+        put(cos_id, data, result): Cache result of data for CoS identified by
+        cos_id (if enabled).
+
+        clear(): Remove all results.
+    '''
+
+    def __init__(self, size: int, ttl: float, cos_ids=()):
+        self.size = size
+        self.ttl = ttl
+        self.cos_ids = set(cos_ids)
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+        # {digest: (result, cached at)} (in order of use)
+        self._results = OrderedDict()
+        self._lock = Lock()
+
+    def enabled(self, cos_id: int):
+        '''
+            Returns True if results of CoS identified by cos_id are cached.
+        '''
+
+        return self.size > 0 and cos_id in self.cos_ids
+
+    def get(self, cos_id: int, data: bytes):
+        '''
+            Returns cached result of data for CoS identified by cos_id, None
+            if not cached.
+        '''
+
+        if not self.enabled(cos_id):
+            return None
+        key = _digest(cos_id, data)
+        with self._lock:
+            entry = self._results.get(key, None)
+            if entry and time() - entry[1] <= self.ttl:
+                self._results.move_to_end(key)
+                self.stats['hits'] += 1
+                return entry[0]
+            if entry:
+                del self._results[key]
+                self.stats['evictions'] += 1
+            self.stats['misses'] += 1
+            return None
+
+    def put(self, cos_id: int, data: bytes, result):
+        '''
+            Cache result of data for CoS identified by cos_id (if enabled).
+        '''
+
+        if not self.enabled(cos_id) or result is None:
+            return
+        key = _digest(cos_id, data)
+        with self._lock:
+            self._results[key] = (result, time())
+            self._results.move_to_end(key)
+            while len(self._results) > self.size:
+                self._results.popitem(last=False)
+                self.stats['evictions'] += 1
+
+    def clear(self):
+        '''
+            Remove all results.
+        '''
+
+        with self._lock:
+            self._results.clear()
+
+
+def _digest(cos_id: int, data: bytes):
+    h = blake2b(cos_id.to_bytes(4, 'big'), digest_size=16)
+    h.update(data)
+    return h.digest()
@@ -0,0 +1,199 @@
+'''
+    Ranking of the host offers (HRES) collected by a consumer during an
+    attempt, according to a pluggable scoring policy, so that work is placed
+    on the host expected to finish it fastest, not on the one that happened
+    to answer first.
+
+    Scores are computed with NumPy over all offers at once, so that hundreds
+    of offers per attempt can be ranked cheaply.
+
+    A policy is a function taking NumPy arrays of offered CPU, RAM, disk,
+    and HRES round-trip times, as well as the requested CoS, and returning an
+    array of scores (the higher, the better; -inf to exclude an offer).
+
+    Classes:
+    --------
+    OfferCache: Consumer-side cache of recent host offers, keyed by CoS, so
+    that requests can skip the broadcast host request (HREQ) phase.
+
+    Methods:
+    --------
+    register_policy(name, policy): Add a scoring policy (or replace one).
+
+    rank(offers, cos, policy, sent_at): Returns list of offers sorted from
+    best to worst according to policy.
+'''
+
+
+from threading import Lock
+from time import time
+
+import numpy as np
+
+from model import CoS
+
+
+def _first(cpu, ram, disk, rtt, cos: CoS):
+    # same as accepting the first response
+    return -rtt
+
+
+def _most_cpu(cpu, ram, disk, rtt, cos: CoS):
+    # most free CPU (ties broken by round-trip time)
+    return cpu - rtt * 1e-6
+
+
+def _best_fit(cpu, ram, disk, rtt, cos: CoS):
+    # offers that can't satisfy the CoS' minimums are excluded, the others
+    # are scored by how little they would have left once the request is
+    # placed (relative to what they offer), to keep large hosts for large
+    # requests
+    need = np.array([[cos.get_min_cpu()], [cos.get_min_ram()],
+                     [cos.get_min_disk()]])
+    offer = np.vstack((cpu, ram, disk))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slack = np.where(offer > 0, (offer - need) / offer, 0)
+    scores = -slack.mean(axis=0)
+    scores[(offer < need).any(axis=0)] = -np.inf
+    return scores
+
+
+def _lowest_rtt(cpu, ram, disk, rtt, cos: CoS):
+    # lowest HRES round-trip time (among offers that satisfy the CoS'
+    # minimums)
+    scores = -rtt
+    scores[(cpu < cos.get_min_cpu()) | (ram < cos.get_min_ram())
+           | (disk < cos.get_min_disk())] = -np.inf
+    return scores
+
+
+policies = {
+    'first': _first,
+    'cpu': _most_cpu,
+    'fit': _best_fit,
+    'rtt': _lowest_rtt,
+}
+
+
+def register_policy(name: str, policy):
+    '''
+        Add a scoring policy (or replace one).
+
+        policy(cpu, ram, disk, rtt, cos) must return an array of scores (the
+        higher, the better; -inf to exclude an offer).
+    '''
+
+    policies[name] = policy
+
+
+def rank(offers: list, cos: CoS, policy: str = 'first',
+         sent_at: float = None):
+    '''
+        Returns list of offers (HRES messages, with timestamp set) sorted from
+        best to worst according to policy. Excluded offers are left out.
+
+        sent_at is the time the HREQ was sent at (to compute round-trip
+        times).
+    '''
+
+    n = len(offers)
+    if n == 0:
+        return []
+    cpu = np.fromiter((o.cpu_offer for o in offers), float, n)
+    ram = np.fromiter((o.ram_offer for o in offers), float, n)
+    disk = np.fromiter((o.disk_offer for o in offers), float, n)
+    rtt = np.fromiter((o.timestamp for o in offers), float, n)
+    if sent_at:
+        rtt -= sent_at
+    scores = policies.get(policy, _first)(cpu, ram, disk, rtt, cos)
+    # stable sort, so equal scores keep order of arrival
+    order = np.argsort(-scores, kind='stable')
+    return [offers[i] for i in order if scores[i] != -np.inf]
+
+
+class OfferCache:
+    '''
+        Consumer-side cache of recent host offers (HRES), keyed by CoS ID, so
+        that requests can send their resource reservation request (RREQ)
+        straight to a host that recently offered resources for the same CoS,
+        skipping the broadcast host request (HREQ) phase.
+
+        Entries expire after ttl seconds, and are invalidated as soon as the
+        host cancels (RCAN/DCAN) or doesn't answer.
+
+        Attributes:
+        -----------
+        ttl: Time to live of entries (in seconds). 0 disables the cache.
+
+        stats: Dict of counters: 'hits' (fresh entry found), 'misses' (no
+        entry for CoS), 'stale' (only expired entries for CoS), and
+        'invalidations'.
+
+        Methods:
+        --------
+        put(cos_id, response): Cache host offer (Response).
+
+        get(cos_id): Returns the most recent fresh offer (Response) for CoS,
+        None if not found.
+
+        invalidate(cos_id, host): Remove host's offer for CoS.
+
+        clear(): Remove all offers.
+    '''
+
+    def __init__(self, ttl: float = 0):
+        self.ttl = ttl
+        self.stats = {'hits': 0, 'misses': 0, 'stale': 0, 'invalidations': 0}
+        # {cos_id: {host: response}}
+        self._offers = {}
+        self._lock = Lock()
+
+    def put(self, cos_id: int, response):
+        '''
+            Cache host offer (Response, with host and timestamp set).
+        '''
+
+        if self.ttl <= 0:
+            return
+        with self._lock:
+            self._offers.setdefault(cos_id, {})[response.host] = response
+
+    def get(self, cos_id: int):
+        '''
+            Returns the most recent fresh offer (Response) for CoS, None if
+            not found (expired offers are removed).
+        '''
+
+        if self.ttl <= 0:
+            return None
+        with self._lock:
+            offers = self._offers.get(cos_id, None)
+            if not offers:
+                self.stats['misses'] += 1
+                return None
+            expired = time() - self.ttl
+            for host in [host for host, response in offers.items()
+                         if response.timestamp < expired]:
+                del offers[host]
+            if not offers:
+                self.stats['stale'] += 1
+                return None
+            self.stats['hits'] += 1
+            return max(offers.values(), key=lambda r: r.timestamp)
+
+    def invalidate(self, cos_id: int, host: str):
+        '''
+            Remove host's offer for CoS.
+        '''
+
+        with self._lock:
+            if self._offers.get(cos_id, {}).pop(host, None):
+                self.stats['invalidations'] += 1
+
+    def clear(self):
+        '''
+            Remove all offers.
+        '''
+
+        with self._lock:
+            self._offers.clear()
@@ -0,0 +1,315 @@
+'''
+    Bounded execution pool of the provider: a fixed number of worker threads
+    run executions taken from a bounded admission queue, so a burst of data
+    exchange requests cannot start more executions (and iperf processes) than
+    the node was configured for. A request waiting in the queue is answered
+    with DWAIT, like one being executed.
+
+    Queued executions are scheduled by Class of Service (CoS): classes with
+    a lower max response time go first, and within a class, the execution
+    with the earliest deadline (admission + max response time) goes first.
+    To protect best-effort classes from starvation, an execution that waited
+    longer than max_wait is started before any other.
+
+    A job can also be given the deadline of its request (propagated by the
+    consumer), which then replaces the one derived from its class, and past
+    which the job is expired instead of being started.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    Job: Execution to be admitted into the pool (target called with args).
+
+    ExecutionPool: Worker threads running jobs from a bounded queue.
+'''
+
+
+from threading import Thread, Lock, Condition
+from collections import deque
+from heapq import heappush, heappop
+from itertools import count
+from time import time
+
+import numpy as np
+
+from model import CoS
+from logger import file
+
+
+# number of wait times kept per CoS (for percentiles)
+WAITS_LEN = 1024
+
+
+class Job:
+    '''
+        Execution to be admitted into the pool (target called with args).
+
+        Attributes:
+        -----------
+        target: Callable.
+
+        args: Tuple of arguments of target.
+
+        cos: CoS of execution (its max response time sets its priority and
+        deadline). Default is None (best-effort).
+
+        deadline: Timestamp past which the job is no longer started (on_expire
+        is called instead). Default is None (deadline derived from cos, and
+        job never expires).
+
+        on_expire: Callable, called with args when job expired. Default is
+        None.
+
+        queued_at: Timestamp of admission.
+
+        started_at: Timestamp of start of execution. Default is None (still
+        queued).
+
+        cancelled: If True, job is dropped instead of being started (set by
+        ExecutionPool.cancel). Default is False.
+    '''
+
+    __slots__ = ('target', 'args', 'cos', 'deadline', 'on_expire',
+                 'queued_at', 'started_at', 'cancelled')
+
+    def __init__(self, target, *args, cos: CoS = None,
+                 deadline: float = None, on_expire=None):
+        self.target = target
+        self.args = args
+        self.cos = cos
+        self.deadline = deadline
+        self.on_expire = on_expire
+        self.queued_at = time()
+        self.started_at = None
+        self.cancelled = False
+
+
+class ExecutionPool:
+    '''
+        Worker threads running jobs from a bounded queue, by CoS priority.
+
+        Attributes:
+        -----------
+        workers: Number of worker threads (max number of parallel
+        executions).
+
+        size: Max number of jobs waiting in the queue.
+
+        max_wait: Time (in seconds) after which a queued job is started
+        before any other (starvation protection). 0 disables. Default is 0.
+
+        stats: Dict of counters: 'admitted', 'rejected', 'started', 'done',
+        'cancelled', 'expired' (jobs whose deadline passed in the queue, not
+        counted as started) and 'aged' (jobs started because of max_wait),
+        'wait' (total time started jobs waited in the queue, in seconds) and
+        'max_wait'.
+
+        Methods:
+        --------
+        submit(job): Admit job. Returns True if admitted, False if queue is
+        full.
+
+        cancel(job): Cancel queued job (it no longer counts in the queue).
+        Returns True if cancelled, False if already started.
+
+        full(): Returns True if queue is full (new jobs would be rejected).
+
+        depth(): Returns number of jobs waiting in the queue.
+
+        busy(): Returns number of jobs being executed.
+
+        mean_wait(): Returns mean time (in seconds) started jobs waited in
+        the queue.
+
+        percentiles(cos_id, q): Returns percentiles q of recent wait times of
+        jobs of CoS identified by cos_id.
+
+        report(q): Returns stats, with queue depth, number of busy workers,
+        mean wait and percentiles q of recent wait times per CoS.
+    '''
+
+    def __init__(self, workers: int, size: int, max_wait: float = 0):
+        self.workers = workers
+        self.size = size
+        self.max_wait = max_wait
+        self.stats = {'admitted': 0, 'rejected': 0, 'started': 0, 'done': 0,
+                      'cancelled': 0, 'expired': 0, 'aged': 0, 'wait': 0.0,
+                      'max_wait': 0.0}
+        # heap of (max response time, deadline, seq, job) (cancelled jobs
+        # are dropped when popped, or when they fill the heap)
+        self._heap = []
+        # number of queued jobs not cancelled
+        self._queued = 0
+        # jobs in admission order (for starvation protection; started jobs
+        # are skipped)
+        self._fifo = deque()
+        self._seq = count()
+        self._busy = 0
+        # {cos ID: deque of recent wait times}
+        self._waits = {}
+        self._lock = Lock()
+        self._cond = Condition(self._lock)
+        for _ in range(workers):
+            Thread(target=self._work, daemon=True).start()
+
+    def submit(self, job: Job):
+        '''
+            Admit job.
+
+            Returns True if admitted, False if queue is full.
+        '''
+
+        job.queued_at = time()
+        rt = job.cos.get_max_response_time() if job.cos else float('inf')
+        with self._cond:
+            if self._queued >= self.size:
+                self.stats['rejected'] += 1
+                return False
+            if len(self._heap) >= self.size:
+                self._compact()
+            deadline = job.deadline or job.queued_at + rt
+            heappush(self._heap, (rt, deadline, next(self._seq), job))
+            self._fifo.append(job)
+            self._queued += 1
+            self.stats['admitted'] += 1
+            self._cond.notify()
+        return True
+
+    def cancel(self, job: Job):
+        '''
+            Cancel queued job (it is dropped instead of being started, and no
+            longer counts in the queue).
+
+            Returns True if cancelled, False if already started (or
+            cancelled).
+        '''
+
+        with self._lock:
+            if job.started_at or job.cancelled:
+                return False
+            job.cancelled = True
+            self._queued -= 1
+            self.stats['cancelled'] += 1
+            return True
+
+    def full(self):
+        '''
+            Returns True if queue is full (new jobs would be rejected).
+        '''
+
+        return self._queued >= self.size
+
+    def depth(self):
+        '''
+            Returns number of jobs waiting in the queue.
+        '''
+
+        return self._queued
+
+    def busy(self):
+        '''
+            Returns number of jobs being executed.
+        '''
+
+        return self._busy
+
+    def mean_wait(self):
+        '''
+            Returns mean time (in seconds) started jobs waited in the queue
+            (expired jobs, which were not started, are not counted).
+        '''
+
+        with self._lock:
+            started = self.stats['started']
+            return self.stats['wait'] / started if started else 0.0
+
+    def percentiles(self, cos_id: int, q=(50, 90, 99)):
+        '''
+            Returns percentiles q of recent wait times (in seconds) of jobs
+            of CoS identified by cos_id (cos_id None for best-effort jobs),
+            None if none was started yet.
+        '''
+
+        with self._lock:
+            waits = self._waits.get(cos_id, None)
+            if not waits:
+                return None
+            waits = np.fromiter(waits, float, len(waits))
+        return np.percentile(waits, q)
+
+    def report(self, q=(50, 90, 99)):
+        '''
+            Returns stats, with 'depth' (jobs waiting in the queue), 'busy'
+            (jobs being executed), 'mean_wait' and 'percentiles' (dict of
+            percentiles q of recent wait times, keys are CoS IDs).
+        '''
+
+        with self._lock:
+            cos_ids = list(self._waits)
+            report = dict(self.stats, depth=self._queued, busy=self._busy)
+        report['mean_wait'] = self.mean_wait()
+        report['percentiles'] = {cos_id: self.percentiles(cos_id, q).tolist()
+                                 for cos_id in cos_ids}
+        return report
+
+    def _compact(self):
+        # drop cancelled jobs from the heap (called with lock held)
+        self._heap = [e for e in self._heap if not e[3].cancelled]
+        self._heap.sort()  # sorted list is a heap
+        self._fifo = deque(job for job in self._fifo if not job.cancelled)
+
+    def _next(self, now: float):
+        # starvation protection (oldest job, if it waited too long)
+        while self._fifo and (self._fifo[0].started_at
+                              or self._fifo[0].cancelled):
+            self._fifo.popleft()
+        if (self.max_wait and self._fifo
+                and now - self._fifo[0].queued_at > self.max_wait):
+            job = self._fifo.popleft()
+            self._heap = [e for e in self._heap if e[3] is not job]
+            self._heap.sort()  # sorted list is a heap
+            self.stats['aged'] += 1
+            return job
+        # CoS priority, then earliest deadline
+        return heappop(self._heap)[3]
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                now = time()
+                job = self._next(now)
+                job.started_at = now
+                if job.cancelled:
+                    continue
+                self._queued -= 1
+                expired = job.deadline is not None and now > job.deadline
+                if expired:
+                    self.stats['expired'] += 1
+                    if not job.on_expire:
+                        continue
+                else:
+                    wait = now - job.queued_at
+                    self.stats['started'] += 1
+                    self.stats['wait'] += wait
+                    if wait > self.stats['max_wait']:
+                        self.stats['max_wait'] = wait
+                    cos_id = job.cos.id if job.cos else None
+                    self._waits.setdefault(
+                        cos_id, deque(maxlen=WAITS_LEN)).append(wait)
+                self._busy += 1
+            try:
+                if expired:
+                    job.on_expire(*job.args)
+                else:
+                    job.target(*job.args)
+            except Exception:
+                file.exception('Execution failed')
+            finally:
+                with self._lock:
+                    self._busy -= 1
+                    if not expired:
+                        self.stats['done'] += 1
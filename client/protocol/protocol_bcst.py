@@ -16,9 +16,11 @@
 
     Methods:
     --------
-    send_request(cos_id, data): Broadcast a request to host a network 
+    submit(cos_id, data): Coroutine broadcasting a request to host a network 
     application of Class of Service (CoS) identified by cos_id, with data as 
     input.
+
+    send_request(cos_id, data): Blocking wrapper over submit(cos_id, data).
 '''
 
 
@@ -28,19 +30,30 @@
 
 
 from threading import Thread
+from random import uniform
+from asyncio import get_running_loop, create_task, wait, FIRST_COMPLETED
+from collections import deque
 from time import time 
 
 from scapy.all import (Packet, ByteEnumField, StrLenField, IntEnumField,
-                       StrField, IntField, IEEEDoubleField, ConditionalField,
-                       AnsweringMachine, conf, bind_layers, send, srp1, sr1,
-                       sniff, Ether, IP)
+                       StrField, IntField, SignedIntField, ShortField,
+                       LongField,
+                       IEEEDoubleField, ConditionalField, conf, bind_layers,
+                       Ether, IP)
 
 from resources import (get_resources, check_resources, reserve_resources,
-                       free_resources, execute)
-from network import MY_IFACE, MY_IP, BROADCAST_IP
+                       renew_lease, MONITOR_PERIOD)
+from network import MY_IP, BROADCAST_IP
 from common import IS_RESOURCE
 from model import Request, Response
 from logger import console
+from engine import Engine
+from codec import Codec, Message
+from offers import rank, OfferCache
+from directory import Directory
+from groups import Membership, group_ip, group_mac
+from rtt import RttEstimator
+from responder import ResponderAM, bulk, store, pool, free_req, expired
 from settings import *
 from consts import *
 
@@ -60,7 +73,9 @@ class MyProtocol(Packet):
         (6) (resource reservation cancellation), DREQ (7) (data exchange 
         request), DRES (8) (data exchange response), DACK (9) (data exchange 
         acknowledgement), DCAN (10) (data exchange cancellation), DWAIT (11) 
-        (data exchange wait). Default is HREQ (1).
+        (data exchange wait), DFRAG (12) (data exchange fragment), DSACK (13) 
+        (data exchange selective acknowledgement), HANN (14) (host 
+        announcement). Default is HREQ (1).
 
         req_id: String of 10 bytes indicating the request's ID. Default is ''.
 
@@ -68,23 +83,56 @@ class MyProtocol(Packet):
         is 1. 
 
         cos_id: Integer of 4 bytes indicating the application's CoS ID. Default 
-        is 1 (best-effort). Conditional field for state == HREQ (1).
+        is 1 (best-effort). Conditional field for state == HREQ (1) or 
+        state == RREQ (3) (so that a host can be reserved directly, without 
+        a prior host request).
+
+        deadline: Signed integer of 4 bytes indicating the time (in ms) left 
+        before the request exceeds the max response time of its CoS, when 
+        it was sent (negative if already exceeded). Default is 0 (no 
+        deadline). Conditional field for state == HREQ (1), state == RREQ 
+        (3) or state == DREQ (7).
+
+        kind: 1 byte indicating the state of the fragmented message, DREQ (7) 
+        or DRES (8). Default is DREQ (7). Conditional field for state == DFRAG 
+        (12) or state == DSACK (13).
+
+        seq: Integer of 4 bytes indicating the fragment's sequence number, or 
+        the first missing fragment's sequence number in acknowledgements. 
+        Default is 0. Conditional field for state == DFRAG (12) or state == 
+        DSACK (13).
+
+        frag_size: Short of 2 bytes indicating the size of fragments (all but 
+        the last one). Default is 0. Conditional field for state == DFRAG 
+        (12).
+
+        total: Integer of 4 bytes indicating the total size of the fragmented 
+        data. Default is 0. Conditional field for state == DFRAG (12).
+
+        bitmap: Long of 8 bytes indicating which of the 64 fragments following 
+        seq were received. Default is 0. Conditional field for state == DSACK 
+        (13).
 
         data: String of undefined number of bytes containing input data and 
-        possibly program to execute. Default is ''. Conditional field for 
-        state == DREQ (6) or state == DRES (7).
+        possibly program to execute (or a fragment of it). Default is ''. 
+        Conditional field for state == DREQ (7), state == DRES (8), state == 
+        DFRAG (12) or state == RREQ (3) (fast path, empty if not used).
 
         cpu_offer: IEEE double of 8 bytes indicating the amount of CPU offered 
         by the responding host. Default is 0. Conditional field for 
-        state == HRES (2).
+        state == HRES (2) or state == HANN (14).
 
         ram_offer: IEEE double of 8 bytes indicating the size of RAM offered by
         the responding host. Default is 0. Conditional field for 
-        state == HRES (2).
+        state == HRES (2) or state == HANN (14).
 
         disk_offer: IEEE double of 8 bytes indicating the size of disk offered 
         by the responding host. Default is 0. Conditional field for 
-        state == HRES (2).
+        state == HRES (2) or state == HANN (14).
+
+        queue: Short of 2 bytes indicating the number of executions waiting 
+        in the announcing host's queue. Default is 0. Conditional field for 
+        state == HANN (14).
     '''
 
     name = PROTO_NAME
@@ -93,15 +141,31 @@ class MyProtocol(Packet):
         StrLenField('req_id', '', lambda _: REQ_ID_LEN),
         IntField('attempt_no', 1),
         ConditionalField(IntEnumField('cos_id', 1, cos_names),
-                         lambda pkt: pkt.state == HREQ),
+                         lambda pkt: pkt.state == HREQ or pkt.state == RREQ),
+        ConditionalField(SignedIntField('deadline', 0),
+                         lambda pkt: pkt.state == HREQ or pkt.state == RREQ
+                         or pkt.state == DREQ),
+        ConditionalField(ByteEnumField('kind', DREQ, proto_states),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(IntField('seq', 0),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(ShortField('frag_size', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(IntField('total', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(LongField('bitmap', 0),
+                         lambda pkt: pkt.state == DSACK),
         ConditionalField(StrField('data', ''),
-                         lambda pkt: pkt.state == DREQ or pkt.state == DRES),
+                         lambda pkt: pkt.state == DREQ or pkt.state == DRES
+                         or pkt.state == DFRAG or pkt.state == RREQ),
         ConditionalField(IEEEDoubleField('cpu_offer', 0),
-                         lambda pkt: pkt.state == HRES),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
         ConditionalField(IEEEDoubleField('ram_offer', 0),
-                         lambda pkt: pkt.state == HRES),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
         ConditionalField(IEEEDoubleField('disk_offer', 0),
-                         lambda pkt: pkt.state == HRES),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
+        ConditionalField(ShortField('queue', 0),
+                         lambda pkt: pkt.state == HANN),
     ]
 
     def show(self):
@@ -138,56 +202,88 @@ class MyProtocol(Packet):
 
 
 # for scapy to be able to dissect MyProtocol packets
-bind_layers(Ether, MyProtocol)
-bind_layers(IP, MyProtocol)
+# (only those with MyProtocol's EtherType/IP protocol number)
+bind_layers(Ether, MyProtocol, type=PROTO_ETHER_TYPE)
+bind_layers(IP, MyProtocol, proto=PROTO_IP_PROTO)
 
 # IP broadcast fails when the following are true (responses are not received)
 conf.checkIPaddr = False
 conf.checkIPsrc = False
 # making them false means IP src must be checked manually
 
-
-class MyProtocolAM(AnsweringMachine):
+# host requests are sent to the multicast group of their CoS, so the
+# interface must not capture the traffic of groups that are not joined
+if PROTO_MCAST_BASE:
+    conf.sniff_promisc = False
+
+# consumer side (single receive socket shared by all requests), also used by
+# the provider side for large data (fragmented)
+# (timeouts are estimated per peer, PROTO_TIMEOUT being the initial value and
+# upper bound)
+engine = Engine(Codec(SEND_TO_BROADCAST, PROTO_IP_PROTO,
+                      PROTO_ETHER_TYPE),
+                RttEstimator(PROTO_TIMEOUT, PROTO_TIMEOUT),
+                frag_size=PROTO_FRAG_SIZE, window=PROTO_WINDOW,
+                retries=PROTO_RETRIES)
+# duplicates of request messages already answered (consumer retries) are
+# answered by the engine with the cached replies
+engine.replies = replies
+# entries of the tables of requests expire on the engine's timer wheel
+requests_.schedule = finished.schedule = engine.call_later
+# recent host offers (to skip host requests)
+offer_cache = OfferCache(PROTO_OFFER_TTL)
+# capacity announced by providers every PROTO_GOSSIP_PERIOD (to skip host
+# requests, which are only broadcast when no announced host fits)
+directory = Directory(PROTO_GOSSIP_TTL)
+engine.handlers[HANN] = directory.update
+# multicast groups of the CoS the provider can currently host (joined and
+# left every MONITOR_PERIOD, None if host requests are broadcast)
+groups = (Membership(PROTO_MCAST_BASE, MY_IP) if PROTO_MCAST_BASE
+          else None)
+# host requests captured and answered by the provider (with multicast,
+# captured requests it cannot answer should drop to near zero)
+hreq_stats = {'captured': 0, 'answered': 0}
+
+# hosts requests are being hedged with (keys are request IDs)
+_hedges = {}
+# recent response times of hedged CoS (keys are CoS IDs)
+_latencies = {}
+# number of response times kept per CoS (and needed before delaying hedges)
+LATENCIES_LEN = 256
+LATENCIES_MIN = 10
+# hedging counters: 'eligible' (requests of hedged CoS with more than one
+# offer), 'hedged' (requests actually sent to more than one host), 'hedges'
+# (extra hosts requests were sent to), 'wins' (results received from extra
+# hosts) and 'cancelled' (hosts cancelled after result was received)
+hedge_stats = {'eligible': 0, 'hedged': 0, 'hedges': 0, 'wins': 0,
+               'cancelled': 0}
+
+
+class MyProtocolAM(ResponderAM):
     '''
-        Class deriving from Scapy's AnsweringMachine class to define the 
-        protocol's responder, which takes decisions and builds and sends 
+        Class deriving from ResponderAM to define the protocol's responder 
+        in BROADCAST mode, which takes decisions and builds and sends 
         replies to received packets based on the protocol's state.
     '''
 
     function_name = 'mpam'
-    sniff_options = {'filter': 'inbound', 'iface': MY_IFACE}
-    send_function = staticmethod(send)
-    send_options = {'iface': MY_IFACE}
-
-    def is_request(self, req):
-        # a packet must have Ether, IP and MyProtocol layers
-        return (Ether in req and IP in req and MyProtocol in req
-                # and no other layer
-                and not any((layer is not Ether
-                             and layer is not IP
-                             and layer is not MyProtocol)
-                            for layer in req.layers())
-                # and not self
-                and req[IP].src != MY_IP
-                and req[IP].src != DEFAULT_IP
-                # and must have an ID
-                and req[MyProtocol].req_id)
-
-    def make_reply(self, req):
-        my_proto = req[MyProtocol]
-        ip_src = req[IP].src
-        req_id = my_proto.req_id.decode()
+    protocol = MyProtocol
+    engine = engine
+    cancelled = HREQ
+    # replies to RREQ and DREQ cached for their duplicates (others may
+    # change on retry)
+    cached_requests = (RREQ, DREQ)
+    cached_replies = (RCAN, DWAIT, DRES)
+
+    def _on_hreq(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         _req_id = (ip_src, req_id)
-        state = my_proto.state
         att_no = my_proto.attempt_no
-
-        _req = requests_.get(_req_id, None)
-        my_req = requests.get(req_id, None)
-        if my_req:
-            att = my_req.attempts.get(att_no, None)
+        hreq_stats['captured'] += 1
+        # request searching hosts again (earlier replies no longer apply)
+        replies.drop(_req_id)
 
         # provider receives host request
-        if state == HREQ and IS_RESOURCE:
+        if IS_RESOURCE:
             # if new request
             if not _req:
                 _req = Request_(req_id)
@@ -200,12 +296,37 @@ class MyProtocolAM(AnsweringMachine):
                 # set cos (for new requests and in case CoS was changed for
                 # old request)
                 _req.cos = cos_dict[my_proto.cos_id]
+                # consumer can no longer meet its deadline
+                if expired(_req, my_proto.deadline):
+                    console.info('Deadline of %s passed', req_id)
+                    _req.state = HREQ
+                    return
+                # work that cannot be started is not accepted
+                if pool.full():
+                    console.info('Execution queue is full')
+                    _req.state = HREQ
+                    return
                 console.info('Checking resources')
                 cpu, ram, disk = get_resources(quiet=True)
                 check = check_resources(_req)
                 if check:
-                    console.info('Send host response to %s', ip_src)
                     _req.state = HRES
+                    hreq_stats['answered'] += 1
+                    # delayed in proportion to load, so the least loaded
+                    # host answers first (and others may not have to)
+                    if PROTO_HRES_BACKOFF:
+                        delay = PROTO_HRES_BACKOFF * _load(_req, cpu, ram,
+                                                           disk)
+                        console.info('Delay host response to %s by %.3fs',
+                                     ip_src, delay)
+                        engine.call_later(
+                            delay, self._send_hres,
+                            Message(state=HRES, req_id=req_id,
+                                    attempt_no=att_no, cpu_offer=cpu,
+                                    ram_offer=ram, disk_offer=disk),
+                            ip_src, _req)
+                        return
+                    console.info('Send host response to %s', ip_src)
                     my_proto.state = HRES
                     my_proto.cpu_offer = cpu
                     my_proto.ram_offer = ram
@@ -214,18 +335,59 @@ class MyProtocolAM(AnsweringMachine):
                 else:
                     console.info('Insufficient (will exceed limit)')
                     _req.state = HREQ
+                    # until resources are checked again
+                    if groups:
+                        groups.update(_req.cos.id, False)
             return
 
+    def _on_hres(self, req, my_proto, ip_src, req_id, _req, my_req, att):
+        att_no = my_proto.attempt_no
+
         # consumer receives host responses (save in database)
         # if request has not been already answered or failed
-        if state == HRES and my_req and my_req.state not in (DRES, FAIL):
-            att.responses[ip_src] = Response(
-                req_id, att_no, ip_src, my_proto.cpu_offer, my_proto.ram_offer,
-                my_proto.disk_offer)
+        if my_req and my_req.state not in (DRES, FAIL):
+            res = Response(req_id, att_no, ip_src, my_proto.cpu_offer,
+                           my_proto.ram_offer, my_proto.disk_offer)
+            att.responses[ip_src] = res
+            offer_cache.put(my_req.cos.id, res)
             return
 
+    def _on_rreq(self, req, my_proto, ip_src, req_id, _req, my_req, att):
+        _req_id = (ip_src, req_id)
+
+        # provider overhears resource reservation request sent to another
+        # host (broadcast at layer 2 with PROTO_HRES_BACKOFF), so its delayed
+        # host response is no longer needed
+        if req[IP].dst != MY_IP:
+            if _req and _req.state == HRES:
+                console.info('Overheard resource reservation request from %s '
+                             'to %s, suppressing host response', ip_src,
+                             req[IP].dst)
+                _req.state = HREQ
+            return
+
+        # provider receives resource reservation request without prior host
+        # request (consumer reserving from its offer cache)
+        if not _req and IS_RESOURCE and my_proto.cos_id in cos_dict:
+            _req = Request_(req_id)
+            _req.cos = cos_dict[my_proto.cos_id]
+            # reserve_resources checks resources before reserving
+            _req.state = HRES
+            requests_[_req_id] = _req
+
         # provider receives resource reservation request
-        if state == RREQ and _req:
+        if _req:
+            # consumer can no longer meet its deadline (so nothing is
+            # reserved)
+            if expired(_req, my_proto.deadline) and _req.state == HRES:
+                console.info('Deadline of %s passed', req_id)
+                _req.state = HREQ
+                return
+            # input data piggybacked (fast path) and its result cached
+            if my_proto.data and _req.state == HRES:
+                reply = self._memoized(my_proto, ip_src, _req)
+                if reply:
+                    return reply
             # host request must have already been answered positively
             # but not yet reserved
             if _req.state == HRES:
@@ -233,29 +395,38 @@ class MyProtocolAM(AnsweringMachine):
                              ip_src)
                 my_proto.show()
                 console.info('Reserving resources')
-                # if resources are actually reserved
-                if reserve_resources(_req):
+                # if resources are actually reserved (and execution can be
+                # queued)
+                if not pool.full() and reserve_resources(_req, _req_id):
                     _req.state = RRES
                     _req._freed = False
                 # else they became no longer sufficient in time between
                 # HRES and RREQ
                 else:
-                    console.info('Resources are no longer sufficient '
-                                 '(will exceed limit)')
+                    console.info('Resources (or execution queue) are no '
+                                 'longer sufficient (will exceed limit)')
                     console.info('Send resource reservation cancellation '
                                  'to %s', ip_src)
                     _req.state = HREQ
                     my_proto.state = RCAN
                     return IP(dst=ip_src) / my_proto
             # if resources reserved
-            if _req.state == RRES:
-                Thread(target=self._respond_resources,
-                       args=(my_proto, ip_src, _req), daemon=True).start()
-            return
+            # (run in the engine, so no thread is held per reservation)
+            if _req.state == RRES and not my_proto.data:
+                engine.spawn(self._respond_resources(my_proto, ip_src, _req))
+            if not my_proto.data:
+                return
+            # input data piggybacked (PROTO_FAST_SIZE), so executed right
+            # away, as if data exchange request was received
+            console.info('Fast path (data piggybacked)')
+            return self._on_dreq(req, my_proto, ip_src, req_id, _req,
+                                 my_req, att)
 
+    def _on_rres(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # consumer receives late resource reservation response
-        # from a previous host
-        if state == RRES and my_req and ip_src != my_req.host:
+        # from a previous host (not one the request is hedged with)
+        if (my_req and ip_src != my_req.host
+                and ip_src not in _hedges.get(req_id, ())):
             console.info('Recv late resource reservation response from %s',
                          ip_src)
             my_proto.show()
@@ -265,12 +436,13 @@ class MyProtocolAM(AnsweringMachine):
             my_proto.state = RCAN
             return IP(dst=ip_src) / my_proto
 
+    def _on_dreq(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # provider receives data exchange request
-        if state == DREQ and _req:
+        if _req:
             # already executed
             if _req.state == DRES:
                 my_proto.state = DRES
-                my_proto.data = _req.result
+                my_proto.data = bulk.wrap(_req.result)
                 return IP(dst=ip_src) / my_proto
             # still executing
             if _req.state == RRES and _req._thread != None:
@@ -278,35 +450,37 @@ class MyProtocolAM(AnsweringMachine):
                 return IP(dst=ip_src) / my_proto
             console.info('Recv data exchange request from %s', ip_src)
             my_proto.show()
-            # if request was cancelled before
-            if _req.state == HREQ:
-                # if resources are still available
-                if check_resources(_req, quiet=True):
-                    console.info('This request arrived late, '
-                                 'but resources are still available')
-                    console.info('Reserving resources')
-                    reserve_resources(_req)
-                    _req.state = RRES
-                    _req._freed = False
-                else:
-                    console.info('This request arrived late, '
-                                 'and resources are no longer sufficient '
-                                 '(will exceed limit)')
-                    console.info('Send data exchange cancellation to %s',
-                                 ip_src)
-                    _req.state = HREQ
-                    my_proto.state = DCAN
-                    return IP(dst=ip_src) / my_proto
+            # consumer can no longer meet its deadline (so reservation, if
+            # any, is released)
+            if expired(_req, my_proto.deadline):
+                console.info('Deadline of %s passed', req_id)
+                free_req((ip_src, _req.id), _req)
+                _req.state = HREQ
+                return self._cancel(req, my_proto, ip_src)
+            # result of the same input already cached (no need to reserve
+            # resources nor to execute)
+            reply = self._memoized(my_proto, ip_src, _req)
+            if reply:
+                return reply
+            # if request was cancelled before (and resources are no longer
+            # available)
+            if _req.state == HREQ and not self._reserve_late(ip_src, _req):
+                return self._cancel(req, my_proto, ip_src)
             # new execution
             if _req.state == RRES:
-                th = Thread(target=self._respond_data,
-                            args=(my_proto, ip_src, _req), daemon=True)
-                _req._thread = th
-                th.start()
+                if not self._queue(my_proto, ip_src, _req):
+                    _req.state = HREQ
+                    return self._cancel(req, my_proto, ip_src)
+                # answered with DWAIT right away, so the consumer does not
+                # retransmit its input (piggybacked on RREQ, or in DREQ)
+                # while the job is queued or executing
+                my_proto.state = DWAIT
+                return IP(dst=ip_src) / my_proto
             return
 
+    def _on_dres(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # consumer receives late data exchange response
-        if state == DRES and my_req:
+        if my_req:
             # if no other response was already accepted
             if not my_req.dres_at:
                 #  if response from previous host, accept
@@ -315,7 +489,7 @@ class MyProtocolAM(AnsweringMachine):
                     my_req.dres_at = dres_at
                     my_req.state = DRES
                     my_req.host = ip_src
-                    my_req.result = my_proto.data
+                    my_req.result = bulk.unwrap(my_proto.data, ip_src)
                     if att:
                         att.state = DRES
                         att.dres_at = dres_at
@@ -344,95 +518,197 @@ class MyProtocolAM(AnsweringMachine):
                     my_proto.state = DACK
                 return IP(dst=ip_src) / my_proto
 
+    def _on_dcan(self, req, my_proto, ip_src, req_id, _req, my_req, att):
+        _req_id = (ip_src, req_id)
+        att_no = my_proto.attempt_no
+
+        # provider receives data exchange cancellation before responding
+        # (consumer got the result from another host it hedged with)
+        if _req and _req.state == RRES:
+            console.info('Recv data exchange cancellation from %s', ip_src)
+            my_proto.show()
+            # unless execution already started (its response will be
+            # cancelled too)
+            job = _req._thread
+            if job and not pool.cancel(job):
+                return
+            _req._thread = None
+            replies.discard(_req_id, att_no)
+            free_req(_req_id, _req)
+            _req.state = HREQ
+            return
+
+    def _on_dack(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # provider receives data exchange acknowledgement
-        if state == DACK and _req and _req.state == DRES:
+        if _req and _req.state == DRES:
             console.info('Recv data exchange acknowledgement from %s', ip_src)
             my_proto.show()
-            # only free resources if still reserved
-            if not _req._freed:
-                console.info('Freeing resources')
-                free_resources(_req)
-                _req._freed = True
-
-    def _respond_resources(self, my_proto, ip_src, _req):
-        my_proto.state = RRES
+            free_req((ip_src, _req.id), _req)
+
+    # handlers of received messages (keys are states)
+    _handlers = {HREQ: _on_hreq, HRES: _on_hres, RREQ: _on_rreq,
+                 RRES: _on_rres, DREQ: _on_dreq, DRES: _on_dres,
+                 DCAN: _on_dcan, DACK: _on_dack}
+
+    def _send_hres(self, hres: Message, ip_src, _req):
+        # (called in the engine thread, after back-off delay)
+        # unless suppressed (or reserved) in the meantime
+        if _req.state == HRES:
+            console.info('Send host response to %s', ip_src)
+            engine.send(hres, ip_src)
+
+    async def _respond_resources(self, my_proto, ip_src, _req):
+        rres = Message(state=RRES, req_id=_req.id,
+                       attempt_no=my_proto.attempt_no)
+        # (duplicate resource reservation requests are answered from the
+        # reply cache, instead of starting another response)
+        _req_id = (ip_src, _req.id)
+        replies.put((ip_src, _req.id, rres.attempt_no, RREQ),
+                    engine.encode(rres, ip_src), ip_src, _req_id)
         retries = PROTO_RETRIES
         dreq = None
-        while not dreq and retries and _req.state == RRES:
+        # (a large data exchange request is received as fragments by the
+        # engine, then handed to make_reply, which starts the execution)
+        while (not dreq and retries and _req.state == RRES
+               and not _req._thread):
+            renew_lease(_req_id)
             console.info('Send resource reservation response to %s', ip_src)
+            # (timeout from RTT estimates, passed explicitly so the answer
+            # is not sampled, as it is not timed by a round trip only)
+            timeout = engine.rtt.timeout(ip_src, PROTO_RETRIES - retries)
             retries -= 1
-            dreq = sr1(IP(dst=ip_src) / my_proto,
-                       timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
-            if dreq and dreq[MyProtocol].state == RCAN:
+            dreq = await engine.exchange(rres, ip_src, (DREQ, RCAN),
+                                         src=ip_src, timeout=timeout)
+            if not dreq and engine.receiving(ip_src, _req.id,
+                                             my_proto.attempt_no):
+                retries = PROTO_RETRIES
+            if dreq and dreq.state == RCAN:
                 console.info('Recv resource reservation cancellation from %s',
                              ip_src)
-                my_proto.show()
+                if PROTO_VERBOSE:
+                    dreq.show()
                 _req.state = HREQ
-                console.info('Freeing resources')
-                free_resources(_req)
+                replies.discard(_req_id, rres.attempt_no)
+                free_req(_req_id, _req)
                 return
         # only free resources if still reserved
-        if not dreq and _req.state == RRES:
+        if not dreq and _req.state == RRES and not _req._thread:
+            replies.discard(_req_id, rres.attempt_no)
             console.info('Waiting for data exchange request timed out')
-            console.info('Freeing resources')
-            free_resources(_req)
+            free_req(_req_id, _req)
             _req.state = HREQ
-            my_proto.state = RCAN
-            send(IP(dst=ip_src) / my_proto, verbose=0, iface=MY_IFACE)
-
-    def _respond_data(self, my_proto, ip_src, _req):
-        #console.info('Executing')
-        #execution_time=random.randint(10,50)
-        #console.info('Executing for %s', execution_time)
-        #sleep(execution_time)
-        console.info('Executing CoS: %s  for %s ip_src', str(_req.cos.id), str(ip_src) )       
-        res = execute(my_proto.data, ip_src, _req.cos.id)
-
-        # save result locally
-        _req.result = res
-        _req.state = DRES
-        my_proto.state = DRES
-        my_proto.data = res
+            rres.state = RCAN
+            engine.send(rres, ip_src)
+
+    async def _send_result(self, dres: Message, ip_src, _req):
+        # duplicates of the data exchange request (answered with DWAIT until
+        # now) are answered with the result
+        if engine.fragmented(dres.data):
+            replies.discard((ip_src, _req.id), dres.attempt_no)
+        else:
+            replies.update((ip_src, _req.id), dres.attempt_no,
+                           engine.encode(dres, ip_src))
         retries = PROTO_RETRIES
         dack = None
         while not dack and retries:
+            renew_lease((ip_src, _req.id))
             console.info('Send data exchange response to %s', ip_src)
+            # sent by the engine (fragmented if too large for a single
+            # packet)
+            dack = await engine.exchange(dres, ip_src, (DACK, DCAN),
+                                         src=ip_src,
+                                         retry=PROTO_RETRIES - retries)
             retries -= 1
-            dack = sr1(IP(dst=ip_src) / my_proto,
-                       timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
-            if dack and dack[MyProtocol].state == DCAN:
+            if dack and dack.state == DCAN:
                 console.info('Recv data exchange cancellation from %s', ip_src)
                 # only free resources if still reserved
-                if not _req._freed:
-                    console.info('Freeing resources')
-                    free_resources(_req)
-                    _req._freed = True
+                if free_req((ip_src, _req.id), _req):
                     return
         if not dack:
             console.info('Waiting for data exchange acknowledgement timed out')
-            # only free resources if still reserved
-            if not _req._freed:
-                console.info('Freeing resources')
-                free_resources(_req)
-                _req._freed = True
+            free_req((ip_src, _req.id), _req)
 
 
-def send_request(cos_id: int, data: bytes):
+def _announce(seq: int = 1):
+    # broadcast free resources and queue length, then again after
+    # PROTO_GOSSIP_PERIOD (called in the engine thread)
+    try:
+        cpu, ram, disk = get_resources(quiet=True)
+        engine.send(Message(state=HANN, attempt_no=seq, cpu_offer=cpu,
+                            ram_offer=ram, disk_offer=disk,
+                            queue=pool.depth()),
+                    BROADCAST_IP, BROADCAST_MAC)
+    finally:
+        engine.call_later(PROTO_GOSSIP_PERIOD, _announce, seq + 1)
+
+
+def _refresh_groups():
+    # join groups of CoS that can be hosted, and leave the others, then again
+    # after MONITOR_PERIOD (called in the engine thread)
+    try:
+        full = pool.full()
+        for cos in list(cos_dict.values()):
+            groups.update(cos.id, not full and check_resources(
+                Request(None, cos, b''), quiet=True))
+    finally:
+        engine.call_later(MONITOR_PERIOD, _refresh_groups)
+
+
+def _hreq_dst(cos_id: int):
+    # IP and MAC addresses host requests of CoS are sent to
+    if not PROTO_MCAST_BASE:
+        return BROADCAST_IP, BROADCAST_MAC
+    ip = group_ip(PROTO_MCAST_BASE, cos_id)
+    return ip, group_mac(ip)
+
+
+if IS_RESOURCE and groups:
+    engine.call_later(0, _refresh_groups)
+
+# (first announcement at a random time of the period, so that nodes started
+# together do not announce together)
+if IS_RESOURCE and PROTO_GOSSIP_PERIOD:
+    engine.call_later(uniform(0, PROTO_GOSSIP_PERIOD), _announce)
+
+
+def _load(_req: Request_, cpu: float, ram: float, disk: float):
+    # share of free resources the request would take (0 to 1)
+    load = 0.0
+    for need, free in ((_req.get_min_cpu(), cpu), (_req.get_min_ram(), ram),
+                       (_req.get_min_disk(), disk)):
+        load = max(load, need / free if free > 0 else 1.0)
+    return min(load, 1.0)
+
+
+async def submit(cos_id: int, data: bytes):
     '''
         Broadcast a request to host a network application of Class of Service 
         (CoS) identified by cos_id, with data as input.
+
+        Coroutine run by the protocol's engine, so that many requests can be 
+        in flight from a single thread.
+
+        Returns received result if executed, None if not.
     '''
 
     req_id = gen_req_id()
     req = Request(req_id, cos_dict[cos_id], data)
     requests[req_id] = req
 
+    # small input is piggybacked on resource reservation requests (unless
+    # they are broadcast at layer 2 with PROTO_HRES_BACKOFF, as every host
+    # would receive it)
+    fast = (data if 0 < len(data) <= PROTO_FAST_SIZE
+            and not engine.fragmented(data) and not PROTO_HRES_BACKOFF
+            else None)
+
     hreq_rt = PROTO_RETRIES
-    hres = None
+    # hosts reserved from the directory (each is tried once)
+    tried = set()
 
     # dres_at is checked throughout in case of late dres from another host
 
-    while not hres and hreq_rt and not req.dres_at:
+    while hreq_rt and not req.dres_at:
         req.host = None
         req.state = HREQ
         attempt = req.new_attempt()
@@ -440,151 +716,72 @@ def send_request(cos_id: int, data: bytes):
         attempt.hreq_at = time()
         if not req.hreq_at:
             req.hreq_at = attempt.hreq_at
+        # skip host request if a host recently offered resources for the
+        # same CoS, or announced enough of them (reservation is checked by
+        # the host anyway)
+        offer = offer_cache.get(req.cos.id)
+        host = offer.host if offer else directory.get(req.cos, tried)
+        if host:
+            attempt.hres_at = attempt.hreq_at
+            attempt.state = RREQ
+            req.state = RREQ
+            req.host = host
+            attempt.host = req.host
+            if offer:
+                console.info('Using cached host offer from %s', host)
+            else:
+                console.info('Using capacity announced by %s', host)
+                tried.add(host)
+            if await _reserve(req, attempt, fast):
+                if await _exchange_data(req, attempt, data):
+                    Thread(target=save_req, args=(req,), daemon=True).start()
+                    return req.result
+            # host cancelled or didn't answer, so fall back to host request
+            # (without counting this attempt)
+            offer_cache.invalidate(req.cos.id, host)
+            if not offer:
+                directory.invalidate(host)
+            continue
         console.info('Broadcasting host request')
         if PROTO_VERBOSE:
             print(req)
+        retry = PROTO_RETRIES - hreq_rt
         hreq_rt -= 1
-        # send broadcast and wait for first response
-        hres = srp1(Ether(dst=BROADCAST_MAC)
-                    / IP(dst=BROADCAST_IP)
-                    / MyProtocol(state=HREQ, req_id=req_id, cos_id=req.cos.id,
-                                 attempt_no=attempt.attempt_no),
-                    timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
+        # send broadcast and collect responses (for PROTO_OFFER_WINDOW after
+        # the first one), then keep the best one according to
+        # PROTO_OFFER_POLICY
+        # (to the multicast group of the CoS, if PROTO_MCAST_BASE)
+        dst, dst_mac = _hreq_dst(req.cos.id)
+        offers = await engine.gather(
+            Message(state=HREQ, req_id=req_id, cos_id=req.cos.id,
+                    attempt_no=attempt.attempt_no, deadline=get_deadline(req)),
+            dst, (HRES,), window=PROTO_OFFER_WINDOW, dst_mac=dst_mac,
+            retry=retry)
+        offers = rank(offers, req.cos, PROTO_OFFER_POLICY, attempt.hreq_at)
+        hres = offers[0] if offers else None
         if hres and not req.dres_at:
             attempt.hres_at = time()
             attempt.state = RREQ
             req.state = RREQ
-            req.host = hres[IP].src
+            req.host = hres.src
             attempt.host = req.host
-            console.info('Recv first host response from %s', req.host)
-            hres[MyProtocol].show()
+            console.info('Recv %d host response(s), best from %s',
+                         len(offers), req.host)
+            if PROTO_VERBOSE:
+                hres.show()
 
             hreq_rt = PROTO_RETRIES
-            rreq_rt = PROTO_RETRIES
-            rres = None
-            while not rres and rreq_rt and not req.dres_at:
-                console.info('Send resource reservation request to %s',
-                             req.host)
-                if PROTO_VERBOSE:
-                    print(req)
-                rreq_rt -= 1
-                # send and wait for response
-                rres = sr1(IP(dst=req.host)
-                           / MyProtocol(state=RREQ, req_id=req_id),
-                           timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
-                if rres and not req.dres_at:
-                    # if late response from previous host
-                    # cancel (in MyProtocolAM)
-                    # and wait for rres from current host
-                    if rres[IP].src != req.host:
-                        try:
-                            rres = sniff(
-                                lfilter=(lambda pkt: (
-                                    IP in pkt
-                                    and pkt[IP].src == req.host
-                                    and MyProtocol in pkt
-                                    and pkt[MyProtocol].req_id == req_id
-                                    and (pkt[MyProtocol].state == RRES
-                                         or pkt[MyProtocol].state == RCAN))),
-                                filter='inbound', count=1, iface=MY_IFACE,
-                                timeout=PROTO_TIMEOUT)[0]
-                        except:
-                            rres = None
-                            continue
-                    # if cancelled from provider (maybe resources became no
-                    # longer sufficient between hres and rreq)
-                    if rres[MyProtocol].state == RCAN:
-                        console.info('Recv resource reservation cancellation '
-                                     'from', req.host)
-                        rres[MyProtocol].show()
-                        # re-send hreq
-                        attempt.state = RCAN
-                        continue
-                    attempt.rres_at = time()
-                    attempt.state = DREQ
-                    req.state = DREQ
-                    console.info('Recv resource reservation response from %s',
-                                 req.host)
-                    rres[MyProtocol].show()
-
-                    dreq_rt = PROTO_RETRIES
-                    dres = None
-                    while not dres and dreq_rt and not req.dres_at:
-                        console.info('Send data exchange request to %s',
-                                     req.host)
-                        if PROTO_VERBOSE:
-                            print(req)
-                        dreq_rt -= 1
-                        # send and wait for response
-                        dres = sr1(IP(dst=req.host)
-                                   / MyProtocol(state=DREQ, req_id=req_id,
-                                                attempt_no=attempt.attempt_no,
-                                                data=data),
-                                   timeout=PROTO_TIMEOUT, verbose=0,
-                                   iface=MY_IFACE)
-                        if dres and not req.dres_at:
-                            # if still executing, wait
-                            if (dres[IP].src == req.host
-                                    and dres[MyProtocol].state == DWAIT):
-                                dreq_rt = PROTO_RETRIES
-                                console.info('%s still executing', req_id)
-                            # if response from previous host
-                            # let MyProtocolAM handle it
-                            if dres[IP].src != req.host:
-                                dreq_rt += 1
-                            if (dres[IP].src != req.host
-                                or (dres[IP].src == req.host
-                                    and dres[MyProtocol].state == DWAIT)):
-                                try:
-                                    # while waiting, sniff for dres
-                                    dres = sniff(
-                                        lfilter=(lambda pkt: (
-                                            IP in pkt
-                                            and pkt[IP].src == req.host
-                                            and MyProtocol in pkt
-                                            and pkt[MyProtocol].req_id == req_id
-                                            and pkt[MyProtocol].state == DRES)),
-                                        filter='inbound', count=1,
-                                        iface=MY_IFACE,
-                                        timeout=PROTO_TIMEOUT)[0]
-                                except:
-                                    dres = None
-                                    continue
-                            if dres[MyProtocol].state == DCAN:
-                                console.info('Recv data exchange cancellation '
-                                             'from %s', req.host)
-                                dres[MyProtocol].show()
-                                # re-send hreq
-                                attempt.state = DCAN
-                                continue
-                            if not req.dres_at:
-                                req.dres_at = time()
-                                req.state = DRES
-                                req.result = dres.data
-                                attempt.dres_at = req.dres_at
-                                attempt.state = DRES
-                                console.info('Recv data exchange response '
-                                             'from %s', req.host)
-                                dres[MyProtocol].show()
-                                console.info('Send data exchange '
-                                             'acknowledgement to %s', req.host)
-                                if PROTO_VERBOSE:
-                                    print(req)
-                                send(IP(dst=req.host)
-                                     / MyProtocol(state=DACK, req_id=req_id),
-                                     verbose=0, iface=MY_IFACE)
-                            Thread(target=save_req, args=(
-                                req,), daemon=True).start()
-                            return req.result
-                        elif not req.dres_at:
-                            console.info('No data')
-                    hres = None
-                    if dreq_rt == 0:
-                        # dres could arrive later
-                        req._late = True
-                elif not req.dres_at:
-                    console.info('No resources')
-            hres = None
+            # latency-critical CoS are sent to more than one host
+            if (len(offers) > 1 and req.cos.get_max_response_time()
+                    <= PROTO_HEDGE_RESPONSE_TIME):
+                hosts = [offer.src for offer in offers[:PROTO_HEDGE_HOSTS]]
+                if await _hedge(req, attempt, hosts, data, fast):
+                    Thread(target=save_req, args=(req,), daemon=True).start()
+                    return req.result
+            elif await _reserve(req, attempt, fast):
+                if await _exchange_data(req, attempt, data):
+                    Thread(target=save_req, args=(req,), daemon=True).start()
+                    return req.result
         elif not req.dres_at:
             console.info('No hosts')
 
@@ -596,3 +793,231 @@ def send_request(cos_id: int, data: bytes):
     # if late dres
     if req.dres_at:
         return req.result
+
+
+async def _hedge(req: Request, attempt, hosts: list, data: bytes,
+                 fast: bytes = None):
+    # returns True if result is received from one of hosts, False if not
+    # the first host is sent requests right away, the others too, or only if
+    # the result is not received after PROTO_HEDGE_PERCENTILE of recent
+    # response times; the first result is kept, and the other hosts are
+    # cancelled (freeing their resources)
+    started = []
+
+    async def place(host):
+        started.append(host)
+        if await _reserve(req, attempt, fast, host):
+            return await _exchange_data(req, attempt, data, host)
+        return False
+
+    _hedges[req.id] = set(hosts)
+    hedge_stats['eligible'] += 1
+    start = time()
+    hedged = False
+    tasks = [create_task(place(hosts[0]))]
+    # (hosts are no longer waited for, however hedging ends, including if
+    # the request itself is cancelled)
+    try:
+        delay = _hedge_delay(req.cos.id)
+        if delay:
+            await wait(tasks, timeout=delay)
+        if not req.dres_at:
+            console.info('Hedging %s with %s', req.id, ', '.join(hosts[1:]))
+            hedged = True
+            hedge_stats['hedged'] += 1
+            hedge_stats['hedges'] += len(hosts) - 1
+            tasks += [create_task(place(host)) for host in hosts[1:]]
+        pending = set(tasks)
+        while pending and not req.dres_at:
+            _, pending = await wait(pending, return_when=FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        _hedges.pop(req.id, None)
+    if req.dres_at:
+        _latencies.setdefault(req.cos.id, deque(maxlen=LATENCIES_LEN)).append(
+            req.dres_at - start)
+        if req.host != hosts[0]:
+            hedge_stats['wins'] += 1
+        for host in started:
+            if host != req.host:
+                console.info('Send data exchange cancellation to %s', host)
+                hedge_stats['cancelled'] += 1
+                engine.send(Message(state=DCAN, req_id=req.id,
+                                    attempt_no=attempt.attempt_no), host)
+    if hedged:
+        console.info('Hedged %d of %d request(s), %.2f extra host(s) per '
+                     'request', hedge_stats['hedged'],
+                     hedge_stats['eligible'],
+                     hedge_stats['hedges'] / hedge_stats['eligible'])
+    return bool(req.dres_at)
+
+
+def _hedge_delay(cos_id: int):
+    # PROTO_HEDGE_PERCENTILE of recent response times of CoS (0 if not set,
+    # or if not enough response times yet)
+    times = _latencies.get(cos_id, ())
+    if not PROTO_HEDGE_PERCENTILE or len(times) < LATENCIES_MIN:
+        return 0
+    times = sorted(times)
+    return times[round(PROTO_HEDGE_PERCENTILE / 100 * (len(times) - 1))]
+
+
+async def _reserve(req: Request, attempt, data: bytes = None,
+                   host: str = None):
+    # returns True if resources are reserved by host (req.host if not
+    # given), False if not
+    # (if data is given, it is piggybacked, and the result may be received
+    # right away)
+    host = host or req.host
+    states = (RRES, RCAN, DWAIT, DRES, DCAN) if data else (RRES, RCAN)
+    rreq_rt = PROTO_RETRIES
+    while rreq_rt and not req.dres_at:
+        console.info('Send resource reservation request to %s', host)
+        if PROTO_VERBOSE:
+            print(req)
+        retry = PROTO_RETRIES - rreq_rt
+        rreq_rt -= 1
+        # send and wait for response
+        # (late responses from previous hosts are cancelled in MyProtocolAM)
+        rres = await engine.exchange(
+            Message(state=RREQ, req_id=req.id, attempt_no=attempt.attempt_no,
+                    cos_id=req.cos.id, deadline=get_deadline(req),
+                    data=data or b''),
+            host, states, src=host, retry=retry,
+            # (overheard by other hosts, to suppress their host responses)
+            dst_mac=BROADCAST_MAC if PROTO_HRES_BACKOFF else None)
+        if rres and not req.dres_at:
+            # if cancelled from provider (maybe resources became no longer
+            # sufficient between hres and rreq)
+            if rres.state in (RCAN, DCAN):
+                console.info('Recv resource reservation cancellation from %s',
+                             host)
+                if PROTO_VERBOSE:
+                    rres.show()
+                # re-send hreq
+                attempt.state = RCAN
+                offer_cache.invalidate(req.cos.id, host)
+                return False
+            attempt.rres_at = time()
+            attempt.state = DREQ
+            req.state = DREQ
+            # fast path (reserved and executing, or executed)
+            if rres.state != RRES:
+                console.info('Recv fast path response from %s', host)
+                if rres.state == DWAIT:
+                    console.info('%s still executing', req.id)
+                    rres = await engine.wait(
+                        engine.expect(req.id, attempt.attempt_no, (DRES,),
+                                      src=host), PROTO_TIMEOUT)
+                # (if result is not received, it is requested with a data
+                # exchange request)
+                if rres:
+                    await _accept_result(req, attempt, rres, host)
+                return True
+            console.info('Recv resource reservation response from %s',
+                         host)
+            if PROTO_VERBOSE:
+                rres.show()
+            return True
+        elif not req.dres_at:
+            console.info('No resources')
+    offer_cache.invalidate(req.cos.id, host)
+    return False
+
+
+async def _exchange_data(req: Request, attempt, data: bytes,
+                         host: str = None):
+    # returns True if result is received (from host, req.host if not given,
+    # or a late one from a previous host), False if not
+    host = host or req.host
+    # large input is sent over the bulk channel (and only if the host does
+    # not already hold it, PROTO_CAS_THRESHOLD)
+    data = store.wrap(data)
+    dreq_rt = PROTO_RETRIES
+    while dreq_rt and not req.dres_at:
+        console.info('Send data exchange request to %s', host)
+        if PROTO_VERBOSE:
+            print(req)
+        retry = PROTO_RETRIES - dreq_rt
+        dreq_rt -= 1
+        # send and wait for response
+        # (responses from previous hosts are handled in MyProtocolAM)
+        dres = await engine.exchange(
+            Message(state=DREQ, req_id=req.id, attempt_no=attempt.attempt_no,
+                    deadline=get_deadline(req), data=data),
+            host, (DRES, DWAIT, DCAN), src=host, retry=retry)
+        if dres and not req.dres_at:
+            # if still executing, wait
+            if dres.state == DWAIT:
+                dreq_rt = PROTO_RETRIES
+                console.info('%s still executing', req.id)
+                # while waiting, listen for dres
+                dres = await engine.wait(
+                    engine.expect(req.id, attempt.attempt_no, (DRES,),
+                                  src=host), PROTO_TIMEOUT)
+                if not dres:
+                    continue
+            if dres.state == DCAN:
+                console.info('Recv data exchange cancellation from %s',
+                             host)
+                if PROTO_VERBOSE:
+                    dres.show()
+                # re-send hreq
+                attempt.state = DCAN
+                offer_cache.invalidate(req.cos.id, host)
+                return False
+            if not await _accept_result(req, attempt, dres, host):
+                continue
+            return True
+        elif not req.dres_at:
+            console.info('No data')
+    if dreq_rt == 0:
+        # dres could arrive later
+        req._late = True
+    return bool(req.dres_at)
+
+
+async def _accept_result(req: Request, attempt, dres: Message, host: str):
+    # returns False if result could not be fetched, True if not (including if
+    # a result was already received)
+    if req.dres_at:
+        return True
+    # large result is fetched over the bulk channel
+    result = dres.data
+    if bulk.is_ref(result):
+        result = await get_running_loop().run_in_executor(
+            None, bulk.unwrap, result, dres.src)
+        if result is None:
+            return False
+    if not req.dres_at:
+        req.dres_at = time()
+        req.state = DRES
+        req.host = host
+        attempt.host = host
+        req.result = result
+        attempt.dres_at = req.dres_at
+        attempt.state = DRES
+        console.info('Recv data exchange response from %s', host)
+        if PROTO_VERBOSE:
+            dres.show()
+        console.info('Send data exchange acknowledgement to %s', host)
+        if PROTO_VERBOSE:
+            print(req)
+        engine.send(Message(state=DACK, req_id=req.id,
+                            attempt_no=attempt.attempt_no), host)
+    return True
+
+
+def send_request(cos_id: int, data: bytes):
+    '''
+        Broadcast a request to host a network application of Class of Service 
+        (CoS) identified by cos_id, with data as input.
+
+        Blocking wrapper over submit(cos_id, data), which is run by the 
+        protocol's engine.
+
+        Returns received result if executed, None if not.
+    '''
+
+    return engine.run(submit(cos_id, data))
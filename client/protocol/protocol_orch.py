@@ -16,9 +16,11 @@
 
     Methods:
     --------
-    send_request(cos_id, data): Send a request to the orchestrator to find 
-    a host for a network application of Class of Service (CoS) identified by 
-    cos_id, with data as input.
+    submit(cos_id, data): Coroutine sending a request to the orchestrator to 
+    find a host for a network application of Class of Service (CoS) 
+    identified by cos_id, with data as input.
+
+    send_request(cos_id, data): Blocking wrapper over submit(cos_id, data).
 '''
 
 
@@ -28,21 +30,25 @@
 
 
 from os import getenv
-from threading import Thread, Event
+from threading import Thread
+from asyncio import get_running_loop
 from time import time
 from datetime import datetime, timedelta
 
 from scapy.all import (Packet, ByteEnumField, StrLenField, IntEnumField,
-                       StrField, IntField, ConditionalField, AnsweringMachine,
-                       bind_layers, send, sendp, srp1, sr1, Ether, IP)
+                       StrField, IntField, SignedIntField, ShortField,
+                       LongField, ConditionalField, bind_layers, Ether, IP)
 
-from resources import (check_resources, reserve_resources, free_resources,
-                       execute)
-from network import MY_IFACE, MY_IP
+from resources import reserve_resources, renew_lease
+from network import MY_IP
 from common import IS_RESOURCE
 from model import Request
 from logger import console, file
 from utils import all_exit
+from engine import Engine
+from codec import Codec, Message
+from rtt import RttEstimator
+from responder import ResponderAM, bulk, store, pool, free_req, expired
 from settings import *
 from consts import *
 #import random
@@ -64,9 +70,6 @@ if ORCH_IP == None:
                'configuration')
     all_exit()
 
-# dict of data exchange events (keys are (src IP, request ID))
-_events = {}
-
 
 class MyProtocol(Packet):
     '''
@@ -84,7 +87,8 @@ class MyProtocol(Packet):
         reservation cancellation), DREQ (7) (data exchange request), DRES (8) 
         (data exchange response), DACK (9) (data exchange acknowledgement), 
         DCAN (10) (data exchange cancellation), DWAIT (11) (data exchange 
-        wait). Default is HREQ (1).
+        wait), DFRAG (12) (data exchange fragment), DSACK (13) (data exchange 
+        selective acknowledgement). Default is HREQ (1).
 
         req_id: String of 10 bytes indicating the request's ID. Default is ''.
 
@@ -95,9 +99,36 @@ class MyProtocol(Packet):
         is 1 (best-effort). Conditional field for state == HREQ (1) or state 
         == RREQ (3).
 
+        deadline: Signed integer of 4 bytes indicating the time (in ms) left 
+        before the request exceeds the max response time of its CoS, when 
+        it was sent (negative if already exceeded). Default is 0 (no 
+        deadline). Conditional field for state == HREQ (1) or state == DREQ 
+        (7) (reservation requests are relayed by the orchestrator).
+
+        kind: 1 byte indicating the state of the fragmented message, DREQ (7) 
+        or DRES (8). Default is DREQ (7). Conditional field for state == DFRAG 
+        (12) or state == DSACK (13).
+
+        seq: Integer of 4 bytes indicating the fragment's sequence number, or 
+        the first missing fragment's sequence number in acknowledgements. 
+        Default is 0. Conditional field for state == DFRAG (12) or state == 
+        DSACK (13).
+
+        frag_size: Short of 2 bytes indicating the size of fragments (all but 
+        the last one). Default is 0. Conditional field for state == DFRAG 
+        (12).
+
+        total: Integer of 4 bytes indicating the total size of the fragmented 
+        data. Default is 0. Conditional field for state == DFRAG (12).
+
+        bitmap: Long of 8 bytes indicating which of the 64 fragments following 
+        seq were received. Default is 0. Conditional field for state == DSACK 
+        (13).
+
         data: String of undefined number of bytes containing input data and 
-        possibly program to execute. Default is ''. Conditional field for 
-        state == DREQ (7) or state == DRES (8).
+        possibly program to execute (or a fragment of it). Default is ''. 
+        Conditional field for state == DREQ (7), state == DRES (8) or state 
+        == DFRAG (12).
 
         src_mac: String of 17 bytes indicating the source node's MAC address 
         (for intermediate communications between potential hosts and 
@@ -128,8 +159,21 @@ class MyProtocol(Packet):
         IntField('attempt_no', 1),
         ConditionalField(IntEnumField('cos_id', 1, cos_names),
                          lambda pkt: pkt.state == HREQ or pkt.state == RREQ),
+        ConditionalField(SignedIntField('deadline', 0),
+                         lambda pkt: pkt.state == HREQ or pkt.state == DREQ),
+        ConditionalField(ByteEnumField('kind', DREQ, proto_states),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(IntField('seq', 0),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(ShortField('frag_size', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(IntField('total', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(LongField('bitmap', 0),
+                         lambda pkt: pkt.state == DSACK),
         ConditionalField(StrField('data', ''),
-                         lambda pkt: pkt.state == DREQ or pkt.state == DRES),
+                         lambda pkt: pkt.state == DREQ or pkt.state == DRES
+                         or pkt.state == DFRAG),
         ConditionalField(StrLenField('src_mac', ' ' * MAC_LEN,
                                      lambda _: MAC_LEN),
                          lambda pkt: pkt.state == RREQ or pkt.state == RRES
@@ -183,51 +227,45 @@ class MyProtocol(Packet):
 
 
 # for scapy to be able to dissect MyProtocol packets
-bind_layers(Ether, MyProtocol)
-bind_layers(IP, MyProtocol)
-
-
-class MyProtocolAM(AnsweringMachine):
+# (only those with MyProtocol's EtherType/IP protocol number)
+bind_layers(Ether, MyProtocol, type=PROTO_ETHER_TYPE)
+bind_layers(IP, MyProtocol, proto=PROTO_IP_PROTO)
+
+# consumer side (single receive socket shared by all requests), also used by
+# the provider side for large data (fragmented)
+# (timeouts are estimated per peer, PROTO_TIMEOUT being the initial value and
+# upper bound)
+engine = Engine(Codec(SEND_TO_ORCHESTRATOR, PROTO_IP_PROTO,
+                      PROTO_ETHER_TYPE),
+                RttEstimator(PROTO_TIMEOUT, PROTO_TIMEOUT),
+                frag_size=PROTO_FRAG_SIZE, window=PROTO_WINDOW,
+                retries=PROTO_RETRIES)
+# duplicates of request messages already answered (consumer retries) are
+# answered by the engine with the cached replies
+engine.replies = replies
+# entries of the tables of requests expire on the engine's timer wheel
+requests_.schedule = finished.schedule = engine.call_later
+
+
+class MyProtocolAM(ResponderAM):
     '''
-        Class deriving from Scapy's AnsweringMachine class to define the 
-        protocol's responder, which takes decisions and builds and sends 
+        Class deriving from ResponderAM to define the protocol's responder 
+        in ORCHESTRATOR mode, which takes decisions and builds and sends 
         replies to received packets based on the protocol's state.
     '''
 
     function_name = 'mpam'
-    sniff_options = {'filter': 'inbound', 'iface': MY_IFACE}
-    send_function = staticmethod(send)
-    send_options = {'iface': MY_IFACE}
-
-    def is_request(self, req):
-        # a packet must have Ether, IP and MyProtocol layers
-        return (Ether in req and IP in req and MyProtocol in req
-                # and no other layer
-                and not any((layer is not Ether
-                             and layer is not IP
-                             and layer is not MyProtocol)
-                            for layer in req.layers())
-                # and not self
-                and req[IP].src != MY_IP
-                and req[IP].src != DEFAULT_IP
-                # and must have an ID
-                and req[MyProtocol].req_id)
-
-    def make_reply(self, req):
-        my_proto = req[MyProtocol]
-        ip_src = req[IP].src
-        req_id = my_proto.req_id.decode()
-        _req_id = (ip_src, req_id)
-        state = my_proto.state
-        att_no = my_proto.attempt_no
-
-        _req = requests_.get(_req_id, None)
-        my_req = requests.get(req_id, None)
-        if my_req:
-            att = my_req.attempts.get(att_no, None)
-
+    protocol = MyProtocol
+    engine = engine
+    cancelled = RCAN
+    # replies to DREQ cached for their duplicates (others may change on
+    # retry)
+    cached_requests = (DREQ,)
+    cached_replies = (DWAIT, DRES)
+
+    def _on_rreq(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # provider receives resource reservation request
-        if state == RREQ and ip_src == ORCH_IP and IS_RESOURCE:
+        if ip_src == ORCH_IP and IS_RESOURCE:
             ip_src = my_proto.src_ip.decode().strip()
             _req_id = (ip_src, req_id)
             _req = requests_.get(_req_id, None)
@@ -243,34 +281,36 @@ class MyProtocolAM(AnsweringMachine):
                              'orchestrator')
                 my_proto.show()
                 console.info('Reserving resources')
-                # if resources are actually reserved
-                if reserve_resources(_req):
+                # if resources are actually reserved (and execution can be
+                # queued, work that cannot be started is not accepted)
+                if not pool.full() and reserve_resources(_req, _req_id):
                     _req.state = RRES
                     _req._freed = False
                 # else they became no longer sufficient in time between
                 # HREQ and RREQ
                 else:
-                    console.info('Resources are not sufficient '
-                                 '(will exceed limit)')
+                    console.info('Resources (or execution queue) are not '
+                                 'sufficient (will exceed limit)')
                     console.info('Send resource reservation cancellation to '
                                  'orchestrator')
                     _req.state = RREQ
                     my_proto.state = RCAN
                     return (IP(dst=ORCH_IP) / my_proto)
             # if resources reserved
+            # (run in the engine, so no thread is held per reservation)
             if _req.state == RRES:
-                Thread(target=self._respond_resources,
-                       args=(my_proto, _req_id, _req), daemon=True).start()
+                engine.spawn(self._respond_resources(my_proto, _req_id, _req))
             return
 
+    def _on_dreq(self, req, my_proto, ip_src, req_id, _req, my_req, att):
+        _req_id = (ip_src, req_id)
+
         # provider receives data exchange request
-        if state == DREQ and _req:
-            if _req_id in _events:
-                _events[_req_id].set()
+        if _req:
             # already executed
             if _req.state == DRES:
                 my_proto.state = DRES
-                my_proto.data = _req.result
+                my_proto.data = bulk.wrap(_req.result)
                 return IP(dst=ip_src) / my_proto
             # still executing
             if _req.state == DREQ and _req._thread != None:
@@ -278,61 +318,61 @@ class MyProtocolAM(AnsweringMachine):
                 return IP(dst=ip_src) / my_proto
             console.info('Recv data exchange request from %s', ip_src)
             my_proto.show()
-            # if request was cancelled before
-            if _req.state == RCAN:
-                # if resources are still available
-                if check_resources(_req, quiet=True):
-                    console.info('This request arrived late, '
-                                 'but resources are still available')
-                    console.info('Reserving resources')
-                    reserve_resources(_req)
-                    _req.state = RRES
-                    _req._freed = False
-                else:
-                    console.info('This request arrived late, '
-                                 'and resources are no longer sufficient '
-                                 '(will exceed limit)')
-                    console.info('Send data exchange cancellation to %s',
-                                 ip_src)
-                    _req.state = DCAN
-                    my_proto.state = DCAN
-                    my_proto.src_mac = req[Ether].src
-                    my_proto.src_ip = ip_src.ljust(IP_LEN, ' ')
-                    my_proto.host_mac = req[Ether].dst
-                    my_proto.host_ip = req[IP].dst.ljust(IP_LEN, ' ')
-                    return IP(dst=ip_src) / my_proto
+            # consumer can no longer meet its deadline (so reservation, if
+            # any, is released)
+            if expired(_req, my_proto.deadline):
+                console.info('Deadline of %s passed', req_id)
+                free_req(_req_id, _req)
+                _req.state = RCAN
+                return self._cancel(req, my_proto, ip_src)
+            # result of the same input already cached (no need to reserve
+            # resources nor to execute)
+            reply = self._memoized(my_proto, ip_src, _req)
+            if reply:
+                return reply
+            # if request was cancelled before (and resources are no longer
+            # available)
+            if _req.state == RCAN and not self._reserve_late(ip_src, _req):
+                return self._cancel(req, my_proto, ip_src)
             # new execution
             if _req.state == RRES:
                 _req.state = DREQ
-                th = Thread(
-                    target=self._respond_data,
-                    args=(my_proto, ip_src, _req_id, _req), daemon=True)
-                _req._thread = th
-                th.start()
+                if not self._queue(my_proto, ip_src, _req):
+                    _req.state = RCAN
+                    return self._cancel(req, my_proto, ip_src)
             return
 
+    def _on_dres(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # consumer receives late data exchange response
-        if state == DRES and my_req:
+        if my_req:
             # if no other response was already accepted
             if not my_req.dres_at:
-                dres_at = time()
-                my_req.dres_at = dres_at
-                my_req.state = DRES
-                my_req.host = ip_src
-                my_req.result = my_proto.data
-                if att:
-                    att.state = DRES
-                    att.dres_at = dres_at
-                console.info('Recv data exchange response from %s', ip_src)
-                my_proto.show()
-                if req_id in _events:
-                    _events[req_id].set()
-                console.info('Send data exchange acknowledgement to '
-                             'orchestrator')
-                my_proto.state = DACK
-                my_proto.host_mac = req[Ether].src
-                my_proto.host_ip = ip_src.ljust(IP_LEN, ' ')
-                return IP(dst=ORCH_IP) / my_proto
+                # if response from previous host, accept (responses of the
+                # current host are handled, and their large results
+                # fetched, by the engine)
+                if ip_src != my_req.host and my_req._late:
+                    # large result is fetched over the bulk channel
+                    result = bulk.unwrap(my_proto.data, ip_src)
+                    if result is None or my_req.dres_at:
+                        return
+                    dres_at = time()
+                    my_req.dres_at = dres_at
+                    my_req.state = DRES
+                    my_req.host = ip_src
+                    my_req.result = result
+                    if att:
+                        att.state = DRES
+                        att.dres_at = dres_at
+                    console.info('Recv late data exchange response from %s',
+                                 ip_src)
+                    my_proto.show()
+                    console.info('Send data exchange acknowledgement to '
+                                 'orchestrator')
+                    my_proto.state = DACK
+                    my_proto.host_mac = req[Ether].src
+                    my_proto.host_ip = ip_src.ljust(IP_LEN, ' ')
+                    return IP(dst=ORCH_IP) / my_proto
+                return
             # if response already received
             else:
                 console.info('Recv late data exchange response from %s, '
@@ -355,24 +395,20 @@ class MyProtocolAM(AnsweringMachine):
                     my_proto.host_ip = ip_src.ljust(IP_LEN, ' ')
                     return IP(dst=ORCH_IP) / my_proto
 
+    def _on_dack(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # provider receives data exchange acknowledgement
-        if state == DACK and ip_src == ORCH_IP:
+        if ip_src == ORCH_IP:
             _req_id = (my_proto.src_ip.decode().strip(), req_id)
             if _req_id in requests_ and requests_[_req_id].state == DRES:
                 console.info('Recv data exchange acknowledgement from '
                              'orchestrator')
                 my_proto.show()
-                if _req_id in _events:
-                    _events[_req_id].set()
-                # only free resources if still reserved
-                if not requests_[_req_id]._freed:
-                    console.info('Freeing resources')
-                    free_resources(requests_[_req_id])
-                    requests_[_req_id]._freed = True
+                free_req(_req_id, requests_[_req_id])
             return
 
+    def _on_dcan(self, req, my_proto, ip_src, req_id, _req, my_req, att):
         # provider receives data exchange cancellation
-        if state == DCAN and ip_src == ORCH_IP:
+        if ip_src == ORCH_IP:
             ip_src = my_proto.src_ip.decode().strip()
             _req_id = (ip_src, req_id)
             _req = requests_.get(_req_id, None)
@@ -380,44 +416,55 @@ class MyProtocolAM(AnsweringMachine):
                 console.info('Recv data exchange cancellation from '
                              'orchestrator')
                 my_proto.show()
-                if _req_id in _events:
-                    _events[_req_id].set()
-                # only free resources if still reserved
-                if not _req._freed:
-                    console.info('Freeing resources')
-                    free_resources(_req)
-                    _req._freed = True
-
-    def _respond_resources(self, my_proto, _req_id, _req):
-        my_proto.state = RRES
+                free_req(_req_id, _req)
+
+    # handlers of received messages (keys are states)
+    _handlers = {RREQ: _on_rreq, DREQ: _on_dreq, DRES: _on_dres,
+                 DACK: _on_dack, DCAN: _on_dcan}
+
+    async def _respond_resources(self, my_proto, _req_id, _req):
+        rres = Message(state=RRES, req_id=_req.id,
+                       attempt_no=my_proto.attempt_no,
+                       src_mac=my_proto.src_mac.decode().strip(),
+                       src_ip=my_proto.src_ip.decode().strip())
+        # (duplicate resource reservation requests are answered from the
+        # reply cache, instead of starting another response)
+        replies.put((ORCH_IP, _req.id, rres.attempt_no, RREQ),
+                    engine.encode(rres, ORCH_IP), ORCH_IP, _req_id)
         retries = PROTO_RETRIES
         rack = None
         while not rack and retries and _req.state == RRES:
+            renew_lease(_req_id)
             console.info('Send resource reservation response to orchestrator')
+            timeout = engine.rtt.timeout(ORCH_IP, PROTO_RETRIES - retries)
             retries -= 1
-            rack = sr1(IP(dst=ORCH_IP) / my_proto,
-                       timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
+            rack = await engine.exchange(rres, ORCH_IP, (RACK, RCAN),
+                                         src=ORCH_IP, timeout=timeout)
         if rack:
-            if rack[MyProtocol].state == RCAN:
+            if rack.state == RCAN:
                 console.info('Recv resource reservation cancellation from '
                              'orchestrator')
-                rack[MyProtocol].show()
+                if PROTO_VERBOSE:
+                    rack.show()
+                replies.discard(_req_id, rres.attempt_no)
                 # only free resources if still reserved
                 if _req.state == RRES:
                     _req.state = RCAN
-                    console.info('Freeing resources')
-                    free_resources(_req)
+                    free_req(_req_id, _req)
             else:
                 console.info('Recv resource reservation acknowledgement from '
                              'orchestrator')
-                rack[MyProtocol].show()
-                ev = Event()
-                _events[_req_id] = ev
-                ev.wait(PROTO_RETRIES * PROTO_TIMEOUT)
-                if not ev.is_set():
+                if PROTO_VERBOSE:
+                    rack.show()
+                # reservation is held until the data exchange request
+                dreq = await engine.wait(
+                    engine.expect(_req.id, rres.attempt_no, (DREQ,),
+                                  src=_req_id[0]),
+                    PROTO_RETRIES * PROTO_TIMEOUT)
+                if not dreq and _req.state == RRES:
+                    replies.discard(_req_id, rres.attempt_no)
                     console.info('Waiting for data exchange request timed out')
-                    console.info('Freeing resources')
-                    free_resources(_req)
+                    free_req(_req_id, _req)
                     _req.state = RCAN
                     # console.info('Send resource reservation cancellation to '
                     #              'orchestrator')
@@ -426,54 +473,58 @@ class MyProtocolAM(AnsweringMachine):
             return
         # only free resources if still reserved
         elif _req.state == RRES:
+            replies.discard(_req_id, rres.attempt_no)
             _req.state = RCAN
             console.info('Waiting for resource reservation acknowledgement '
                          'timed out')
-            console.info('Freeing resources')
-            free_resources(_req)
+            free_req(_req_id, _req)
             console.info('Send resource reservation cancellation to '
                          'orchestrator')
-            my_proto.state = RCAN
-            send(IP(dst=ORCH_IP) / my_proto, verbose=0, iface=MY_IFACE)
-
-    def _respond_data(self, my_proto, ip_src, _req_id, _req):
-        #execution_time=random.randint(10,50)
-        #console.info('Executing for %s', execution_time)
-        #sleep(execution_time)
-        
-        console.info('Executing CoS: %s  for %s ip_src', str(_req.cos.id), str(ip_src) )
-        res = execute(my_proto.data,ip_src, _req.cos.id)
-        
-        # save result locally
-        _req.result = res
-        _req.state = DRES
-        my_proto.state = DRES
-        my_proto.data = res
+            rres.state = RCAN
+            engine.send(rres, ORCH_IP)
+
+    def _address(self, my_proto, ip_src, req=None):
+        # (the orchestrator relays cancellations between the consumer and
+        # the host)
+        my_proto.src_ip = ip_src.ljust(IP_LEN, ' ')
+        my_proto.host_ip = (req[IP].dst if req else MY_IP).ljust(IP_LEN, ' ')
+        if req:
+            my_proto.src_mac = req[Ether].src
+            my_proto.host_mac = req[Ether].dst
+
+    async def _send_result(self, dres: Message, ip_src, _req):
+        # duplicates of the data exchange request (answered with DWAIT until
+        # now) are answered with the result
+        if engine.fragmented(dres.data):
+            replies.discard((ip_src, _req.id), dres.attempt_no)
+        else:
+            replies.update((ip_src, _req.id), dres.attempt_no,
+                           engine.encode(dres, ip_src))
         retries = PROTO_RETRIES
-        ev = Event()
-        _events[_req_id] = ev
-        while retries:
+        ack = None
+        while not ack and retries:
+            renew_lease((ip_src, _req.id))
             console.info('Send data exchange response to %s', ip_src)
+            timeout = engine.rtt.timeout(ip_src, PROTO_RETRIES - retries)
             retries -= 1
-            send(IP(dst=ip_src) / my_proto, verbose=0, iface=MY_IFACE)
-            ev.wait(PROTO_TIMEOUT)
-            if ev.is_set():
-                return
-        if not ev.is_set():
+            # sent by the engine (fragmented if too large for a single
+            # packet), and acknowledged (or cancelled) by the orchestrator
+            ack = await engine.exchange(dres, ip_src, (DACK, DCAN),
+                                        src=ORCH_IP, timeout=timeout)
+        if not ack:
             console.info('Waiting for data exchange acknowledgement timed out')
-            # only free resources if still reserved
-            if not _req._freed:
-                console.info('Freeing resources')
-                free_resources(_req)
-                _req._freed = True
+            free_req((ip_src, _req.id), _req)
 
 
-def send_request(cos_id: int, data: bytes):
+async def submit(cos_id: int, data: bytes):
     '''
         Send a request to the orchestrator to find a host for a network 
         application of Class of Service (CoS) identified by cos_id, with data 
         as input.
 
+        Coroutine run by the protocol's engine, so that many requests can be 
+        in flight from a single thread.
+
         Returns received result if executed, None if not.
     '''
 
@@ -482,11 +533,10 @@ def send_request(cos_id: int, data: bytes):
     requests[req_id] = req
 
     hreq_rt = PROTO_RETRIES
-    hres = None
 
     # dres_at is checked throughout in case of late dres from another host
 
-    while not hres and hreq_rt and not req.dres_at:
+    while hreq_rt and not req.dres_at:
         req.host = None
         req.state = HREQ
         attempt = req.new_attempt()
@@ -499,84 +549,28 @@ def send_request(cos_id: int, data: bytes):
             print(req)
         hreq_rt -= 1
         # send request to orchestrator and wait for response
-        hres = srp1(Ether(dst=ORCH_MAC)
-                    / IP(dst=ORCH_IP)
-                    / MyProtocol(state=HREQ, req_id=req_id, cos_id=req.cos.id,
-                                 attempt_no=attempt.attempt_no),
-                    timeout=PROTO_TIMEOUT * PROTO_RETRIES, verbose=0,
-                    iface=MY_IFACE)
+        # (fixed timeout of all retries, not derived from RTT estimates nor
+        # sampled, since the orchestrator searches for a host before
+        # answering)
+        hres = await engine.exchange(
+            Message(state=HREQ, req_id=req_id, cos_id=req.cos.id,
+                    attempt_no=attempt.attempt_no, deadline=get_deadline(req)),
+            ORCH_IP, (HRES,), src=ORCH_IP,
+            timeout=PROTO_TIMEOUT * PROTO_RETRIES, dst_mac=ORCH_MAC)
         if hres and not req.dres_at:
             attempt.hres_at = time()
             attempt.state = DREQ
-            attempt.host = hres[MyProtocol].host_ip.decode().strip()
+            attempt.host = hres.host_ip
             req.state = DREQ
             req.host = attempt.host
             console.info('Recv host response from orchestrator')
-            hres[MyProtocol].show()
+            if PROTO_VERBOSE:
+                hres.show()
 
             hreq_rt = PROTO_RETRIES
-            dreq_rt = PROTO_RETRIES
-            dres = None
-            while not dres and dreq_rt and not req.dres_at:
-                console.info('Send data exchange request to %s', req.host)
-
-                if PROTO_VERBOSE:
-                    print(req)
-                dreq_rt -= 1
-                # send and wait for response
-                host_mac = hres[MyProtocol].host_mac
-                dres = srp1(Ether(dst=host_mac)
-                            / IP(dst=req.host)
-                            / MyProtocol(state=DREQ, req_id=req_id,
-                                         attempt_no=attempt.attempt_no,
-                                         data=data),
-                            timeout=PROTO_TIMEOUT, verbose=0, iface=MY_IFACE)
-                if dres and not req.dres_at:
-                    # if still executing, wait
-                    if dres[MyProtocol].state == DWAIT:
-                        dreq_rt = PROTO_RETRIES
-                        console.info('%s still executing', req_id)
-                        _events[req_id] = Event()
-                        _events[req_id].wait(PROTO_TIMEOUT)
-                        if not _events[req_id].is_set():
-                            dres = None
-                            continue
-                    if dres[MyProtocol].state == DCAN:
-                        console.info(
-                            'Recv data exchange cancellation from %s',
-                            req.host)
-                        dres[MyProtocol].show()
-                        # re-send hreq
-                        attempt.state = DCAN
-                        continue
-                    if not req.dres_at:
-                        req.dres_at = time()
-                        req.state = DRES
-                        req.result = dres.data
-                        attempt.dres_at = req.dres_at
-                        attempt.state = DRES
-                        console.info('Recv data exchange response from %s',
-                                     req.host)
-                        dres[MyProtocol].show()
-
-                        console.info('Send data exchange acknowledgement to '
-                                     'orchestrator')
-                        if PROTO_VERBOSE:
-                            print(req)
-                        sendp(Ether(dst=ORCH_MAC)
-                              / IP(dst=ORCH_IP)
-                              / MyProtocol(state=DACK, req_id=req_id,
-                                           host_ip=req.host.ljust(IP_LEN, ' '),
-                                           host_mac=host_mac),
-                              verbose=0, iface=MY_IFACE)
-                    Thread(target=save_req, args=(req,), daemon=True).start()
-                    return req.result
-                elif not req.dres_at:
-                    console.info('No data')
-            hres = None
-            if dreq_rt == 0:
-                # dres could arrive later
-                req._late = True
+            if await _exchange_data(req, attempt, data, hres.host_mac):
+                Thread(target=save_req, args=(req,), daemon=True).start()
+                return req.result
         elif not req.dres_at:
             console.info('No hosts')
 
@@ -588,3 +582,93 @@ def send_request(cos_id: int, data: bytes):
     # if late dres
     if req.dres_at:
         return req.result
+
+
+async def _exchange_data(req: Request, attempt, data: bytes, host_mac: str):
+    # returns True if result is received (from req.host or a late one from a
+    # previous host), False if not
+    # large input is sent over the bulk channel (and only if the host does
+    # not already hold it, PROTO_CAS_THRESHOLD)
+    data = store.wrap(data)
+    dreq_rt = PROTO_RETRIES
+    while dreq_rt and not req.dres_at:
+        console.info('Send data exchange request to %s', req.host)
+        if PROTO_VERBOSE:
+            print(req)
+        retry = PROTO_RETRIES - dreq_rt
+        dreq_rt -= 1
+        # send and wait for response
+        dres = await engine.exchange(
+            Message(state=DREQ, req_id=req.id, attempt_no=attempt.attempt_no,
+                    deadline=get_deadline(req), data=data),
+            req.host, (DRES, DWAIT, DCAN), src=req.host, dst_mac=host_mac,
+            retry=retry)
+        if dres and not req.dres_at:
+            # if still executing, wait
+            if dres.state == DWAIT:
+                dreq_rt = PROTO_RETRIES
+                console.info('%s still executing', req.id)
+                # (acknowledged below, like a direct response)
+                dres = await engine.wait(
+                    engine.expect(req.id, attempt.attempt_no, (DRES,),
+                                  src=req.host), PROTO_TIMEOUT)
+                if not dres and not req.dres_at:
+                    continue
+            if dres and dres.state == DCAN:
+                console.info('Recv data exchange cancellation from %s',
+                             req.host)
+                if PROTO_VERBOSE:
+                    dres.show()
+                # re-send hreq
+                attempt.state = DCAN
+                return False
+            if not req.dres_at:
+                # large result is fetched over the bulk channel
+                result = dres.data if dres else None
+                if result and bulk.is_ref(result):
+                    result = await get_running_loop().run_in_executor(
+                        None, bulk.unwrap, result, dres.src)
+                    if result is None:
+                        continue
+            if not req.dres_at:
+                req.dres_at = time()
+                req.state = DRES
+                req.result = result
+                attempt.dres_at = req.dres_at
+                attempt.state = DRES
+                console.info('Recv data exchange response from %s', req.host)
+                if PROTO_VERBOSE:
+                    dres.show()
+
+                console.info('Send data exchange acknowledgement to '
+                             'orchestrator')
+                if PROTO_VERBOSE:
+                    print(req)
+                # (of the attempt answered, which the host's
+                # acknowledgement wait is keyed on)
+                engine.send(Message(state=DACK, req_id=req.id,
+                                    attempt_no=attempt.attempt_no,
+                                    host_ip=req.host, host_mac=host_mac),
+                            ORCH_IP, dst_mac=ORCH_MAC)
+            return True
+        elif not req.dres_at:
+            console.info('No data')
+    if dreq_rt == 0:
+        # dres could arrive later
+        req._late = True
+    return bool(req.dres_at)
+
+
+def send_request(cos_id: int, data: bytes):
+    '''
+        Send a request to the orchestrator to find a host for a network 
+        application of Class of Service (CoS) identified by cos_id, with data 
+        as input.
+
+        Blocking wrapper over submit(cos_id, data), which is run by the 
+        protocol's engine.
+
+        Returns received result if executed, None if not.
+    '''
+
+    return engine.run(submit(cos_id, data))
@@ -0,0 +1,140 @@
+'''
+    Provider-side cache of the last reply sent to each request message, as
+    encoded packets, so that a retransmitted request (consumer retry) is
+    answered again by the engine, as soon as it is decoded, without going
+    through the responder (no dissection, decision tree, resource check nor
+    logging).
+
+    Entries are keyed by (src IP, request ID, attempt number, state of the
+    request message), and grouped by owner (the key of the request in the
+    table of requests received as provider), so they can be dropped along
+    with it. Lookups take no lock (a single dict lookup); only updates do.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    ReplyCache: Size bounded cache of encoded replies.
+'''
+
+
+from threading import Lock
+
+
+class ReplyCache:
+    '''
+        Size bounded cache of encoded replies, keyed by (src IP, request ID,
+        attempt number, state) of the request message they answer.
+
+        Attributes:
+        -----------
+        size: Max number of cached replies (oldest are evicted first). 0
+        disables the cache.
+
+        stats: Dict of counters: 'hits' (duplicates answered from the
+        cache), 'stored', 'evictions' and 'dropped' (replies dropped along
+        with their request, or because they no longer apply).
+
+        Methods:
+        --------
+        get(key): Returns (packet, dst IP) replying to key, None if not
+        cached.
+
+        put(key, packet, dst, owner): Cache packet (bytes, from the IP
+        header) replying to key, to be sent to dst.
+
+        update(owner, attempt_no, packet): Replace replies of attempt of
+        owner with packet (state of request changed, e.g. result ready).
+
+        discard(owner, attempt_no): Drop replies of attempt of owner.
+
+        drop(owner): Drop all replies of owner.
+    '''
+
+    def __init__(self, size: int):
+        self.size = size
+        self.stats = {'hits': 0, 'stored': 0, 'evictions': 0, 'dropped': 0}
+        # {key: (packet, dst)} (in order of insertion)
+        self._replies = {}
+        # {owner: set of keys}
+        self._owners = {}
+        # {key: owner}
+        self._keys = {}
+        self._lock = Lock()
+
+    def get(self, key: tuple):
+        '''
+            Returns (packet, dst IP) replying to key (src IP, request ID,
+            attempt number, state), None if not cached.
+        '''
+
+        # (no lock, a dict lookup is atomic)
+        reply = self._replies.get(key, None)
+        if reply:
+            self.stats['hits'] += 1
+        return reply
+
+    def __contains__(self, key: tuple):
+        return key in self._replies
+
+    def put(self, key: tuple, packet: bytes, dst: str, owner):
+        '''
+            Cache packet (bytes, from the IP header) replying to key (src IP,
+            request ID, attempt number, state), to be sent to dst. owner is
+            the key of the request the reply belongs to.
+        '''
+
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._replies.pop(key, None)
+            self._replies[key] = (packet, dst)
+            self._keys[key] = owner
+            self._owners.setdefault(owner, set()).add(key)
+            self.stats['stored'] += 1
+            while len(self._replies) > self.size:
+                self._remove(next(iter(self._replies)))
+                self.stats['evictions'] += 1
+
+    def update(self, owner, attempt_no: int, packet: bytes):
+        '''
+            Replace replies of attempt of owner with packet (bytes, from the
+            IP header, sent to the same destinations).
+        '''
+
+        with self._lock:
+            for key in self._owners.get(owner, ()):
+                if key[2] == attempt_no:
+                    self._replies[key] = (packet, self._replies[key][1])
+
+    def discard(self, owner, attempt_no: int):
+        '''
+            Drop replies of attempt of owner (they no longer apply).
+        '''
+
+        with self._lock:
+            for key in [key for key in self._owners.get(owner, ())
+                        if key[2] == attempt_no]:
+                self._remove(key)
+                self.stats['dropped'] += 1
+
+    def drop(self, owner):
+        '''
+            Drop all replies of owner.
+        '''
+
+        if owner not in self._owners:
+            return
+        with self._lock:
+            for key in list(self._owners.get(owner, ())):
+                self._remove(key)
+                self.stats['dropped'] += 1
+
+    def _remove(self, key: tuple):
+        del self._replies[key]
+        owner = self._keys.pop(key)
+        keys = self._owners[owner]
+        keys.discard(key)
+        if not keys:
+            del self._owners[owner]
@@ -0,0 +1,338 @@
+'''
+    Provider side shared by both modes of the protocol (BROADCAST and
+    ORCHESTRATOR): the objects holding its data and executions, and the base
+    of both responders, which handles the messages forwarded by the engine
+    and the executions of data exchange requests (DREQ).
+
+    Classes:
+    --------
+    ResponderAM: Class deriving from Scapy's AnsweringMachine class, base of
+    the protocol's responder of both modes.
+
+    Methods:
+    --------
+    free_req(_req_id, _req): Free resources reserved for request received as
+    provider, only once. Returns True if freed, False if already freed.
+
+    expired(_req, deadline): Returns True if the consumer's deadline of
+    request received as provider passed.
+'''
+
+
+# !!IMPORTANT!!
+# This module relies on config that is only present AFTER the connect()
+# method is called, so only import after
+
+
+from time import time
+
+from scapy.all import AnsweringMachine, send, Ether, IP
+
+from resources import (reserve_resources, free_resources, renew_lease,
+                       execute)
+from network import MY_IFACE, MY_IP
+from logger import console
+from codec import Message
+from bulk import BulkChannel
+from cas import ContentStore
+from pool import ExecutionPool, Job
+from dispatch import Dispatcher
+from memo import ResultCache
+from settings import *
+from consts import *
+
+
+# large inputs and results (only references are carried by MyProtocol)
+bulk = BulkChannel(PROTO_BULK_THRESHOLD, PROTO_BULK_PORT)
+# inputs received (only transferred if not already held, whoever sent them)
+store = ContentStore(PROTO_CAS_PATH, PROTO_CAS_SIZE, PROTO_CAS_THRESHOLD,
+                     bulk)
+# executions of the provider (bounded, queued requests are answered with
+# DWAIT, and scheduled by CoS)
+pool = ExecutionPool(PROTO_WORKERS, PROTO_QUEUE_SIZE, PROTO_MAX_QUEUE_WAIT)
+# received packets (processed in parallel across requests, and in order
+# for the same request)
+dispatcher = Dispatcher(PROTO_DISPATCH_WORKERS, PROTO_DISPATCH_QUEUE)
+# results of executions (of CoS in PROTO_MEMO_COS)
+memo = ResultCache(PROTO_MEMO_SIZE, PROTO_MEMO_TTL, PROTO_MEMO_COS)
+
+
+class ResponderAM(AnsweringMachine):
+    '''
+        Class deriving from Scapy's AnsweringMachine class, base of the
+        protocol's responder of both modes, which takes decisions and builds
+        and sends replies to received packets based on the protocol's state.
+
+        Subclasses set the class attributes below, the handlers of received
+        messages (_handlers, keys are states), and implement
+        _send_result(dres, ip_src, _req), the coroutine sending the result
+        of an execution.
+
+        Attributes:
+        -----------
+        protocol: MyProtocol class of the mode.
+
+        engine: Engine of the mode.
+
+        cancelled: State of a request received as provider whose reservation
+        was cancelled (a retried request reserves resources again).
+
+        cached_requests: States of request messages whose replies are
+        cached, to answer their duplicates.
+
+        cached_replies: States of the replies cached (others may change on
+        retry).
+    '''
+
+    send_function = staticmethod(send)
+    send_options = {'iface': MY_IFACE}
+    protocol = None
+    engine = None
+    cancelled = HREQ
+    cached_requests = (DREQ,)
+    cached_replies = (DWAIT, DRES)
+    _handlers = {}
+
+    def is_request(self, req):
+        # a packet must have Ether, IP and MyProtocol layers
+        # (checked on the layer chain directly instead of walking it, since
+        # this runs for every received packet)
+        ip = req.payload
+        my_proto = ip.payload
+        return (req.__class__ is Ether
+                and ip.__class__ is IP
+                and my_proto.__class__ is self.protocol
+                # and no other layer
+                and not my_proto.payload
+                # and not self
+                and ip.src != MY_IP
+                and ip.src != DEFAULT_IP
+                # and must have an ID
+                and my_proto.req_id)
+
+    def forward(self, msg: Message, frame: bytes):
+        '''
+            Handle message received by the engine (duplicates of requests
+            already answered are not forwarded, but answered by the engine
+            from the reply cache).
+        '''
+
+        # (dissected and processed by the dispatcher's workers, in parallel
+        # for different requests and in order for the same request, so the
+        # engine thread only queues frames)
+        dispatcher.submit(msg.req_id.encode(), self._forward, frame)
+
+    def reply(self, pkt, send_function=None, address=None):
+        # (processed by the dispatcher's workers, like forwarded frames)
+        if self.is_request(pkt):
+            dispatcher.submit(pkt.payload.payload.req_id, self._reply, pkt)
+
+    def _forward(self, frame: bytes):
+        pkt = Ether(frame)
+        if self.is_request(pkt):
+            self._reply(pkt)
+
+    def _reply(self, pkt):
+        reply = self.make_reply(pkt)
+        if reply:
+            self.send_reply(reply)
+
+    def deliver(self, msg: Message):
+        '''
+            Handle message reassembled by the engine (large DREQ/DRES) as if
+            it was received in a single packet.
+        '''
+
+        self.reply(Ether() / IP(src=msg.src, dst=msg.dst, proto=PROTO_IP_PROTO)
+                   / self.protocol(state=msg.state,
+                                   req_id=msg.req_id.encode(),
+                                   attempt_no=msg.attempt_no, data=msg.data))
+
+    def send_reply(self, reply, send_function=None):
+        my_proto = reply[self.protocol]
+        # too large for a single packet, so fragmented by the engine
+        if my_proto.state == DRES and self.engine.fragmented(my_proto.data):
+            self.engine.spawn(self.engine.transfer(
+                Message(state=DRES, req_id=my_proto.req_id.decode(),
+                        attempt_no=my_proto.attempt_no, data=my_proto.data),
+                reply[IP].dst))
+            return
+        super().send_reply(reply, send_function)
+
+    def make_reply(self, req):
+        my_proto = req[self.protocol]
+        ip_src = req[IP].src
+        req_id = my_proto.req_id.decode()
+        state = my_proto.state
+        # (table-driven, by state of the received message)
+        handler = self._handlers.get(state, None)
+        if not handler:
+            return
+        key = (ip_src, req_id, my_proto.attempt_no, state)
+
+        _req = requests_.get(key[:2], None)
+        my_req = get_req(req_id)
+        att = my_req.attempts.get(key[2], None) if my_req else None
+        reply = handler(self, req, my_proto, ip_src, req_id, _req, my_req,
+                        att)
+        # (my_proto is reused by the reply)
+        if (reply and state in self.cached_requests
+                and my_proto.state in self.cached_replies
+                and not (my_proto.state == DRES
+                         and self.engine.fragmented(my_proto.data))):
+            replies.put(key, bytes(reply), reply[IP].dst, key[:2])
+        return reply
+
+    def _address(self, my_proto, ip_src, req=None):
+        # fill in the addresses of a cancellation sent by the provider to
+        # ip_src, in answer to req if any (none in BROADCAST mode)
+        pass
+
+    def _cancel(self, req, my_proto, ip_src):
+        # returns data exchange cancellation answering req
+        console.info('Send data exchange cancellation to %s', ip_src)
+        my_proto.state = DCAN
+        self._address(my_proto, ip_src, req)
+        return IP(dst=ip_src) / my_proto
+
+    def _reserve_late(self, ip_src, _req):
+        # reserve resources again for request cancelled before (its data
+        # exchange request arrived late)
+        # returns True if reserved, False if resources are no longer
+        # sufficient
+        console.info('This request arrived late, reserving resources')
+        if reserve_resources(_req, (ip_src, _req.id)):
+            console.info('Resources are still available')
+            _req.state = RRES
+            _req._freed = False
+            return True
+        console.info('Resources are no longer sufficient (will exceed limit)')
+        return False
+
+    def _queue(self, my_proto, ip_src, _req):
+        # queue execution of request (answered with DWAIT until done, and
+        # cancelled if the deadline passes in the queue)
+        # returns True if queued, False if the queue is full (resources are
+        # freed)
+        # (the job gets its own copy, as my_proto is reused by the reply)
+        job = Job(self._respond_data, my_proto.copy(), ip_src, _req,
+                  cos=_req.cos, deadline=_req._deadline,
+                  on_expire=self._expire_data)
+        _req._thread = job
+        # (lease held while queued, so it is not reclaimed under a long
+        # queue, renewed again by the worker)
+        renew_lease((ip_src, _req.id), _hold(_req))
+        if not pool.submit(job):
+            console.info('Execution queue is full')
+            _req._thread = None
+            free_req((ip_src, _req.id), _req)
+            return False
+        # (wait times are reported by pool.report())
+        console.info('Execution queued (depth %d, %d executing)',
+                     pool.depth(), pool.busy())
+        return True
+
+    def _memoized(self, my_proto, ip_src, _req):
+        # returns data exchange response if result of the same input (for the
+        # same CoS) is cached, None if not (or if input is not received yet)
+        if bulk.is_ref(my_proto.data) or store.is_ref(my_proto.data):
+            return None
+        res = memo.get(_req.cos.id, my_proto.data)
+        if res is None:
+            return None
+        console.info('Result found in cache')
+        free_req((ip_src, _req.id), _req)
+        _req.result = res
+        _req.state = DRES
+        console.info('Send data exchange response to %s', ip_src)
+        my_proto.state = DRES
+        my_proto.data = bulk.wrap(res)
+        return IP(dst=ip_src) / my_proto
+
+    def _cancel_data(self, my_proto, ip_src, _req,
+                     reason: str = 'Fetching data failed'):
+        # execution cannot go on (input data could not be fetched, or
+        # deadline passed), so cancel (a retried data exchange request
+        # reserves resources again)
+        console.info(reason)
+        free_req((ip_src, _req.id), _req)
+        _req._thread = None
+        _req.state = self.cancelled
+        replies.discard((ip_src, _req.id), my_proto.attempt_no)
+        send(self._cancel(None, my_proto, ip_src), verbose=0, iface=MY_IFACE)
+
+    def _expire_data(self, my_proto, ip_src, _req):
+        # (called by the pool instead of _respond_data)
+        self._cancel_data(my_proto, ip_src, _req,
+                          'Deadline of %s passed while queued' % _req.id)
+
+    def _respond_data(self, my_proto, ip_src, _req):
+        # (called by the pool; lease is held for the execution, then renewed
+        # for the wait of the acknowledgement, however the execution ends)
+        renew_lease((ip_src, _req.id), _hold(_req))
+        try:
+            self._execute(my_proto, ip_src, _req)
+        finally:
+            renew_lease((ip_src, _req.id))
+
+    def _execute(self, my_proto, ip_src, _req):
+        # large input is read from the content store, or fetched over the
+        # bulk channel
+        data = store.unwrap(my_proto.data, ip_src, _req.cos.id)
+        if data is None:
+            self._cancel_data(my_proto, ip_src, _req)
+            return
+        # (input fetched over the bulk channel could not be looked up before)
+        res = (memo.get(_req.cos.id, data) if data is not my_proto.data
+               else None)
+        if res is None:
+            console.info('Executing CoS: %s  for %s ip_src', str(_req.cos.id),
+                         str(ip_src))
+            res = execute(data, ip_src, _req.cos.id)
+            memo.put(_req.cos.id, data, res)
+
+        # save result locally
+        _req.result = res
+        _req.state = DRES
+        my_proto.state = DRES
+        # large result is sent over the bulk channel
+        my_proto.data = bulk.wrap(res)
+        dres = Message(state=DRES, req_id=my_proto.req_id.decode(),
+                       attempt_no=my_proto.attempt_no, data=my_proto.data)
+        # (acknowledgement is waited for in the engine, so the worker is
+        # free for the next execution)
+        self.engine.spawn(self._send_result(dres, ip_src, _req))
+
+
+def free_req(_req_id: tuple, _req: Request_):
+    # free resources reserved for request, only once (the dispatcher's
+    # workers, the execution workers and the engine may all try to)
+    # returns True if freed, False if already freed
+    with requests_.lock(_req_id):
+        if _req._freed:
+            return False
+        _req._freed = True
+    console.info('Freeing resources')
+    free_resources(_req, _req_id)
+    return True
+
+
+def expired(_req: Request_, deadline: int):
+    # returns True if the consumer's deadline passed
+    # (deadline is the time left in ms when the request was sent; if 0, the
+    # last one received is kept, as reassembled requests carry none)
+    if deadline:
+        _req._deadline = time() + deadline / 1000
+    return _req._deadline is not None and time() >= _req._deadline
+
+
+def _hold(_req: Request_):
+    # time (in s) the lease of a queued or executing request is held for:
+    # until the consumer's deadline (past which the result is no longer
+    # needed), or the max response time of its CoS, so that it is still
+    # reclaimed if the execution never ends
+    # (None for the default lease if neither is known)
+    if _req._deadline is not None:
+        return max(_req._deadline - time(), 0)
+    rt = _req.cos.get_max_response_time()
+    return None if rt == float('inf') else rt
@@ -0,0 +1,104 @@
+'''
+    TCP-style round-trip time (RTT) estimation per peer (RFC 6298), used to
+    compute the timeout of each exchange instead of a fixed global value: a
+    peer on the same LAN answers in milliseconds, while one behind a Wi-Fi
+    access point may take much longer.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    RttEstimator: Smoothed RTT (SRTT) and RTT variation (RTTVAR) per peer IP,
+    and the resulting retransmission timeouts (with exponential backoff and
+    jitter between retries).
+'''
+
+
+from random import random
+
+
+# RFC 6298 constants
+ALPHA = 1 / 8
+BETA = 1 / 4
+K = 4
+
+
+class RttEstimator:
+    '''
+        Smoothed RTT (SRTT) and RTT variation (RTTVAR) per peer IP, and the
+        resulting retransmission timeouts (RTO = SRTT + 4 * RTTVAR), with
+        exponential backoff and jitter between retries.
+
+        Samples must only be taken from exchanges answered on their first
+        try (Karn's algorithm), since the answer of a retransmitted message
+        can't be matched to one of its copies.
+
+        Attributes:
+        -----------
+        initial: Timeout used for peers without samples (in seconds).
+
+        upper: Upper bound of timeouts (in seconds), including backoff.
+
+        lower: Lower bound of timeouts (in seconds). Default is 0.01s.
+
+        jitter: Fraction of the timeout randomly taken off (to avoid
+        synchronized retransmissions). Default is 0.1.
+
+        Methods:
+        --------
+        sample(peer, rtt): Update peer's estimates with new RTT sample (in
+        seconds).
+
+        timeout(peer, retry): Returns timeout (in seconds) for the retry-th
+        retransmission to peer (0 for the first transmission).
+
+        srtt(peer): Returns peer's smoothed RTT (in seconds), None if no
+        samples.
+    '''
+
+    def __init__(self, initial: float, upper: float, lower: float = 0.01,
+                 jitter: float = 0.1):
+        self.initial = initial
+        self.upper = upper
+        self.lower = min(lower, upper)
+        self.jitter = jitter
+        # {peer: [srtt, rttvar]}
+        self._peers = {}
+
+    def sample(self, peer: str, rtt: float):
+        '''
+            Update peer's estimates with new RTT sample (in seconds).
+        '''
+
+        if rtt < 0:
+            return
+        est = self._peers.get(peer, None)
+        if est is None:
+            self._peers[peer] = [rtt, rtt / 2]
+            return
+        srtt, rttvar = est
+        est[1] = (1 - BETA) * rttvar + BETA * abs(srtt - rtt)
+        est[0] = (1 - ALPHA) * srtt + ALPHA * rtt
+
+    def timeout(self, peer: str, retry: int = 0):
+        '''
+            Returns timeout (in seconds) for the retry-th retransmission to
+            peer (0 for the first transmission).
+        '''
+
+        est = self._peers.get(peer, None)
+        if est is None:
+            rto = self.initial
+        else:
+            rto = max(self.lower, est[0] + K * est[1])
+        rto = min(self.upper, rto * 2 ** retry)
+        return max(self.lower, rto * (1 - self.jitter * random()))
+
+    def srtt(self, peer: str):
+        '''
+            Returns peer's smoothed RTT (in seconds), None if no samples.
+        '''
+
+        est = self._peers.get(peer, None)
+        return est[0] if est else None
@@ -3,14 +3,20 @@
 # method is called, so only import after
 
 
-from os import getenv
-from string import ascii_letters, digits
-from random import choice
+from os import getenv, cpu_count
+from string import ascii_uppercase, ascii_lowercase, digits
+from socket import inet_aton
+from ipaddress import ip_address, ip_network
+from itertools import count
+from time import time
 
 from model import CoS, Request, Attempt, Response
 from api import add_request
 from logger import console, file
-from network import MY_IP
+from network import MY_IP, NETWORK_ADDRESS
+from offers import policies
+from table import StateTable, ShardedTable
+from replies import ReplyCache
 from consts import *
 
 
@@ -62,6 +68,381 @@ except:
                  'received configuration', exc_info=True)
     PROTO_RETRIES = 3
 
+try:
+    PROTO_IP_PROTO = int(getenv('PROTOCOL_IP_PROTO', None), 0)
+    if PROTO_IP_PROTO < 0 or PROTO_IP_PROTO > 255:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:IP_PROTO parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 253 (experimentation and testing)')
+    file.warning('PROTOCOL:IP_PROTO parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_IP_PROTO = 253
+
+try:
+    PROTO_ETHER_TYPE = int(getenv('PROTOCOL_ETHER_TYPE', None), 0)
+    if PROTO_ETHER_TYPE < 0x0600 or PROTO_ETHER_TYPE > 0xffff:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:ETHER_TYPE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0x88B5 (local experimental)')
+    file.warning('PROTOCOL:ETHER_TYPE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_ETHER_TYPE = 0x88B5
+
+try:
+    PROTO_OFFER_WINDOW = float(getenv('PROTOCOL_OFFER_WINDOW', None))
+    if PROTO_OFFER_WINDOW < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:OFFER_WINDOW parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0s (first host response is accepted)')
+    file.warning('PROTOCOL:OFFER_WINDOW parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_OFFER_WINDOW = 0
+
+try:
+    PROTO_HRES_BACKOFF = float(getenv('PROTOCOL_HRES_BACKOFF', None))
+    if PROTO_HRES_BACKOFF < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:HRES_BACKOFF parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0s (host responses are not delayed)')
+    file.warning('PROTOCOL:HRES_BACKOFF parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_HRES_BACKOFF = 0
+
+try:
+    PROTO_HEDGE_RESPONSE_TIME = float(
+        getenv('PROTOCOL_HEDGE_RESPONSE_TIME', None))
+    if PROTO_HEDGE_RESPONSE_TIME < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:HEDGE_RESPONSE_TIME parameter invalid or '
+                    'missing from received configuration. '
+                    'Defaulting to 0s (requests are not hedged)')
+    file.warning('PROTOCOL:HEDGE_RESPONSE_TIME parameter invalid or missing '
+                 'from received configuration', exc_info=True)
+    PROTO_HEDGE_RESPONSE_TIME = 0
+
+try:
+    PROTO_HEDGE_HOSTS = int(getenv('PROTOCOL_HEDGE_HOSTS', None))
+    if PROTO_HEDGE_HOSTS < 2:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:HEDGE_HOSTS parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 2')
+    file.warning('PROTOCOL:HEDGE_HOSTS parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_HEDGE_HOSTS = 2
+
+try:
+    PROTO_HEDGE_PERCENTILE = float(getenv('PROTOCOL_HEDGE_PERCENTILE', None))
+    if PROTO_HEDGE_PERCENTILE < 0 or PROTO_HEDGE_PERCENTILE > 100:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:HEDGE_PERCENTILE parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 0 (hedged right away)')
+    file.warning('PROTOCOL:HEDGE_PERCENTILE parameter invalid or missing '
+                 'from received configuration', exc_info=True)
+    PROTO_HEDGE_PERCENTILE = 0
+
+PROTO_OFFER_POLICY = getenv('PROTOCOL_OFFER_POLICY', None)
+if PROTO_OFFER_POLICY not in policies:
+    console.warning('PROTOCOL:OFFER_POLICY parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to first')
+    file.warning('PROTOCOL:OFFER_POLICY parameter (%s) invalid or missing '
+                 'from received configuration', str(PROTO_OFFER_POLICY))
+    PROTO_OFFER_POLICY = 'first'
+
+try:
+    PROTO_OFFER_TTL = float(getenv('PROTOCOL_OFFER_TTL', None))
+    if PROTO_OFFER_TTL < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:OFFER_TTL parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0s (host offers are not cached)')
+    file.warning('PROTOCOL:OFFER_TTL parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_OFFER_TTL = 0
+
+try:
+    PROTO_GOSSIP_PERIOD = float(getenv('PROTOCOL_GOSSIP_PERIOD', None))
+    if PROTO_GOSSIP_PERIOD < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:GOSSIP_PERIOD parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 0s (capacity is not announced)')
+    file.warning('PROTOCOL:GOSSIP_PERIOD parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_GOSSIP_PERIOD = 0
+
+try:
+    PROTO_GOSSIP_TTL = float(getenv('PROTOCOL_GOSSIP_TTL', None))
+    if PROTO_GOSSIP_TTL < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:GOSSIP_TTL parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 3 gossip periods')
+    file.warning('PROTOCOL:GOSSIP_TTL parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_GOSSIP_TTL = 3 * PROTO_GOSSIP_PERIOD
+
+try:
+    PROTO_MCAST_BASE = getenv('PROTOCOL_MCAST_BASE', None)
+    if not 224 <= inet_aton(PROTO_MCAST_BASE)[0] <= 239:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:MCAST_BASE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to none (host requests are broadcast)')
+    file.warning('PROTOCOL:MCAST_BASE parameter (%s) invalid or missing '
+                 'from received configuration', str(PROTO_MCAST_BASE))
+    PROTO_MCAST_BASE = None
+
+try:
+    PROTO_FRAG_SIZE = int(getenv('PROTOCOL_FRAG_SIZE', None))
+    if PROTO_FRAG_SIZE < 64 or PROTO_FRAG_SIZE > 65000:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:FRAG_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 1400 bytes (fits a 1500-byte MTU)')
+    file.warning('PROTOCOL:FRAG_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_FRAG_SIZE = 1400
+
+try:
+    PROTO_WINDOW = int(getenv('PROTOCOL_WINDOW', None))
+    if PROTO_WINDOW < 1:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:WINDOW parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 64 fragments')
+    file.warning('PROTOCOL:WINDOW parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_WINDOW = 64
+
+try:
+    PROTO_BULK_THRESHOLD = int(getenv('PROTOCOL_BULK_THRESHOLD', None))
+    if PROTO_BULK_THRESHOLD < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:BULK_THRESHOLD parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 1MB')
+    file.warning('PROTOCOL:BULK_THRESHOLD parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_BULK_THRESHOLD = 1 << 20
+
+try:
+    PROTO_BULK_PORT = int(getenv('PROTOCOL_BULK_PORT', None))
+    if PROTO_BULK_PORT < 0 or PROTO_BULK_PORT > 65535:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:BULK_PORT parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0 (ephemeral)')
+    file.warning('PROTOCOL:BULK_PORT parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_BULK_PORT = 0
+
+try:
+    PROTO_FAST_SIZE = int(getenv('PROTOCOL_FAST_SIZE', None))
+    if PROTO_FAST_SIZE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:FAST_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 0 (fast path disabled)')
+    file.warning('PROTOCOL:FAST_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_FAST_SIZE = 0
+
+try:
+    PROTO_CAS_THRESHOLD = int(getenv('PROTOCOL_CAS_THRESHOLD', None))
+    if PROTO_CAS_THRESHOLD < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:CAS_THRESHOLD parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 0 (inputs are always sent)')
+    file.warning('PROTOCOL:CAS_THRESHOLD parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_CAS_THRESHOLD = 0
+
+try:
+    PROTO_CAS_SIZE = int(getenv('PROTOCOL_CAS_SIZE', None))
+    if PROTO_CAS_SIZE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:CAS_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 256MB')
+    file.warning('PROTOCOL:CAS_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_CAS_SIZE = 256 << 20
+
+# (different directories for different hosts, in case of simulation)
+PROTO_CAS_PATH = getenv('PROTOCOL_CAS_PATH',
+                        ROOT_PATH + '/data/cas.' + MY_IP)
+
+try:
+    PROTO_WORKERS = int(getenv('PROTOCOL_WORKERS', None))
+    if PROTO_WORKERS < 1:
+        raise ValueError
+except:
+    PROTO_WORKERS = cpu_count() or 1
+    console.warning('PROTOCOL:WORKERS parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to %d (number of CPUs)', PROTO_WORKERS)
+    file.warning('PROTOCOL:WORKERS parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+
+try:
+    PROTO_QUEUE_SIZE = int(getenv('PROTOCOL_QUEUE_SIZE', None))
+    if PROTO_QUEUE_SIZE < 1:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:QUEUE_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 16')
+    file.warning('PROTOCOL:QUEUE_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_QUEUE_SIZE = 16
+
+try:
+    PROTO_MAX_QUEUE_WAIT = float(getenv('PROTOCOL_MAX_QUEUE_WAIT', None))
+    if PROTO_MAX_QUEUE_WAIT < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:MAX_QUEUE_WAIT parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 30s')
+    file.warning('PROTOCOL:MAX_QUEUE_WAIT parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_MAX_QUEUE_WAIT = 30
+
+try:
+    PROTO_MEMO_SIZE = int(getenv('PROTOCOL_MEMO_SIZE', None))
+    if PROTO_MEMO_SIZE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:MEMO_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 256')
+    file.warning('PROTOCOL:MEMO_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_MEMO_SIZE = 256
+
+try:
+    PROTO_MEMO_TTL = float(getenv('PROTOCOL_MEMO_TTL', None))
+    if PROTO_MEMO_TTL < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:MEMO_TTL parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 300s')
+    file.warning('PROTOCOL:MEMO_TTL parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_MEMO_TTL = 300
+
+# (comma-separated CoS IDs, only deterministic applications should be listed)
+try:
+    PROTO_MEMO_COS = {int(cos_id) for cos_id in
+                      getenv('PROTOCOL_MEMO_COS', '').split(',')
+                      if cos_id.strip()}
+except:
+    console.warning('PROTOCOL:MEMO_COS parameter invalid in received '
+                    'configuration. '
+                    'Defaulting to none (results are not cached)')
+    file.warning('PROTOCOL:MEMO_COS parameter invalid in received '
+                 'configuration', exc_info=True)
+    PROTO_MEMO_COS = set()
+
+try:
+    PROTO_STATE_TTL = float(getenv('PROTOCOL_STATE_TTL', None))
+    if PROTO_STATE_TTL < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:STATE_TTL parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 60s')
+    file.warning('PROTOCOL:STATE_TTL parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_STATE_TTL = 60
+
+try:
+    PROTO_STATE_SIZE = int(getenv('PROTOCOL_STATE_SIZE', None))
+    if PROTO_STATE_SIZE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:STATE_SIZE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 10000')
+    file.warning('PROTOCOL:STATE_SIZE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_STATE_SIZE = 10000
+
+try:
+    PROTO_STATE_SHARDS = int(getenv('PROTOCOL_STATE_SHARDS', None))
+    if PROTO_STATE_SHARDS < 1:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:STATE_SHARDS parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 16')
+    file.warning('PROTOCOL:STATE_SHARDS parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    PROTO_STATE_SHARDS = 16
+
+try:
+    PROTO_DISPATCH_WORKERS = int(getenv('PROTOCOL_DISPATCH_WORKERS', None))
+    if PROTO_DISPATCH_WORKERS < 1:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:DISPATCH_WORKERS parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 4')
+    file.warning('PROTOCOL:DISPATCH_WORKERS parameter invalid or missing '
+                 'from received configuration', exc_info=True)
+    PROTO_DISPATCH_WORKERS = 4
+
+try:
+    PROTO_DISPATCH_QUEUE = int(getenv('PROTOCOL_DISPATCH_QUEUE', None))
+    if PROTO_DISPATCH_QUEUE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:DISPATCH_QUEUE parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 1024')
+    file.warning('PROTOCOL:DISPATCH_QUEUE parameter invalid or missing '
+                 'from received configuration', exc_info=True)
+    PROTO_DISPATCH_QUEUE = 1024
+
+try:
+    PROTO_REPLY_CACHE_SIZE = int(getenv('PROTOCOL_REPLY_CACHE_SIZE', None))
+    if PROTO_REPLY_CACHE_SIZE < 0:
+        raise ValueError
+except:
+    console.warning('PROTOCOL:REPLY_CACHE_SIZE parameter invalid or missing '
+                    'from received configuration. '
+                    'Defaulting to 1024')
+    file.warning('PROTOCOL:REPLY_CACHE_SIZE parameter invalid or missing '
+                 'from received configuration', exc_info=True)
+    PROTO_REPLY_CACHE_SIZE = 1024
+
 _proto_verbose = getenv('PROTOCOL_VERBOSE', '').upper()
 if _proto_verbose not in ('TRUE', 'FALSE'):
     _proto_verbose = 'FALSE'
@@ -70,14 +451,45 @@ PROTO_VERBOSE = _proto_verbose == 'TRUE'
 cos_dict = {cos.id: cos for cos in CoS.select()}
 cos_names = {id: cos.name for id, cos in cos_dict.items()}
 
-# dict of requests sent as consumer (keys are request IDs)
-requests = {'_': None}  # '_' is placeholder
-# fill with existing request IDs from DB to avoid conflict when generating IDs
-requests.update(
-    {req[0]: None for req in Request.select(fields=('id',), as_obj=False)})
+# dict of requests in flight as consumer (keys are request IDs)
+requests = {}
+# table of tombstones of requests no longer in flight (keys are request IDs),
+# to answer their late responses without keeping their data and result
+# (entries expire PROTO_STATE_TTL after last access)
+finished = StateTable(PROTO_STATE_TTL, PROTO_STATE_SIZE)
+
+# request IDs are the node's host number (IP address within
+# NETWORK_ADDRESS) followed by a sequence number, in fixed-width base 62 (so
+# that IDs of the node sort by sequence number), so they are unique without
+# checking past IDs
+_ID_CHARS = digits + ascii_uppercase + ascii_lowercase  # (in ASCII order)
+_ID_BITS = 59  # (10 chars hold 59 bits)
+try:
+    _NODE_BITS = 32 - ip_network(NETWORK_ADDRESS).prefixlen
+except (TypeError, ValueError):
+    _NODE_BITS = 32  # (whole IP address)
+_SEQ_BITS = _ID_BITS - _NODE_BITS
+# the sequence is seeded from the number of seconds since _SEQ_EPOCH only if
+# that takes less than 1/1024 of its range for a century (2^32 s), i.e. if
+# the network leaves more than 42 bits to it (/22 or smaller). Otherwise
+# (e.g. no NETWORK_ADDRESS, 27 bits), it only follows the last ID stored in
+# DB, and IDs are unique for 2^_SEQ_BITS requests per node (134M with 27
+# bits), or until the DB is reset
+_SEQ_EPOCH = 1704067200  # 2024-01-01
+_SEQ_TIMED = _SEQ_BITS > 42
 
-# dict of requests received as provider (keys are (src IP, request ID))
-requests_ = {}
+# table of requests received as provider (keys are (src IP, request ID))
+# (entries expire PROTO_STATE_TTL after last access, unless they still hold
+# resources, and are split in PROTO_STATE_SHARDS shards by request ID, each
+# with its own lock)
+requests_ = ShardedTable(PROTO_STATE_TTL, PROTO_STATE_SIZE,
+                         PROTO_STATE_SHARDS)
+# last replies to request messages of requests_ (answering duplicates, and
+# dropped along with their request)
+replies = ReplyCache(PROTO_REPLY_CACHE_SIZE)
+requests_.on_evict = lambda _req_id, _: replies.drop(_req_id)
+# bound of the deadline field of request messages (time left, in ms)
+DEADLINE_MAX = 2 ** 31 - 1
 
 proto_states = {
     HREQ: 'host request (HREQ)',
@@ -91,25 +503,104 @@ proto_states = {
     DACK: 'data exchange acknowledgement (DACK)',
     DCAN: 'data exchange cancellation (DCAN)',
     DWAIT: 'data exchange wait (DWAIT)',
+    DFRAG: 'data exchange fragment (DFRAG)',
+    DSACK: 'data exchange selective acknowledgement (DSACK)',
+    HANN: 'host announcement (HANN)',
 }
 
 
+class Finished_:
+    # tombstone of a request sent as consumer, no longer in flight
+    # (dres_at is set even if it failed, so late responses are cancelled)
+    __slots__ = ('id', 'host', 'state', 'dres_at', '_late', 'attempts')
+
+    def __init__(self, req: Request):
+        self.id = req.id
+        self.host = req.host
+        self.state = req.state
+        self.dres_at = req.dres_at or time()
+        self._late = False
+        self.attempts = {}
+
+
 class Request_(Request):
     def __init__(self, id):
         super().__init__(id, None, None)
         self._thread = None
         self._freed = True
+        # timestamp past which the consumer no longer needs the result
+        # (propagated in request messages), None if unknown
+        self._deadline = None
 
 
-def gen_req_id():
-    id = '_'
-    while id in requests:
-        id = ''.join(
-            choice(ascii_letters + digits) for _ in range(REQ_ID_LEN))
+def _encode_id(n: int):
+    id = ''
+    for _ in range(REQ_ID_LEN):
+        n, r = divmod(n, len(_ID_CHARS))
+        id = _ID_CHARS[r] + id
     return id
 
 
+def _decode_id(id: str):
+    n = 0
+    for c in id:
+        n = n * len(_ID_CHARS) + _ID_CHARS.index(c)
+    return n
+
+
+def _first_seq():
+    # after the last ID of the node stored in DB (if any), and never before
+    # the number of seconds since _SEQ_EPOCH if _SEQ_TIMED (in case the DB
+    # was reset, IDs sent before may still be known by other nodes)
+    seq = int(time()) - _SEQ_EPOCH if _SEQ_TIMED else 0
+    last = Request.select(fields=('max(id)',), as_obj=False,
+                          id=(' < ', _encode_id(_node + (1 << _SEQ_BITS))))
+    if last and last[0][0] and len(last[0][0]) == REQ_ID_LEN:
+        try:
+            n = _decode_id(last[0][0])
+        except ValueError:  # (not generated by gen_req_id)
+            n = 0
+        if n >= _node:
+            seq = max(seq, n - _node + 1)
+    return seq
+
+
+try:
+    _node = ((int(ip_address(MY_IP)) & ((1 << _NODE_BITS) - 1))
+             << _SEQ_BITS)
+except ValueError:
+    _node = 0
+_seq = count(_first_seq())
+
+
+def gen_req_id():
+    # (next() on itertools.count is atomic, so safe across threads)
+    # (wraps after 2^_SEQ_BITS IDs, see _SEQ_TIMED)
+    return _encode_id(_node + next(_seq) % (1 << _SEQ_BITS))
+
+
+def get_req(req_id: str):
+    # request sent as consumer, in flight or finished (tombstone), None if
+    # unknown
+    req = requests.get(req_id, None)
+    return req if req else finished.get(req_id, None)
+
+
+def get_deadline(req: Request):
+    # time left (in ms) before req exceeds the max response time of its CoS
+    # (negative if exceeded, 0 if none)
+    rt = req.cos.get_max_response_time()
+    if rt == float('inf') or not req.hreq_at:
+        return 0
+    left = round((req.hreq_at + rt - time()) * 1000)
+    return max(-DEADLINE_MAX, min(left, DEADLINE_MAX)) or -1
+
+
 def save_req(req: Request):
+    # (the request is no longer in flight, only its tombstone is kept)
+    finished[req.id] = Finished_(req)
+    requests.pop(req.id, None)
+
     req.insert()
     for attempt in req.attempts.values():
         attempt.insert()
@@ -0,0 +1,319 @@
+'''
+    Bounded table of the requests received as provider, whose entries
+    expire after a period of inactivity, so that a node running for weeks
+    does not keep every request (and its result) it has ever seen.
+
+    Expiry is scheduled on a timer wheel (the engine's, through its
+    call_later, set as the table's schedule), with one timer per entry: when
+    it fires, an entry accessed since is scheduled again for the rest of its
+    ttl, so accesses only update a deadline. Entries still holding resources
+    (reserved, queued or executing) are never evicted; their deadline is
+    pushed back instead.
+
+    The table can be split in shards by hash of request ID, each with its
+    own lock, so that requests processed in parallel (by the dispatcher's
+    workers) do not contend on a single lock.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    StateTable: Dict-like table of provider-side requests with timer-wheel
+    expiry.
+
+    ShardedTable: StateTable split in shards by hash of request ID.
+'''
+
+
+from threading import RLock
+from time import monotonic
+
+
+class StateTable:
+    '''
+        Dict-like table of provider-side requests with timer-wheel expiry.
+
+        Attributes:
+        -----------
+        ttl: Time (in seconds) an entry is kept after it was last accessed
+        (long enough to answer duplicate requests). 0 disables expiry.
+
+        size: Max number of entries. When full, the entries closest to their
+        deadline are evicted first. 0 is unbounded. Default is 0.
+
+        on_evict: Function called with key and value of evicted entries.
+        Default is None.
+
+        schedule: Function scheduling expiry timers, called with delay (in
+        seconds), callback and args (e.g. Engine.call_later, so they are
+        driven by the engine's timer wheel). Default is None (entries only
+        expire when expire() is called).
+
+        stats: Dict of counters: 'evicted' (expired entries), 'overflows'
+        (entries evicted before their deadline because the table was full)
+        and 'deferred' (expiries pushed back because resources are still
+        held).
+
+        Methods:
+        --------
+        get(key, default): Returns value of key (and renews its deadline),
+        default if missing.
+
+        occupancy(): Returns number of entries.
+
+        expire(): Evict entries whose deadline passed.
+    '''
+
+    def __init__(self, ttl: float, size: int = 0, on_evict=None,
+                 schedule=None):
+        self.ttl = ttl
+        self.size = size
+        self.on_evict = on_evict
+        self.schedule = schedule
+        self.stats = {'evicted': 0, 'overflows': 0, 'deferred': 0}
+        self._data = {}
+        # {key: deadline} (of monotonic clock)
+        self._deadlines = {}
+        # keys with a pending expiry timer
+        self._armed = set()
+        self._lock = RLock()
+
+    def get(self, key, default=None):
+        '''
+            Returns value of key (and renews its deadline), default if
+            missing.
+        '''
+
+        with self._lock:
+            value = self._data.get(key, default)
+            if key in self._deadlines:
+                self._deadlines[key] = monotonic() + self.ttl
+            return value
+
+    def occupancy(self):
+        '''
+            Returns number of entries.
+        '''
+
+        return len(self._data)
+
+    def expire(self):
+        '''
+            Evict entries whose deadline passed.
+        '''
+
+        if not self.ttl:
+            return
+        with self._lock:
+            now = monotonic()
+            for key, deadline in list(self._deadlines.items()):
+                if deadline <= now:
+                    self._due(key, now)
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        with self._lock:
+            if (key not in self._data and self.size
+                    and len(self._data) >= self.size):
+                self._overflow()
+            self._data[key] = value
+            self._deadlines[key] = monotonic() + self.ttl
+            if key not in self._armed:
+                self._arm(key, self.ttl)
+
+    def __delitem__(self, key):
+        with self._lock:
+            del self._data[key]
+            del self._deadlines[key]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def __iter__(self):
+        return iter(list(self._data))
+
+    def items(self):
+        return list(self._data.items())
+
+    def values(self):
+        return list(self._data.values())
+
+    def _arm(self, key, delay: float):
+        # (called with lock held)
+        if self.ttl and self.schedule:
+            self._armed.add(key)
+            self.schedule(delay, self._fire, key)
+
+    def _fire(self, key):
+        # expiry timer of key (on the scheduler's thread)
+        with self._lock:
+            self._armed.discard(key)
+            if key in self._deadlines:
+                self._due(key, monotonic())
+
+    def _due(self, key, now: float):
+        # (called with lock held)
+        deadline = self._deadlines[key]
+        if deadline > now:
+            # renewed since
+            if key not in self._armed:
+                self._arm(key, deadline - now)
+        elif not self._evictable(self._data[key]):
+            self.stats['deferred'] += 1
+            self._deadlines[key] = now + self.ttl
+            if key not in self._armed:
+                self._arm(key, self.ttl)
+        else:
+            self._evict(key)
+            self.stats['evicted'] += 1
+
+    def _overflow(self):
+        # evict the evictable entry closest to its deadline
+        for key, _ in sorted(self._deadlines.items(), key=lambda e: e[1]):
+            if self._evictable(self._data[key]):
+                self._evict(key)
+                self.stats['overflows'] += 1
+                return
+
+    def _evict(self, key):
+        value = self._data.pop(key)
+        del self._deadlines[key]
+        if self.on_evict:
+            self.on_evict(key, value)
+
+    def _evictable(self, value):
+        # resources no longer reserved (freed or never reserved)
+        return getattr(value, '_freed', True)
+
+
+class ShardedTable:
+    '''
+        StateTable split in shards by hash of request ID (keys are (src IP,
+        request ID)), each with its own lock.
+
+        Attributes:
+        -----------
+        ttl: Time (in seconds) an entry is kept after it was last accessed.
+        0 disables expiry.
+
+        size: Max number of entries (split evenly between shards). 0 is
+        unbounded. Default is 0.
+
+        shards: Number of shards. Default is 16.
+
+        on_evict: Function called with key and value of evicted entries.
+        Default is None.
+
+        schedule: Function scheduling expiry timers (see StateTable).
+        Default is None.
+
+        stats: Dict of counters of all shards (see StateTable).
+
+        Methods:
+        --------
+        get(key, default): Returns value of key (and renews its deadline),
+        default if missing.
+
+        lock(key): Returns lock of the shard of key.
+
+        occupancy(): Returns number of entries.
+
+        expire(): Evict entries whose deadline passed.
+    '''
+
+    def __init__(self, ttl: float, size: int = 0, shards: int = 16,
+                 on_evict=None, schedule=None):
+        self.ttl = ttl
+        self.size = size
+        self._shards = [StateTable(ttl, -(-size // shards), on_evict,
+                                   schedule)
+                        for _ in range(shards)]
+
+    @property
+    def on_evict(self):
+        return self._shards[0].on_evict
+
+    @on_evict.setter
+    def on_evict(self, on_evict):
+        for shard in self._shards:
+            shard.on_evict = on_evict
+
+    @property
+    def schedule(self):
+        return self._shards[0].schedule
+
+    @schedule.setter
+    def schedule(self, schedule):
+        for shard in self._shards:
+            shard.schedule = schedule
+
+    @property
+    def stats(self):
+        stats = {}
+        for shard in self._shards:
+            for name, value in shard.stats.items():
+                stats[name] = stats.get(name, 0) + value
+        return stats
+
+    def get(self, key, default=None):
+        '''
+            Returns value of key (and renews its deadline), default if
+            missing.
+        '''
+
+        return self._shard(key).get(key, default)
+
+    def lock(self, key):
+        '''
+            Returns lock of the shard of key (reentrant).
+        '''
+
+        return self._shard(key)._lock
+
+    def occupancy(self):
+        '''
+            Returns number of entries.
+        '''
+
+        return len(self)
+
+    def expire(self):
+        '''
+            Evict entries whose deadline passed.
+        '''
+
+        for shard in self._shards:
+            shard.expire()
+
+    def __getitem__(self, key):
+        return self._shard(key)[key]
+
+    def __setitem__(self, key, value):
+        self._shard(key)[key] = value
+
+    def __delitem__(self, key):
+        del self._shard(key)[key]
+
+    def __contains__(self, key):
+        return key in self._shard(key)
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def __iter__(self):
+        return iter([key for shard in self._shards for key in shard])
+
+    def items(self):
+        return [item for shard in self._shards for item in shard.items()]
+
+    def values(self):
+        return [value for shard in self._shards for value in shard.values()]
+
+    def _shard(self, key):
+        return self._shards[hash(key[1]) % len(self._shards)]
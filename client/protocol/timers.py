@@ -0,0 +1,197 @@
+'''
+    Hierarchical timer wheel driving the timeouts of the protocol (waits for
+    answers, retransmissions, reservation leases, acknowledgement waits) from
+    the engine's thread, so that the number of threads does not depend on the
+    number of requests in flight.
+
+    Timers are kept in the slot of the tick they are due at: the first level
+    has one slot per tick, and each next level one slot per turn of the level
+    below. Scheduling and cancelling a timer are O(1); timers of higher levels
+    are moved down (cascaded) as their slot comes due.
+
+    Like the codec, this module does not rely on the configuration received
+    from the server.
+
+    Classes:
+    --------
+    Timer: Callback scheduled on a timer wheel.
+
+    TimerWheel: Hierarchical timer wheel.
+'''
+
+
+from math import ceil
+from time import monotonic
+
+from logger import file
+
+
+class Timer:
+    '''
+        Callback scheduled on a timer wheel (called with args once its tick
+        is due, unless cancelled).
+    '''
+
+    __slots__ = ('tick', 'callback', 'args', 'cancelled')
+
+    def __init__(self, tick: int, callback, args: tuple = ()):
+        self.tick = tick
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        '''
+            Cancel timer (left in its slot until due, then dropped).
+        '''
+
+        self.cancelled = True
+
+
+class TimerWheel:
+    '''
+        Hierarchical timer wheel, advanced by its owner (not thread-safe).
+
+        Attributes:
+        -----------
+        tick: Duration of a tick (in seconds), the resolution of timers.
+        Default is 0.001.
+
+        slots: Number of slots per level. Default is 256.
+
+        levels: Number of levels (timers can be scheduled up to
+        slots ** levels ticks ahead, later ones being placed again as the
+        last level turns). Default is 4.
+
+        clock: Function returning the current time (in seconds). Default is
+        time.monotonic.
+
+        stats: Dict of counters: 'scheduled', 'fired', 'cancelled' and
+        'cascaded' (timers moved down a level).
+
+        Methods:
+        --------
+        schedule(delay, callback, *args): Returns Timer calling
+        callback(*args) after delay (in seconds).
+
+        advance(now): Fire timers due by now. Returns number of timers fired.
+
+        next_expiry(): Returns time the wheel must be advanced at next, None
+        if no timer is scheduled.
+    '''
+
+    def __init__(self, tick: float = 0.001, slots: int = 256,
+                 levels: int = 4, clock=monotonic):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.clock = clock
+        self.stats = {'scheduled': 0, 'fired': 0, 'cancelled': 0,
+                      'cascaded': 0}
+        self._wheels = [[[] for _ in range(slots)] for _ in range(levels)]
+        # ticks covered by a slot of each level
+        self._spans = [slots ** level for level in range(levels + 1)]
+        self._current = int(clock() / tick)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def schedule(self, delay: float, callback, *args):
+        '''
+            Returns Timer calling callback(*args) after delay (in seconds,
+            rounded up to the next tick).
+        '''
+
+        now = self.clock()
+        # (the wheel is not advanced while empty)
+        if not self._count:
+            self._current = max(self._current, int(now / self.tick))
+        tick = max(ceil((now + delay) / self.tick), self._current + 1)
+        timer = Timer(tick, callback, args)
+        self._insert(timer)
+        self._count += 1
+        self.stats['scheduled'] += 1
+        return timer
+
+    def advance(self, now: float = None):
+        '''
+            Fire timers due by now (current time if not given).
+
+            Returns number of timers fired.
+        '''
+
+        target = int((self.clock() if now is None else now) / self.tick)
+        if not self._count:
+            self._current = max(self._current, target)
+            return 0
+        due = []
+        while self._current < target:
+            self._current += 1
+            current = self._current
+            # cascade from the highest level whose slot starts now, so timers
+            # cascaded into a lower slot starting now are cascaded again
+            level = 1
+            while level < self.levels and not current % self._spans[level]:
+                level += 1
+            for level in range(level - 1, 0, -1):
+                self._cascade(level, current, due)
+            slot = self._wheels[0][current % self.slots]
+            if slot:
+                due.extend(slot)
+                slot.clear()
+        fired = 0
+        for timer in due:
+            self._count -= 1
+            if timer.cancelled:
+                self.stats['cancelled'] += 1
+                continue
+            fired += 1
+            try:
+                timer.callback(*timer.args)
+            except Exception:
+                file.exception('Timer callback failed')
+        self.stats['fired'] += fired
+        return fired
+
+    def next_expiry(self):
+        '''
+            Returns time (of clock) the wheel must be advanced at next (next
+            non-empty slot of the first level, or next cascade), None if no
+            timer is scheduled.
+        '''
+
+        if not self._count:
+            return None
+        first = self._wheels[0]
+        for tick in range(self._current + 1, self._current + self.slots + 1):
+            if first[tick % self.slots] or not tick % self.slots:
+                return tick * self.tick
+
+    def _insert(self, timer: Timer):
+        delta = timer.tick - self._current
+        level = 0
+        while level < self.levels - 1 and delta >= self._spans[level + 1]:
+            level += 1
+        # (timers beyond the last level are delayed to its last slot, and
+        # placed again when cascaded)
+        tick = min(timer.tick, self._current + self._spans[self.levels] - 1)
+        self._wheels[level][(tick // self._spans[level]) % self.slots].append(
+            timer)
+
+    def _cascade(self, level: int, current: int, due: list):
+        slot = self._wheels[level][(current // self._spans[level])
+                                   % self.slots]
+        if not slot:
+            return
+        timers = slot[:]
+        slot.clear()
+        for timer in timers:
+            if timer.cancelled:
+                self._count -= 1
+                self.stats['cancelled'] += 1
+            elif timer.tick <= current:
+                due.append(timer)
+            else:
+                self.stats['cascaded'] += 1
+                self._insert(timer)
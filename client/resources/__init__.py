@@ -8,15 +8,25 @@
     --------
     get_resources(quiet): Returns tuple of free CPU, free RAM, and free disk.
 
-    check_resources(request): Returns True if the current resources can satisfy 
-    the requirements of request, False if not.
+    get_bandwidth(): Returns free bandwidth of main interface.
+
+    check_resources(request): Returns True if the current resources (including
+    bandwidth of main interface) can satisfy the requirements of request,
+    False if not.
     
-    reserve_resources(request): Subtract a quantity of resources to be reserved 
-    for request from simulation variables.
+    reserve_resources(request): Subtract a quantity of resources (including 
+    bandwidth) to be reserved for request from simulation variables.
     
     free_resources(request): Add back a quantity of resources reserved for 
     request to simulation variables.
 
+    renew_lease(key, duration): Push back expiry of reservation identified by
+    key (consumer IP, request ID).
+
+    reconcile(fix): Returns report comparing reservation ledger with
+    simulation variables (and corrects them if fix, which is never done
+    automatically: drift is only logged).
+
     execute(data): Simulate the execution of network application by doing 
     sleeping for a determined period of time (by default randomly generated 
     between 0s and 1s).
@@ -36,7 +46,9 @@ path.append(dirname(__file__))
 
 
 from .monitor import IS_CONTAINER
-from .simulator import (check_resources, get_resources, reserve_resources,
-                        free_resources, execute, SIM_EXEC_MIN, SIM_EXEC_MAX,
-                        MONITOR, MONITOR_PERIOD, MEASURES, SIM_ON, CPU, RAM, 
-                        DISK, CPU_THRESHOLD, RAM_THRESHOLD, DISK_THRESHOLD)
+from .simulator import (check_resources, get_resources, get_bandwidth,
+                        reserve_resources, free_resources, renew_lease,
+                        reconcile, lease_stats, execute, SIM_EXEC_MIN,
+                        SIM_EXEC_MAX, SIM_LEASE, MONITOR, MONITOR_PERIOD,
+                        MEASURES, SIM_ON, CPU, RAM, DISK, BANDWIDTH,
+                        CPU_THRESHOLD, RAM_THRESHOLD, DISK_THRESHOLD)
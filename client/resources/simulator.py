@@ -11,15 +11,25 @@
     --------
     get_resources(quiet): Returns tuple of free CPU, free RAM, and free disk.
 
-    check_resources(request): Returns True if the current resources can satisfy 
-    the requirements of request, False if not.
+    get_bandwidth(): Returns free bandwidth of main interface.
+
+    check_resources(request): Returns True if the current resources (including
+    bandwidth of main interface) can satisfy the requirements of request,
+    False if not.
     
-    reserve_resources(request): Subtract a quantity of resources to be reserved 
-    for request from simulation variables.
+    reserve_resources(request): Subtract a quantity of resources (including 
+    bandwidth) to be reserved for request from simulation variables.
     
     free_resources(request): Add back a quantity of resources reserved for 
     request to simulation variables.
 
+    renew_lease(key, duration): Push back expiry of reservation identified by
+    key (consumer IP, request ID).
+
+    reconcile(fix): Returns report comparing reservation ledger with
+    simulation variables (and corrects them if fix, which is never done
+    automatically: drift is only logged).
+
     execute(data): Simulate the execution of network application by doing 
     sleeping for a determined period of time (by default randomly generated 
     between 0s and 1s).
@@ -32,12 +42,15 @@
 
 
 from os import getenv
-from threading import Lock
+from threading import Thread, Lock, Condition
 from random import uniform
 from time import sleep, time
+from heapq import heappush, heappop
+from itertools import count
 
 from .monitor import Monitor
 from common import THRESHOLD, LIMIT, IS_RESOURCE
+from network import MY_IFACE
 from model import Request
 from logger import console, file
 from utils import all_exit
@@ -118,6 +131,19 @@ CPU_THRESHOLD = CPU * THRESHOLD
 RAM_THRESHOLD = RAM * THRESHOLD
 DISK_THRESHOLD = DISK * THRESHOLD
 
+# bandwidth (in Mbit/s) of main interface offered to requests when simulation
+# is active (capacity measured by monitor if not declared)
+_bandwidth = float('inf')
+if IS_RESOURCE and SIM_ON:
+    try:
+        _bandwidth = float(getenv('HOST_BANDWIDTH', None))
+    except:
+        console.warning('HOST_BANDWIDTH argument invalid or missing. '
+                        'Defaulting to capacity of %s', str(MY_IFACE))
+        file.warning('HOST_BANDWIDTH argument invalid or missing',
+                     exc_info=True)
+BANDWIDTH = _bandwidth
+
 try:
     SIM_EXEC_MIN = float(getenv('SIMULATOR_EXEC_MIN', None))
     try:
@@ -148,13 +174,72 @@ except:
     SIM_EXEC_MIN = 0
     SIM_EXEC_MAX = 10
 
+# reservations are leased, and reclaimed when their lease expires if it is
+# not renewed (by protocol progress) in time, so resources of requests whose DACK was lost,
+# or whose thread died, are not held until restart
+try:
+    SIM_LEASE = float(getenv('SIMULATOR_LEASE', None))
+    if SIM_LEASE <= 0:
+        raise ValueError
+except:
+    console.warning('SIMULATOR:LEASE parameter invalid or missing from '
+                    'received configuration. '
+                    'Defaulting to 60s')
+    file.warning('SIMULATOR:LEASE parameter invalid or missing from '
+                 'received configuration', exc_info=True)
+    SIM_LEASE = 60
+
 # simulation variables of reserved resources
 _reserved = {
     'cpu': 0.0,
     'ram': 0.0,  # in MB
     'disk': 0.0,  # in GB
+    'bandwidth': 0.0,  # in Mbit/s
 }
 _reserved_lock = Lock()  # for thread safety
+# ledger of reservations (keys are (consumer IP, request ID), values are
+# [cpu, ram, disk, bandwidth, lease deadline])
+_leases = {}
+# deadline timers of leases: heap of (deadline, sequence number, key) (so
+# keys are never compared), and {key: deadline armed} (renewals pushing a
+# deadline back do not arm a new timer, the armed one re-arms itself when it
+# fires before the lease expired)
+_expiries = []
+_armed = {}
+_sequence = count()
+# notified when a timer earlier than all others is armed
+_expiry = Condition(_reserved_lock)
+# ledger counters: 'reclaimed' (leases expired), 'drifts' (drifts of
+# simulation variables detected by reconcile) and 'corrections' (drifts
+# corrected by reconcile)
+lease_stats = {'reclaimed': 0, 'drifts': 0, 'corrections': 0}
+# max difference between simulation variables and ledger (rounding)
+_DRIFT = 1e-6
+
+# dimensions of admission control (resources reserved per request)
+# (max delay and jitter of CoS are not checked, as the monitor does not
+# measure them)
+_DIMS = ('cpu', 'ram', 'disk', 'bandwidth')
+# matrix of requirements (rows are CoS, columns are min cpu, ram, disk and
+# bandwidth), built as CoS are first requested
+_specs = np.empty((0, len(_DIMS)))
+# {CoS ID: (requirements, row of _specs)} (row rewritten if the CoS changed)
+_rows = {}
+
+
+def get_bandwidth():
+    '''
+        Returns free bandwidth (in Mbit/s) of main interface (both ways),
+        inf if not measured.
+    '''
+
+    if SIM_ON:
+        return _capacity() - _reserved['bandwidth']
+    # (measured free bandwidth already excludes traffic of running
+    # executions, so reservations are not subtracted)
+    port = MEASURES.get(MY_IFACE, {})
+    return min(port.get('bandwidth_up', float('inf')),
+               port.get('bandwidth_down', float('inf')))
 
 
 def get_resources(quiet: bool = False, _all: bool = False):
@@ -212,71 +297,230 @@ def get_resources(quiet: bool = False, _all: bool = False):
 
 def check_resources(req: Request, quiet: bool = False):
     '''
-        Returns True if current resources can satisfy requirements of Request, 
-        False if not.
+        Returns True if current resources (CPU, RAM, disk, and bandwidth of
+        main interface) can satisfy requirements of Request, False if not.
     '''
 
     with _reserved_lock:
-        min_cpu = req.get_min_cpu()
-        min_ram = req.get_min_ram()
-        min_disk = req.get_min_disk()
-        if not quiet:
-            console.info('required(cpu=%.3f, ram=%.2fMB, disk=%.2fGB)' %
-                         (min_cpu, min_ram, min_disk))
-        cpu, ram, disk = get_resources(quiet)
-        return (cpu - min_cpu >= CPU_THRESHOLD
-                and ram - min_ram >= RAM_THRESHOLD
-                and disk - min_disk >= DISK_THRESHOLD)
-
-
-def reserve_resources(req: Request):
+        return _admit(req, quiet)[0]
+
+
+def reserve_resources(req: Request, key: tuple = None):
     '''
-        Add quantity of resources to be reserved for Request to simulation 
-        variables.
+        Add quantity of resources (including bandwidth) to be reserved for
+        Request to simulation variables, and lease them to key (consumer IP,
+        request ID) for SIM_LEASE.
 
         Returns True if reserved, False if not.
     '''
 
+    if key is None:
+        key = (None, req.id)
     with _reserved_lock:
-        min_cpu = req.get_min_cpu()
-        min_ram = req.get_min_ram()
-        min_disk = req.get_min_disk()
-        console.info('required(cpu=%.3f, ram=%.2fMB, disk=%.2fGB)' %
-                     (min_cpu, min_ram, min_disk))
-        cpu, ram, disk = get_resources(quiet=True)
-        if (cpu - min_cpu >= CPU_THRESHOLD
-                and ram - min_ram >= RAM_THRESHOLD
-                and disk - min_disk >= DISK_THRESHOLD):
-            _reserved['cpu'] += min_cpu
-            _reserved['ram'] += min_ram
-            _reserved['disk'] += min_disk
+        # (already reserved for key)
+        if key in _leases:
+            _leases[key][-1] = time() + SIM_LEASE
+            _arm(key, _leases[key][-1])
+            return True
+        ok, required = _admit(req)
+        if ok:
+            for dim, amount in zip(_DIMS, required):
+                _reserved[dim] += amount
+            _leases[key] = [*required, time() + SIM_LEASE]
+            _arm(key, _leases[key][-1])
             get_resources()
             return True
         else:
             return False
 
 
-def free_resources(req: Request):
+def free_resources(req: Request, key: tuple = None):
     '''
-        Subtract quantity of resources reserved for Request from simulation 
-        variables.
+        Subtract quantity of resources reserved for Request (leased to key,
+        consumer IP and request ID) from simulation variables.
 
-        Returns True if freed, False if not.
+        Returns True if freed, False if not (not reserved, or lease already
+        reclaimed).
     '''
 
+    if key is None:
+        key = (None, req.id)
     with _reserved_lock:
-        _reserved['cpu'] -= req.get_min_cpu()
-        if _reserved['cpu'] < 0:
-            _reserved['cpu'] = 0.0
-        _reserved['ram'] -= req.get_min_ram()
-        if _reserved['ram'] < 0:
-            _reserved['ram'] = 0.0
-        _reserved['disk'] -= req.get_min_disk()
-        if _reserved['disk'] < 0:
-            _reserved['disk'] = 0.0
+        lease = _leases.pop(key, None)
+        if not lease:
+            return False
+        _armed.pop(key, None)
+        _release(lease)
         get_resources()
         return True
-    
+
+
+def renew_lease(key: tuple, duration: float = None):
+    '''
+        Push back expiry of reservation leased to key (consumer IP, request
+        ID) to duration (in seconds, SIM_LEASE by default, inf to hold it
+        until next renewal) from now.
+
+        Returns True if renewed, False if not (not reserved, or lease already
+        reclaimed).
+    '''
+
+    with _reserved_lock:
+        lease = _leases.get(key, None)
+        if not lease:
+            return False
+        lease[-1] = time() + (SIM_LEASE if duration is None else duration)
+        _arm(key, lease[-1])
+        return True
+
+
+def reconcile(fix: bool = False):
+    '''
+        Returns report comparing ledger of reservations with simulation
+        variables: dict of 'leases' (number of leases), 'reserved' and
+        'leased' (dicts of cpu, ram, disk and bandwidth, as counted by
+        simulation variables and as summed from ledger), 'drift' (True if
+        they differ) and lease_stats.
+
+        If fix, simulation variables are set to the ledger's sums (drift is
+        a bug to report, so it is not corrected by default).
+    '''
+
+    with _reserved_lock:
+        leased = dict(zip(_DIMS,
+                          (sum(lease[i] for lease in _leases.values())
+                           for i in range(len(_DIMS)))))
+        reserved = dict(_reserved)
+        drift = any(abs(reserved[r] - leased[r]) > _DRIFT for r in leased)
+        if drift and fix:
+            _reserved.update(leased)
+            lease_stats['corrections'] += 1
+        return {'leases': len(_leases), 'reserved': reserved,
+                'leased': leased, 'drift': drift, **lease_stats}
+
+
+def _release(lease: list):
+    # (called with _reserved_lock held)
+    for dim, amount in zip(_DIMS, lease):
+        _reserved[dim] -= amount
+
+
+def _capacity():
+    # bandwidth capacity (in Mbit/s) of main interface, inf if unknown
+    if BANDWIDTH != float('inf'):
+        return BANDWIDTH
+    return MEASURES.get(MY_IFACE, {}).get('capacity', BANDWIDTH)
+
+
+def _requirements(req: Request):
+    # row of requirements of CoS of request (added to matrix on first
+    # request of CoS, and rewritten when the CoS's requirements changed)
+    global _specs
+    required = (req.get_min_cpu(), req.get_min_ram(), req.get_min_disk(),
+                req.get_min_bandwidth())
+    cached = _rows.get(req.cos.id, None)
+    if cached is None:
+        _specs = np.vstack((_specs, required))
+        row = len(_specs) - 1
+    else:
+        row = cached[1]
+        if cached[0] == required:
+            return _specs[row]
+        _specs[row] = required
+    _rows[req.cos.id] = (required, row)
+    return _specs[row]
+
+
+def _admit(req: Request, quiet: bool = False):
+    # returns True if free resources (minus thresholds) satisfy requirements
+    # of request in every dimension (called with _reserved_lock held), and
+    # quantities to reserve
+    required = _requirements(req)
+    if not quiet:
+        console.info('required(cpu=%.3f, ram=%.2fMB, disk=%.2fGB, '
+                     'bandwidth=%.2fMbit/s)' % tuple(required))
+    cpu, ram, disk = get_resources(quiet)
+    capacity = _capacity()
+    bandwidth_threshold = (capacity * THRESHOLD
+                           if capacity != float('inf') else 0)
+    free = np.array([cpu - CPU_THRESHOLD, ram - RAM_THRESHOLD,
+                     disk - DISK_THRESHOLD,
+                     get_bandwidth() - bandwidth_threshold])
+    return (bool(np.all(free >= required)),
+            [float(amount) for amount in required])
+
+
+def _arm(key: tuple, deadline: float):
+    # arm deadline timer of lease, unless one fires before deadline (called
+    # with _reserved_lock held)
+    if deadline == float('inf'):
+        return
+    armed = _armed.get(key, None)
+    if armed is not None and armed <= deadline:
+        return
+    _armed[key] = deadline
+    heappush(_expiries, (deadline, next(_sequence), key))
+    if _expiries[0][2] == key:
+        _expiry.notify()
+
+
+def _expire():
+    # reclaim reservations when their lease expires
+    with _reserved_lock:
+        while True:
+            now = time()
+            while _expiries and _expiries[0][0] <= now:
+                deadline, _, key = heappop(_expiries)
+                # (timer of freed lease, or superseded by an earlier one)
+                if _armed.get(key, None) != deadline:
+                    continue
+                del _armed[key]
+                lease = _leases.get(key, None)
+                if lease is None:
+                    continue
+                # (renewed since armed)
+                if lease[-1] > now:
+                    _arm(key, lease[-1])
+                    continue
+                _release(_leases.pop(key))
+                lease_stats['reclaimed'] += 1
+                console.warning('Lease of reservation %s expired, reclaiming '
+                                'resources', str(key))
+                file.warning('Lease of reservation %s expired, reclaiming '
+                             'resources', str(key))
+            _expiry.wait(_expiries[0][0] - now if _expiries else None)
+
+
+def _reconcile():
+    # check simulation variables against ledger every MONITOR_PERIOD, and
+    # report drift (once per drifted value, without correcting it)
+    reported = None
+    while True:
+        sleep(MONITOR_PERIOD)
+        try:
+            report = reconcile()
+            if not report['drift']:
+                reported = None
+            elif report['reserved'] != reported:
+                reported = report['reserved']
+                with _reserved_lock:
+                    lease_stats['drifts'] += 1
+                console.warning('Reserved resources drifted from ledger '
+                                '(%s instead of %s)',
+                                str(report['reserved']),
+                                str(report['leased']))
+                file.warning('Reserved resources drifted from ledger (%s '
+                             'instead of %s)',
+                             str(report['reserved']), str(report['leased']))
+        except Exception:
+            file.exception('Reconciliation of reservations failed')
+
+
+if IS_RESOURCE:
+    Thread(target=_expire, daemon=True).start()
+    Thread(target=_reconcile, daemon=True).start()
+
+
 def run_iperf2_cmd(cmd:str):
     #print('cmd = %s',cmd)
     process = None
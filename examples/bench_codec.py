@@ -0,0 +1,214 @@
+'''
+    Benchmark of the hand-written MyProtocol codec (client/protocol/codec.py)
+    against the Scapy path (building and dissecting Ether/IP/MyProtocol), in
+    packets per second, for both BROADCAST and ORCHESTRATOR modes.
+
+    It also checks that both paths are wire-compatible (same bytes on
+    encoding, same fields on decoding).
+
+    MyProtocol can not be imported without the configuration received from
+    the server, so its fields_desc are replicated below (keep them in sync
+    with protocol_bcst.py and protocol_orch.py).
+
+    Usage: python bench_codec.py [number of packets]
+'''
+
+
+from sys import argv, path
+from os.path import dirname, abspath, join
+from time import perf_counter
+
+_client = abspath(join(dirname(__file__), '..', 'client'))
+path.insert(0, join(_client, 'protocol'))
+path.insert(0, _client)
+
+from scapy.all import (Packet, ByteField, StrLenField, IntField, StrField,
+                       SignedIntField, ShortField, LongField, IEEEDoubleField,
+                       ConditionalField, Ether, IP, bind_layers)
+
+from codec import Codec, Message, MAX_FRAME
+from consts import *
+
+
+class BcstProtocol(Packet):
+    name = 'MyProtocol (BCST)'
+    fields_desc = [
+        ByteField('state', HREQ),
+        StrLenField('req_id', '', lambda _: REQ_ID_LEN),
+        IntField('attempt_no', 1),
+        ConditionalField(IntField('cos_id', 1),
+                         lambda pkt: pkt.state == HREQ or pkt.state == RREQ),
+        ConditionalField(SignedIntField('deadline', 0),
+                         lambda pkt: pkt.state in (HREQ, RREQ, DREQ)),
+        ConditionalField(ByteField('kind', DREQ),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(IntField('seq', 0),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(ShortField('frag_size', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(IntField('total', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(LongField('bitmap', 0),
+                         lambda pkt: pkt.state == DSACK),
+        ConditionalField(StrField('data', ''),
+                         lambda pkt: pkt.state == DREQ or pkt.state == DRES
+                         or pkt.state == DFRAG or pkt.state == RREQ),
+        ConditionalField(IEEEDoubleField('cpu_offer', 0),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
+        ConditionalField(IEEEDoubleField('ram_offer', 0),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
+        ConditionalField(IEEEDoubleField('disk_offer', 0),
+                         lambda pkt: pkt.state == HRES or pkt.state == HANN),
+        ConditionalField(ShortField('queue', 0),
+                         lambda pkt: pkt.state == HANN),
+    ]
+
+
+class OrchProtocol(Packet):
+    name = 'MyProtocol (ORCH)'
+    fields_desc = [
+        ByteField('state', HREQ),
+        StrLenField('req_id', '', lambda _: REQ_ID_LEN),
+        IntField('attempt_no', 1),
+        ConditionalField(IntField('cos_id', 1),
+                         lambda pkt: pkt.state == HREQ or pkt.state == RREQ),
+        ConditionalField(SignedIntField('deadline', 0),
+                         lambda pkt: pkt.state == HREQ or pkt.state == DREQ),
+        ConditionalField(ByteField('kind', DREQ),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(IntField('seq', 0),
+                         lambda pkt: pkt.state == DFRAG or pkt.state == DSACK),
+        ConditionalField(ShortField('frag_size', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(IntField('total', 0),
+                         lambda pkt: pkt.state == DFRAG),
+        ConditionalField(LongField('bitmap', 0),
+                         lambda pkt: pkt.state == DSACK),
+        ConditionalField(StrField('data', ''),
+                         lambda pkt: pkt.state == DREQ or pkt.state == DRES
+                         or pkt.state == DFRAG),
+        ConditionalField(StrLenField('src_mac', ' ' * MAC_LEN,
+                                     lambda _: MAC_LEN),
+                         lambda pkt: pkt.state in (RREQ, RRES, RACK, RCAN,
+                                                   DACK, DCAN)),
+        ConditionalField(StrLenField('src_ip', ' ' * IP_LEN, lambda _: IP_LEN),
+                         lambda pkt: pkt.state in (RREQ, RRES, RACK, RCAN,
+                                                   DACK, DCAN)),
+        ConditionalField(StrLenField('host_mac', ' ' * MAC_LEN,
+                                     lambda _: MAC_LEN),
+                         lambda pkt: pkt.state in (HRES, DCAN, DACK)),
+        ConditionalField(StrLenField('host_ip', ' ' * IP_LEN,
+                                     lambda _: IP_LEN),
+                         lambda pkt: pkt.state in (HRES, DCAN, DACK)),
+    ]
+
+
+SRC, DST = '10.0.0.1', '10.0.0.2'
+SRC_MAC, DST_MAC = '00:00:00:00:00:01', '00:00:00:00:00:02'
+REQ_ID = 'aB3dE5gH7j'
+
+MESSAGES = {
+    SEND_TO_BROADCAST: [
+        dict(state=HREQ, cos_id=3, deadline=250),
+        dict(state=HRES, cpu_offer=1.5, ram_offer=512.0, disk_offer=10.0),
+        dict(state=RREQ, cos_id=3, deadline=-20, data=b'input'),
+        dict(state=DREQ, deadline=120, data=b'data + program' * 8),
+        dict(state=DRES, data=b'result'),
+        dict(state=DACK),
+        dict(state=DFRAG, kind=DREQ, seq=7, frag_size=1400, total=10000,
+             data=b'fragment' * 175),
+        dict(state=DSACK, kind=DRES, seq=3, bitmap=0b1011),
+        dict(state=HANN, attempt_no=42, cpu_offer=2.0, ram_offer=1024.0,
+             disk_offer=20.0, queue=3),
+    ],
+    SEND_TO_ORCHESTRATOR: [
+        dict(state=HREQ, cos_id=3, deadline=250),
+        dict(state=HRES, host_mac=DST_MAC, host_ip=DST),
+        dict(state=RREQ, cos_id=3, src_mac=SRC_MAC, src_ip=SRC),
+        dict(state=DREQ, deadline=120, data=b'data + program' * 8),
+        dict(state=DRES, data=b'result'),
+        dict(state=DACK, src_mac=SRC_MAC, src_ip=SRC, host_mac=DST_MAC,
+             host_ip=DST),
+        dict(state=DFRAG, kind=DREQ, seq=7, frag_size=1400, total=10000,
+             data=b'fragment' * 175),
+        dict(state=DSACK, kind=DRES, seq=3, bitmap=0b1011),
+    ],
+}
+
+
+def _scapy_fields(fields: dict):
+    # scapy expects fixed-length strings already padded
+    fields = dict(fields)
+    for name, length in (('src_mac', MAC_LEN), ('src_ip', IP_LEN),
+                         ('host_mac', MAC_LEN), ('host_ip', IP_LEN)):
+        if name in fields:
+            fields[name] = fields[name].ljust(length, ' ')
+    return fields
+
+
+def _check(mode: str, proto, codec: Codec, buf: bytearray):
+    for fields in MESSAGES[mode]:
+        pkt = (Ether(src=SRC_MAC, dst=DST_MAC) / IP(src=SRC, dst=DST)
+               / proto(req_id=REQ_ID, **_scapy_fields(fields)))
+        raw = bytes(pkt)
+        length = codec.encode_frame_into(buf, Message(req_id=REQ_ID,
+                                                      **fields),
+                                         SRC, DST, SRC_MAC, DST_MAC)
+        assert raw == bytes(buf[:length]), (mode, fields)
+        msg = codec.decode_frame(memoryview(raw))
+        assert msg.src == SRC and msg.dst == DST, (mode, fields)
+        assert msg.req_id == REQ_ID, (mode, fields)
+        for name, value in fields.items():
+            assert getattr(msg, name) == value, (mode, name)
+
+
+def _bench_scapy(mode: str, proto, n: int):
+    frames = [bytes(Ether(src=SRC_MAC, dst=DST_MAC) / IP(src=SRC, dst=DST)
+                    / proto(req_id=REQ_ID, **_scapy_fields(fields)))
+              for fields in MESSAGES[mode]]
+    built = [_scapy_fields(fields) for fields in MESSAGES[mode]]
+    k = len(frames)
+    start = perf_counter()
+    for i in range(n):
+        pkt = Ether(frames[i % k])
+        pkt[proto].state
+        bytes(Ether(src=SRC_MAC, dst=DST_MAC) / IP(src=SRC, dst=DST)
+              / proto(req_id=REQ_ID, **built[i % k]))
+    return n / (perf_counter() - start)
+
+
+def _bench_codec(codec: Codec, mode: str, n: int):
+    frames = [bytes(codec_buf[:codec.encode_frame_into(
+        codec_buf, Message(req_id=REQ_ID, **fields), SRC, DST, SRC_MAC,
+        DST_MAC)]) for fields in MESSAGES[mode]]
+    messages = [Message(req_id=REQ_ID, **fields) for fields in MESSAGES[mode]]
+    recv_buf = bytearray(MAX_FRAME)
+    recv_view = memoryview(recv_buf)
+    k = len(frames)
+    start = perf_counter()
+    for i in range(n):
+        frame = frames[i % k]
+        length = len(frame)
+        recv_buf[:length] = frame  # stands for socket.recv_into
+        codec.decode_frame(recv_view, length).state
+        codec.encode_frame_into(codec_buf, messages[i % k], SRC, DST,
+                                SRC_MAC, DST_MAC)
+    return n / (perf_counter() - start)
+
+
+codec_buf = bytearray(MAX_FRAME)
+
+
+if __name__ == '__main__':
+    n = int(argv[1]) if len(argv) > 1 else 20000
+    for mode, proto in ((SEND_TO_BROADCAST, BcstProtocol),
+                        (SEND_TO_ORCHESTRATOR, OrchProtocol)):
+        bind_layers(IP, proto)
+        codec = Codec(mode)
+        _check(mode, proto, codec, codec_buf)
+        scapy_pps = _bench_scapy(mode, proto, n)
+        codec_pps = _bench_codec(codec, mode, n)
+        print('%-12s scapy: %10.0f pkt/s   codec: %10.0f pkt/s   (x%.1f)' %
+              (mode, scapy_pps, codec_pps, codec_pps / scapy_pps))
+        # unbind so the next mode's layer is used for dissection
+        IP.payload_guess = [g for g in IP.payload_guess if g[1] is not proto]
@@ -0,0 +1,93 @@
+'''
+    Measure the per-packet CPU cost of receiving MyProtocol traffic with and
+    without the kernel BPF filter, while other traffic (e.g. the iPerf flood
+    of a CoS 3 streaming execution) is running on the same interface.
+
+    Two receive sockets are opened on the interface, side by side:
+
+    - without filter: only the 'inbound' filter is attached (as in the former
+      responder), and every packet is dissected with Scapy;
+
+    - with filter: the MyProtocol BPF filter is attached, and every packet is
+      decoded with the codec.
+
+    Each is read by its own thread, whose CPU time is measured.
+
+    Usage (as root, while a CoS 3 execution is running):
+
+        IFACE=eth0 IP_PROTO=253 DURATION=30 python bench_filter.py
+'''
+
+
+from os import getenv
+from sys import path
+from os.path import dirname, abspath, join
+from threading import Thread
+from time import time, thread_time
+from socket import socket, htons, timeout, AF_PACKET, SOCK_RAW
+
+_client = abspath(join(dirname(__file__), '..', 'client'))
+path.insert(0, join(_client, 'protocol'))
+path.insert(0, _client)
+
+from scapy.all import Ether
+
+from bpf import attach_filter
+from codec import Codec, MAX_FRAME
+
+
+ETH_P_ALL = 0x0003
+
+IFACE = getenv('IFACE', 'eth0')
+IP_PROTO = int(getenv('IP_PROTO', '253'), 0)
+ETHER_TYPE = int(getenv('ETHER_TYPE', '0x88B5'), 0)
+DURATION = float(getenv('DURATION', '30'))
+
+
+def _receive(filtered: bool, results: dict):
+    sock = socket(AF_PACKET, SOCK_RAW, htons(ETH_P_ALL))
+    sock.bind((IFACE, ETH_P_ALL))
+    if filtered:
+        attach_filter(sock, IP_PROTO, ETHER_TYPE)
+    else:
+        attach_filter(sock, None)
+    sock.settimeout(0.1)
+    codec = Codec(ip_proto=IP_PROTO, ether_type=ETHER_TYPE)
+    buf = bytearray(MAX_FRAME)
+    view = memoryview(buf)
+    packets = 0
+    start = thread_time()
+    end = time() + DURATION
+    while time() < end:
+        try:
+            length = sock.recv_into(buf)
+        except timeout:
+            continue
+        packets += 1
+        if filtered:
+            codec.decode_frame(view, length)
+        else:
+            Ether(bytes(view[:length]))
+    results[filtered] = (packets, thread_time() - start)
+    sock.close()
+
+
+if __name__ == '__main__':
+    results = {}
+    threads = [Thread(target=_receive, args=(filtered, results))
+               for filtered in (False, True)]
+    print('Receiving on %s for %.0fs...' % (IFACE, DURATION))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for filtered, label in ((False, 'without filter'), (True, 'with filter')):
+        packets, cpu = results[filtered]
+        print('%-15s %8d packets (%8.1f/s)   CPU %7.3fs (%5.1f%%)   '
+              '%8.1f us/packet' % (label, packets, packets / DURATION, cpu,
+                                   cpu / DURATION * 100,
+                                   cpu / packets * 1e6 if packets else 0))
+    (before, cpu_before), (after, cpu_after) = results[False], results[True]
+    print('CPU saved: %.3fs (%.1f%%)' % (
+        cpu_before - cpu_after,
+        (cpu_before - cpu_after) / cpu_before * 100 if cpu_before else 0))
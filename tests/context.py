@@ -1,5 +1,33 @@
 from sys import path
+from os import environ
 from os.path import dirname, abspath, join
 
 
 path.insert(0, abspath(join(dirname(__file__), '..')))
+
+# modules of client are imported by name (like client/__init__.py does)
+_client = abspath(join(dirname(__file__), '..', 'client'))
+path.insert(0, join(_client, 'protocol'))
+path.insert(0, _client)
+
+# configuration normally received from the server on connect() (only used
+# where not already set)
+for _key, _value in {
+        'SERVER_IP': '127.0.0.1',
+        'SERVER_API_PORT': '8080',
+        'IS_RESOURCE': 'TRUE',
+        'RESOURCE_LIMIT': '100',
+        'SIMULATOR_ACTIVE': 'TRUE',
+        'HOST_CPU': '4',
+        'HOST_RAM': '4096',
+        'HOST_DISK': '64',
+        'HOST_BANDWIDTH': '100',
+        'SIMULATOR_LEASE': '60',
+        'PROTOCOL_SEND_TO': 'ORCHESTRATOR',
+        'PROTOCOL_TIMEOUT': '0.2',
+        'PROTOCOL_RETRIES': '3',
+        'CONTROLLER_DECOY_MAC': '00:00:00:00:00:fe',
+        'CONTROLLER_DECOY_IP': '10.0.0.254',
+        'DATABASE_COS': "[{'id': 1, 'name': 'best_effort'}]",
+}.items():
+    environ.setdefault(_key, _value)
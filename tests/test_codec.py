@@ -0,0 +1,123 @@
+import pytest
+from scapy.all import Ether, IP
+
+from . import context
+from codec import Codec, Message, MAX_FRAME, ETH_HLEN, IP_HLEN
+from consts import *
+
+import protocol_bcst as bcst
+import protocol_orch as orch
+
+
+SRC, DST = '10.0.0.1', '10.0.0.2'
+SRC_MAC, DST_MAC = '00:00:00:00:00:01', '00:00:00:00:00:02'
+REQ_ID = 'aB3dE5gH7j'
+
+# messages of each mode, checked against the MyProtocol of the mode (so the
+# codec is kept in sync with its fields_desc)
+MESSAGES = {
+    SEND_TO_BROADCAST: [
+        dict(state=HREQ, cos_id=3, deadline=250),
+        dict(state=HRES, cpu_offer=1.5, ram_offer=512.0, disk_offer=10.0),
+        dict(state=RREQ, cos_id=3, deadline=-20, data=b'input'),
+        dict(state=RRES),
+        dict(state=RCAN),
+        dict(state=DREQ, deadline=120, data=b'data + program' * 8),
+        dict(state=DRES, data=b'result'),
+        dict(state=DWAIT),
+        dict(state=DACK),
+        dict(state=DCAN),
+        dict(state=DFRAG, kind=DREQ, seq=7, frag_size=1400, total=10000,
+             data=b'fragment' * 175),
+        dict(state=DSACK, kind=DRES, seq=3, bitmap=0b1011),
+        dict(state=HANN, attempt_no=42, cpu_offer=2.0, ram_offer=1024.0,
+             disk_offer=20.0, queue=3),
+    ],
+    SEND_TO_ORCHESTRATOR: [
+        dict(state=HREQ, cos_id=3, deadline=250),
+        dict(state=HRES, host_mac=DST_MAC, host_ip=DST),
+        dict(state=RREQ, cos_id=3, src_mac=SRC_MAC, src_ip=SRC),
+        dict(state=RRES, src_mac=SRC_MAC, src_ip=SRC),
+        dict(state=RACK, src_mac=SRC_MAC, src_ip=SRC),
+        dict(state=RCAN, src_mac=SRC_MAC, src_ip=SRC),
+        dict(state=DREQ, deadline=120, data=b'data + program' * 8),
+        dict(state=DRES, data=b'result'),
+        dict(state=DWAIT),
+        dict(state=DACK, src_mac=SRC_MAC, src_ip=SRC, host_mac=DST_MAC,
+             host_ip=DST),
+        dict(state=DCAN, src_mac=SRC_MAC, src_ip=SRC, host_mac=DST_MAC,
+             host_ip=DST),
+        dict(state=DFRAG, kind=DREQ, seq=7, frag_size=1400, total=10000,
+             data=b'fragment' * 175),
+        dict(state=DSACK, kind=DRES, seq=3, bitmap=0b1011),
+    ],
+}
+
+MODES = [(SEND_TO_BROADCAST, bcst.MyProtocol, bcst.engine.codec),
+         (SEND_TO_ORCHESTRATOR, orch.MyProtocol, orch.engine.codec)]
+CASES = [(mode, proto, codec, fields) for mode, proto, codec in MODES
+         for fields in MESSAGES[mode]]
+
+
+def scapy_fields(fields: dict):
+    # (fixed-length strings are padded by MyProtocol's users)
+    fields = dict(fields)
+    for name, length in (('src_mac', MAC_LEN), ('src_ip', IP_LEN),
+                         ('host_mac', MAC_LEN), ('host_ip', IP_LEN)):
+        if name in fields:
+            fields[name] = fields[name].ljust(length, ' ')
+    return fields
+
+
+def scapy_value(name: str, value):
+    # (addresses are decoded and stripped by the codec, data is not)
+    if name != 'data' and isinstance(value, bytes):
+        return value.decode().strip()
+    return value
+
+
+@pytest.mark.parametrize('mode, proto, codec, fields', CASES)
+def test_encoding_matches_scapy(mode, proto, codec, fields):
+    pkt = (Ether(src=SRC_MAC, dst=DST_MAC)
+           / IP(src=SRC, dst=DST, proto=codec.ip_proto)
+           / proto(req_id=REQ_ID, **scapy_fields(fields)))
+    buf = bytearray(MAX_FRAME)
+    length = codec.encode_frame_into(buf, Message(req_id=REQ_ID, **fields),
+                                     SRC, DST, SRC_MAC, DST_MAC)
+    assert bytes(buf[:length]) == bytes(pkt)
+    assert codec.size(Message(req_id=REQ_ID, **fields)) == len(
+        bytes(pkt[proto]))
+
+
+@pytest.mark.parametrize('mode, proto, codec, fields', CASES)
+def test_decoding_matches_scapy(mode, proto, codec, fields):
+    raw = bytes(Ether(src=SRC_MAC, dst=DST_MAC)
+                / IP(src=SRC, dst=DST, proto=codec.ip_proto)
+                / proto(req_id=REQ_ID, **scapy_fields(fields)))
+    msg = codec.decode_frame(memoryview(raw))
+    dissected = proto(raw[ETH_HLEN + IP_HLEN:])
+    assert (msg.src, msg.dst) == (SRC, DST)
+    assert msg.req_id == REQ_ID
+    for field in dissected.fields_desc:
+        name = field.name
+        if name == 'req_id':
+            continue
+        value = dissected.getfieldval(name)
+        if name in dissected.fields:
+            assert getattr(msg, name) == scapy_value(name, value), name
+    for name, value in fields.items():
+        assert getattr(msg, name) == value, name
+
+
+def test_other_protocol_is_not_decoded():
+    codec = Codec(SEND_TO_BROADCAST, 253)
+    raw = bytes(Ether() / IP(src=SRC, dst=DST, proto=6) / (b'x' * 40))
+    assert codec.decode_frame(memoryview(raw)) is None
+
+
+def test_truncated_message_is_not_decoded():
+    codec = bcst.engine.codec
+    raw = bytes(Ether(src=SRC_MAC, dst=DST_MAC)
+                / IP(src=SRC, dst=DST, proto=codec.ip_proto)
+                / bcst.MyProtocol(state=HANN, req_id=REQ_ID))
+    assert codec.decode_frame(memoryview(raw[:-4])) is None
@@ -0,0 +1,101 @@
+from time import time
+
+import pytest
+
+from . import context
+from codec import Codec, Message
+from consts import SEND_TO_BROADCAST, DREQ, DFRAG, DSACK
+from engine import Engine, MAX_REASSEMBLIES_PER_SOURCE
+
+
+SRC = '10.0.0.1'
+FRAG_SIZE = 100
+DATA = bytes(range(256)) * 4  # (11 fragments, the last one shorter)
+
+
+@pytest.fixture
+def engine():
+    # receiving side only, fed fragments directly (its sockets are never
+    # opened, and its timers never fire)
+    engine = Engine(Codec(SEND_TO_BROADCAST))
+    engine.sent = []
+    engine.delivered = []
+    engine.send = lambda msg, dst, dst_mac=None: engine.sent.append(msg)
+    engine._deliver = engine.delivered.append
+    return engine
+
+
+def fragment(seq: int, data: bytes = DATA, src: str = SRC,
+             req_id: str = 'req'):
+    return Message(state=DFRAG, req_id=req_id, attempt_no=1, kind=DREQ,
+                   seq=seq, frag_size=FRAG_SIZE, total=len(data),
+                   data=data[seq * FRAG_SIZE:(seq + 1) * FRAG_SIZE],
+                   src=src, timestamp=time())
+
+
+def sacks(engine):
+    return [(msg.seq, msg.bitmap) for msg in engine.sent
+            if msg.state == DSACK]
+
+
+def test_in_order_fragments_are_reassembled(engine):
+    for seq in range(11):
+        engine._on_fragment(fragment(seq))
+    assert len(engine.delivered) == 1
+    msg = engine.delivered[0]
+    assert (msg.state, msg.src, msg.data) == (DREQ, SRC, DATA)
+    # acknowledged every ACK_EVERY fragments, and on completion
+    assert sacks(engine)[-1] == (11, 0)
+    assert not engine._reassemblies and not engine._sources
+
+
+def test_lost_fragments_are_reported_and_filled(engine):
+    lost = (2, 5)
+    for seq in range(11):
+        if seq not in lost:
+            engine._on_fragment(fragment(seq))
+    assert not engine.delivered
+    # (gap acknowledged right away, with fragments received after it)
+    base, bitmap = sacks(engine)[-1]
+    assert base == 2
+    assert not bitmap & 1 << (5 - 3)
+    assert bitmap & 1 << (4 - 3)
+    for seq in lost:
+        engine._on_fragment(fragment(seq))
+    assert len(engine.delivered) == 1
+    assert engine.delivered[0].data == DATA
+
+
+def test_duplicates_are_acknowledged_but_not_delivered_twice(engine):
+    for seq in (0, 1, 1, 0, 2):
+        engine._on_fragment(fragment(seq))
+    n = len(sacks(engine))
+    assert n >= 2
+    for seq in range(3, 11):
+        engine._on_fragment(fragment(seq))
+    assert len(engine.delivered) == 1
+    # transfer retried after reassembly (answer lost): acknowledged again,
+    # and delivered again only once
+    engine._on_fragment(fragment(4))
+    engine._on_fragment(fragment(0))
+    engine._on_fragment(fragment(1))
+    assert len(engine.delivered) == 2
+    assert sacks(engine)[-1] == (11, 0)
+
+
+def test_invalid_first_fragment_starts_no_reassembly(engine):
+    engine._on_fragment(fragment(0, data=b''))
+    frag = fragment(0)
+    frag.frag_size = 0
+    engine._on_fragment(frag)
+    assert not engine._reassemblies
+
+
+def test_reassemblies_per_source_are_bounded(engine):
+    for i in range(MAX_REASSEMBLIES_PER_SOURCE + 1):
+        engine._on_fragment(fragment(0, req_id='req%d' % i))
+    assert len(engine._reassemblies) == MAX_REASSEMBLIES_PER_SOURCE
+    assert engine.stats['refused'] == 1
+    # (other sources are not refused)
+    engine._on_fragment(fragment(0, src='10.0.0.9'))
+    assert len(engine._reassemblies) == MAX_REASSEMBLIES_PER_SOURCE + 1
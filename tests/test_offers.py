@@ -0,0 +1,69 @@
+from . import context
+from codec import Message
+from consts import HRES
+from model import CoS, CoSSpecs
+from offers import rank, register_policy, policies
+
+
+COS = CoS(1, 'cos', CoSSpecs(min_cpu=1, min_ram=100, min_disk=1))
+SENT_AT = 100.0
+
+
+def offer(src: str, cpu: float, ram: float, disk: float, rtt: float):
+    return Message(state=HRES, req_id='req', cpu_offer=cpu, ram_offer=ram,
+                   disk_offer=disk, src=src, timestamp=SENT_AT + rtt)
+
+
+OFFERS = [
+    # (arrival order is order of the list)
+    offer('small', 1.5, 200, 2, 0.001),
+    offer('large', 8, 8000, 100, 0.002),
+    offer('too small', 0.5, 50, 1, 0.003),
+    offer('fit', 1.1, 110, 1.1, 0.004),
+]
+
+
+def hosts(offers):
+    return [o.src for o in offers]
+
+
+def test_no_offers():
+    assert rank([], COS, 'fit', SENT_AT) == []
+
+
+def test_first():
+    assert hosts(rank(OFFERS, COS, 'first', SENT_AT)) == [
+        'small', 'large', 'too small', 'fit']
+
+
+def test_most_cpu():
+    assert hosts(rank(OFFERS, COS, 'cpu', SENT_AT)) == [
+        'large', 'small', 'fit', 'too small']
+
+
+def test_best_fit_excludes_offers_below_minimums():
+    assert hosts(rank(OFFERS, COS, 'fit', SENT_AT)) == [
+        'fit', 'small', 'large']
+
+
+def test_lowest_rtt_excludes_offers_below_minimums():
+    assert hosts(rank(OFFERS[::-1], COS, 'rtt', SENT_AT)) == [
+        'small', 'large', 'fit']
+
+
+def test_equal_scores_keep_order_of_arrival():
+    same = [offer(str(i), 2, 200, 2, 0.001) for i in range(5)]
+    assert hosts(rank(same, COS, 'cpu', SENT_AT)) == hosts(same)
+
+
+def test_unknown_policy_falls_back_to_first():
+    assert hosts(rank(OFFERS[::-1], COS, 'unknown', SENT_AT)) == [
+        'small', 'large', 'too small', 'fit']
+
+
+def test_registered_policy():
+    register_policy('most_disk', lambda cpu, ram, disk, rtt, cos: disk)
+    try:
+        assert hosts(rank(OFFERS, COS, 'most_disk', SENT_AT))[0] == 'large'
+    finally:
+        del policies['most_disk']
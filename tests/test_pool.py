@@ -0,0 +1,116 @@
+from threading import Event
+from time import time, sleep
+
+from . import context
+from model import CoS, CoSSpecs
+from pool import ExecutionPool, Job
+
+
+URGENT = CoS(1, 'urgent', CoSSpecs(max_response_time=0.1))
+BEST_EFFORT = CoS(2, 'best_effort')
+
+
+def blocked(pool: ExecutionPool):
+    # occupies the (single) worker until the returned event is set
+    release = Event()
+    started = Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    assert pool.submit(Job(block))
+    assert started.wait(5)
+    return release
+
+
+def wait_done(pool: ExecutionPool, n: int):
+    for _ in range(500):
+        if pool.stats['done'] + pool.stats['expired'] >= n:
+            return
+        sleep(0.01)
+    raise AssertionError('jobs not done')
+
+
+def test_queue_is_bounded():
+    pool = ExecutionPool(1, 2)
+    release = blocked(pool)
+    assert pool.submit(Job(lambda: None))
+    assert pool.submit(Job(lambda: None))
+    assert pool.full()
+    assert not pool.submit(Job(lambda: None))
+    assert pool.stats['rejected'] == 1
+    release.set()
+    wait_done(pool, 3)
+    assert pool.depth() == 0
+
+
+def test_lower_response_time_first_then_earliest_deadline():
+    pool = ExecutionPool(1, 8)
+    order = []
+    release = blocked(pool)
+    now = time()
+    pool.submit(Job(order.append, 'best effort', cos=BEST_EFFORT))
+    pool.submit(Job(order.append, 'urgent late', cos=URGENT,
+                    deadline=now + 20))
+    pool.submit(Job(order.append, 'urgent early', cos=URGENT,
+                    deadline=now + 10))
+    release.set()
+    wait_done(pool, 4)
+    assert order == ['urgent early', 'urgent late', 'best effort']
+
+
+def test_starved_job_is_started_first():
+    pool = ExecutionPool(1, 8, max_wait=0.05)
+    order = []
+    release = blocked(pool)
+    pool.submit(Job(order.append, 'best effort', cos=BEST_EFFORT))
+    sleep(0.1)
+    pool.submit(Job(order.append, 'urgent', cos=URGENT))
+    release.set()
+    wait_done(pool, 3)
+    assert order == ['best effort', 'urgent']
+    assert pool.stats['aged'] == 1
+
+
+def test_expired_job_calls_on_expire_and_is_not_waited():
+    pool = ExecutionPool(1, 8)
+    ran = []
+    expired = []
+    release = blocked(pool)
+    pool.submit(Job(ran.append, 'expired', deadline=time() + 0.01,
+                    on_expire=expired.append))
+    pool.submit(Job(ran.append, 'run'))
+    sleep(0.05)
+    release.set()
+    wait_done(pool, 3)
+    assert ran == ['run']
+    assert expired == ['expired']
+    assert pool.stats['expired'] == 1
+    # (only the blocking job and the one run are counted in the mean)
+    assert pool.stats['started'] == 2
+    assert pool.mean_wait() == pool.stats['wait'] / 2
+
+
+def test_cancelled_job_is_not_started():
+    pool = ExecutionPool(1, 8)
+    ran = []
+    release = blocked(pool)
+    job = Job(ran.append, 'cancelled')
+    pool.submit(job)
+    assert pool.cancel(job)
+    assert pool.depth() == 0
+    pool.submit(Job(ran.append, 'run'))
+    release.set()
+    wait_done(pool, 2)
+    assert ran == ['run']
+    assert not pool.cancel(job)
+
+
+def test_report():
+    pool = ExecutionPool(1, 8)
+    pool.submit(Job(lambda: None, cos=URGENT))
+    wait_done(pool, 1)
+    report = pool.report()
+    assert report['done'] == 1 and report['depth'] == 0
+    assert len(report['percentiles'][URGENT.id]) == 3
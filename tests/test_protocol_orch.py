@@ -0,0 +1,79 @@
+from asyncio import wait_for
+from time import time
+
+import pytest
+
+from . import context
+from codec import Message
+from consts import DREQ, DRES, DWAIT, DACK
+
+import protocol_orch as orch
+
+
+CONSUMER_IP = '10.0.0.1'
+HOST_IP = '10.0.0.2'
+HOST_MAC = '00:00:00:00:00:02'
+
+
+@pytest.fixture
+def network(monkeypatch):
+    # loopback of the consumer, the host and the orchestrator through the
+    # (single) engine, driven on its loop without opening its sockets
+    engine = orch.engine
+    loop = engine._loop
+    sent = []
+    provider = {}
+    am = orch.MyProtocolAM(verbose=0)
+
+    def receive(msg, src):
+        loop.call_soon(engine.dispatch,
+                       Message(state=msg.state, req_id=msg.req_id,
+                               attempt_no=msg.attempt_no, data=msg.data,
+                               src=src, timestamp=time()))
+
+    def send(msg, dst, dst_mac=None):
+        sent.append((msg.state, msg.attempt_no, dst))
+        if msg.state == DREQ:
+            # the host queues the execution, and sends its result later
+            receive(Message(state=DWAIT, req_id=msg.req_id,
+                            attempt_no=msg.attempt_no), HOST_IP)
+            _req = orch.Request_(msg.req_id)
+            _req._freed = False
+            dres = Message(state=DRES, req_id=msg.req_id,
+                           attempt_no=msg.attempt_no, data=b'result')
+            loop.call_later(0.05, lambda: provider.setdefault(
+                'task', loop.create_task(
+                    am._send_result(dres, CONSUMER_IP, _req))))
+            provider['req'] = _req
+        elif msg.state == DRES:
+            receive(msg, HOST_IP)
+        elif msg.state == DACK:
+            # relayed by the orchestrator to the host
+            receive(msg, orch.ORCH_IP)
+
+    monkeypatch.setattr(engine, 'send', send)
+    monkeypatch.setattr(orch.requests_, 'schedule', None)
+    monkeypatch.setattr(orch.finished, 'schedule', None)
+    return loop, sent, provider
+
+
+def test_result_of_second_attempt_is_acknowledged(network):
+    loop, sent, provider = network
+    req = orch.Request(orch.gen_req_id(), orch.cos_dict[1], b'input')
+    req.new_attempt()
+    attempt = req.new_attempt()
+    assert attempt.attempt_no == 2
+    req.host = attempt.host = HOST_IP
+
+    async def run():
+        received = await wait_for(
+            orch._exchange_data(req, attempt, b'input', HOST_MAC), 10)
+        await wait_for(provider['task'], 10)
+        return received
+
+    assert loop.run_until_complete(run())
+    assert req.result == b'result'
+    assert (DACK, 2, orch.ORCH_IP) in sent
+    # acknowledged on the first try, so neither sent again nor freed
+    assert [s for s in sent if s[0] == DRES] == [(DRES, 2, CONSUMER_IP)]
+    assert not provider['req']._freed
@@ -0,0 +1,61 @@
+from . import context
+from replies import ReplyCache
+
+
+OWNER = ('10.0.0.1', 'req')
+OTHER = ('10.0.0.1', 'other')
+
+
+def key(owner, attempt_no, state=7):
+    return (*owner, attempt_no, state)
+
+
+def test_cached_reply_answers_duplicate():
+    cache = ReplyCache(8)
+    assert cache.get(key(OWNER, 1)) is None
+    cache.put(key(OWNER, 1), b'dwait', '10.0.0.1', OWNER)
+    assert cache.get(key(OWNER, 1)) == (b'dwait', '10.0.0.1')
+    assert cache.stats['hits'] == 1
+
+
+def test_update_and_discard_only_touch_their_attempt():
+    cache = ReplyCache(8)
+    cache.put(key(OWNER, 1), b'dwait 1', '10.0.0.1', OWNER)
+    cache.put(key(OWNER, 2), b'dwait 2', '10.0.0.1', OWNER)
+    cache.update(OWNER, 2, b'dres 2')
+    assert cache.get(key(OWNER, 1)) == (b'dwait 1', '10.0.0.1')
+    assert cache.get(key(OWNER, 2)) == (b'dres 2', '10.0.0.1')
+    cache.discard(OWNER, 1)
+    assert key(OWNER, 1) not in cache
+    assert key(OWNER, 2) in cache
+
+
+def test_drop_removes_all_replies_of_owner():
+    cache = ReplyCache(8)
+    cache.put(key(OWNER, 1, 3), b'rres', '10.0.0.1', OWNER)
+    cache.put(key(OWNER, 1, 7), b'dwait', '10.0.0.1', OWNER)
+    cache.put(key(OTHER, 1), b'dwait', '10.0.0.1', OTHER)
+    cache.drop(OWNER)
+    assert key(OWNER, 1, 3) not in cache and key(OWNER, 1, 7) not in cache
+    assert key(OTHER, 1) in cache
+    assert cache.stats['dropped'] == 2
+    # (unknown owner)
+    cache.drop(OWNER)
+
+
+def test_oldest_replies_are_evicted():
+    cache = ReplyCache(2)
+    for attempt_no in (1, 2, 3):
+        cache.put(key(OWNER, attempt_no), b'reply', '10.0.0.1', OWNER)
+    assert key(OWNER, 1) not in cache
+    assert key(OWNER, 3) in cache
+    assert cache.stats['evictions'] == 1
+    # (evicted replies are no longer dropped with their owner)
+    cache.drop(OWNER)
+    assert cache.stats['dropped'] == 2
+
+
+def test_disabled_cache_stores_nothing():
+    cache = ReplyCache(0)
+    cache.put(key(OWNER, 1), b'reply', '10.0.0.1', OWNER)
+    assert key(OWNER, 1) not in cache
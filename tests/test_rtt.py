@@ -0,0 +1,47 @@
+from pytest import approx
+
+from . import context
+from rtt import RttEstimator
+
+
+def test_peer_without_samples_uses_initial_timeout():
+    rtt = RttEstimator(1, 4, jitter=0)
+    assert rtt.srtt('10.0.0.1') is None
+    assert rtt.timeout('10.0.0.1') == 1
+
+
+def test_first_sample():
+    # SRTT = R, RTTVAR = R / 2, so RTO = R + 4 * R / 2 = 3R
+    rtt = RttEstimator(1, 4, jitter=0)
+    rtt.sample('10.0.0.1', 0.1)
+    assert rtt.srtt('10.0.0.1') == approx(0.1)
+    assert rtt.timeout('10.0.0.1') == approx(0.3)
+
+
+def test_next_samples_are_smoothed():
+    rtt = RttEstimator(1, 4, jitter=0)
+    rtt.sample('10.0.0.1', 0.1)
+    rtt.sample('10.0.0.1', 0.2)
+    # RTTVAR = 3/4 * 0.05 + 1/4 * |0.1 - 0.2|, SRTT = 7/8 * 0.1 + 1/8 * 0.2
+    assert rtt.srtt('10.0.0.1') == approx(0.1125)
+    assert rtt.timeout('10.0.0.1') == approx(0.1125 + 4 * 0.0625)
+    # (per peer)
+    assert rtt.srtt('10.0.0.2') is None
+
+
+def test_backoff_doubles_up_to_upper_bound():
+    rtt = RttEstimator(1, 1, jitter=0)
+    rtt.sample('10.0.0.1', 0.1)
+    assert [rtt.timeout('10.0.0.1', retry) for retry in range(3)] == approx(
+        [0.3, 0.6, 1])
+
+
+def test_bounds_and_jitter():
+    rtt = RttEstimator(1, 4, lower=0.05, jitter=0.5)
+    rtt.sample('10.0.0.1', 0.001)
+    for _ in range(100):
+        assert rtt.timeout('10.0.0.1') == 0.05
+        assert 2 <= rtt.timeout('10.0.0.2', 2) <= 4
+    # (negative samples are ignored)
+    rtt.sample('10.0.0.2', -1)
+    assert rtt.srtt('10.0.0.2') is None
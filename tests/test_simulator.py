@@ -0,0 +1,92 @@
+from time import sleep
+
+import pytest
+
+from . import context
+from model import CoS, CoSSpecs, Request
+from resources import simulator
+from resources.simulator import (get_resources, check_resources,
+                                 reserve_resources, free_resources,
+                                 renew_lease, reconcile, lease_stats, CPU,
+                                 RAM)
+
+
+# (simulated host of tests/context.py: 4 CPUs, 4096MB of RAM, no
+# threshold)
+COS = CoS(1, 'cos', CoSSpecs(min_cpu=1, min_ram=512, min_disk=1,
+                             min_bandwidth=1))
+
+
+@pytest.fixture
+def leases():
+    # keys reserved by the test (freed after it)
+    keys = []
+    yield keys
+    for key in keys:
+        free_resources(Request(key[1], COS, b''), key)
+    assert not reconcile()['drift']
+
+
+def reserve(leases, n: int):
+    key = ('10.0.0.1', 'req%d' % n)
+    leases.append(key)
+    return reserve_resources(Request(key[1], COS, b''), key), key
+
+
+def test_reserve_until_resources_are_exhausted(leases):
+    for n in range(int(CPU)):
+        assert reserve(leases, n)[0]
+    assert get_resources(quiet=True)[0] == 0
+    req = Request('other', COS, b'')
+    assert not check_resources(req, quiet=True)
+    assert not reserve(leases, CPU)[0]
+    report = reconcile()
+    assert report['leases'] == CPU and not report['drift']
+    assert report['leased']['ram'] == CPU * 512
+
+
+def test_free_releases_once(leases):
+    _, key = reserve(leases, 0)
+    req = Request(key[1], COS, b'')
+    assert get_resources(quiet=True)[1] == RAM - 512
+    assert free_resources(req, key)
+    assert not free_resources(req, key)
+    assert get_resources(quiet=True)[1] == RAM
+
+
+def test_reserving_again_only_renews(leases):
+    assert reserve(leases, 0)[0]
+    assert reserve(leases, 0)[0]
+    assert reconcile()['leases'] == 1
+    assert get_resources(quiet=True)[0] == CPU - 1
+
+
+def test_lease_expires_unless_renewed(leases):
+    reclaimed = lease_stats['reclaimed']
+    _, expiring = reserve(leases, 0)
+    _, renewed = reserve(leases, 1)
+    renew_lease(expiring, 0.05)
+    renew_lease(renewed, 0.05)
+    renew_lease(renewed)
+    sleep(0.3)
+    assert lease_stats['reclaimed'] == reclaimed + 1
+    assert not renew_lease(expiring)
+    assert renew_lease(renewed)
+    assert reconcile()['leases'] == 1
+    assert get_resources(quiet=True)[0] == CPU - 1
+
+
+def test_reconcile_reports_drift_and_fixes_it_on_demand(leases):
+    reserve(leases, 0)
+    with simulator._reserved_lock:
+        simulator._reserved['cpu'] += 0.5
+    try:
+        report = reconcile()
+        assert report['drift']
+        assert report['reserved']['cpu'] == report['leased']['cpu'] + 0.5
+        # (only reported by default)
+        assert reconcile()['drift']
+    finally:
+        reconcile(fix=True)
+    assert not reconcile()['drift']
+    assert get_resources(quiet=True)[0] == CPU - 1
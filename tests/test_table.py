@@ -0,0 +1,105 @@
+import pytest
+
+from . import context
+import table
+from table import StateTable, ShardedTable
+
+
+class Entry:
+    def __init__(self, freed=True):
+        self._freed = freed
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # monotonic clock of the tables, moved by the test
+    now = [0.0]
+    monkeypatch.setattr(table, 'monotonic', lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def timers():
+    # expiry timers scheduled by the tables, fired by the test
+    return []
+
+
+def fire(timers, now):
+    for timer in [t for t in timers if t[0] <= now]:
+        timers.remove(timer)
+        timer[1](*timer[2])
+
+
+def schedule(timers, clock):
+    return lambda delay, callback, *args: timers.append(
+        (clock[0] + delay, callback, args))
+
+
+def test_entry_expires_ttl_after_last_access(clock, timers):
+    evicted = []
+    states = StateTable(10, on_evict=lambda k, v: evicted.append(k),
+                        schedule=schedule(timers, clock))
+    states['a'] = Entry()
+    clock[0] = 8
+    assert states.get('a')
+    # (timer fires at 10, but the entry was accessed since)
+    clock[0] = 10
+    fire(timers, clock[0])
+    assert 'a' in states
+    clock[0] = 18
+    fire(timers, clock[0])
+    assert 'a' not in states
+    assert evicted == ['a']
+    assert states.stats['evicted'] == 1
+
+
+def test_entry_holding_resources_is_not_evicted(clock, timers):
+    states = StateTable(10, schedule=schedule(timers, clock))
+    entry = Entry(freed=False)
+    states['a'] = entry
+    clock[0] = 10
+    fire(timers, clock[0])
+    assert 'a' in states
+    assert states.stats['deferred'] == 1
+    entry._freed = True
+    clock[0] = 20
+    fire(timers, clock[0])
+    assert 'a' not in states
+
+
+def test_expire_without_schedule(clock):
+    states = StateTable(10)
+    states['a'] = Entry()
+    states['b'] = Entry()
+    clock[0] = 5
+    states.get('b')
+    clock[0] = 12
+    states.expire()
+    assert 'a' not in states and 'b' in states
+
+
+def test_full_table_evicts_closest_to_deadline(clock):
+    states = StateTable(10, size=2)
+    states['a'] = Entry(freed=False)
+    clock[0] = 1
+    states['b'] = Entry()
+    clock[0] = 2
+    states['c'] = Entry()
+    assert set(states) == {'a', 'c'}
+    assert states.stats['overflows'] == 1
+
+
+def test_sharded_table_expires_every_shard(clock, timers):
+    evicted = []
+    states = ShardedTable(10, shards=4)
+    states.on_evict = lambda k, v: evicted.append(k)
+    states.schedule = schedule(timers, clock)
+    keys = [('10.0.0.1', 'req%d' % i) for i in range(16)]
+    for key in keys:
+        states[key] = Entry()
+    assert len(states) == 16
+    clock[0] = 10
+    fire(timers, clock[0])
+    assert len(states) == 0
+    assert sorted(evicted) == sorted(keys)
+    assert states.stats['evicted'] == 16
@@ -0,0 +1,69 @@
+from . import context
+from timers import TimerWheel
+
+
+class Clock:
+    # clock of the wheel, moved by the test
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_timers_fire_in_order_of_delay():
+    clock = Clock()
+    wheel = TimerWheel(tick=0.001, slots=8, levels=3, clock=clock)
+    fired = []
+    # (beyond the first level, and beyond all levels)
+    for delay in (0.3, 0.005, 0.05, 0.001, 0.6):
+        wheel.schedule(delay, fired.append, delay)
+    assert len(wheel) == 5
+    for step in range(1, 701):
+        clock.now = step * 0.001
+        wheel.advance()
+        # never fired before its tick
+        assert all(delay <= clock.now + 1e-9 for delay in fired)
+    assert fired == [0.001, 0.005, 0.05, 0.3, 0.6]
+    assert len(wheel) == 0
+    assert wheel.next_expiry() is None
+
+
+def test_timers_due_together_fire_in_one_advance():
+    clock = Clock()
+    wheel = TimerWheel(tick=0.001, slots=8, levels=3, clock=clock)
+    fired = []
+    for delay in (0.002, 0.02, 0.1):
+        wheel.schedule(delay, fired.append, delay)
+    clock.now = 1.0
+    assert wheel.advance() == 3
+    assert fired == [0.002, 0.02, 0.1]
+
+
+def test_cancelled_timer_does_not_fire():
+    clock = Clock()
+    wheel = TimerWheel(tick=0.001, slots=8, levels=3, clock=clock)
+    fired = []
+    kept = wheel.schedule(0.01, fired.append, 'kept')
+    cancelled = wheel.schedule(0.01, fired.append, 'cancelled')
+    # (cancelled while in a higher level, so dropped when cascaded)
+    far = wheel.schedule(0.2, fired.append, 'far')
+    cancelled.cancel()
+    far.cancel()
+    clock.now = 0.5
+    assert wheel.advance() == 1
+    assert fired == ['kept']
+    assert not kept.cancelled
+    assert wheel.stats['cancelled'] == 2
+    assert len(wheel) == 0
+
+
+def test_failing_callback_does_not_stop_others():
+    clock = Clock()
+    wheel = TimerWheel(tick=0.001, clock=clock)
+    fired = []
+    wheel.schedule(0.001, lambda: 1 / 0)
+    wheel.schedule(0.001, fired.append, 'after')
+    clock.now = 0.01
+    wheel.advance()
+    assert fired == ['after']